@@ -37,6 +37,8 @@ import psycopg2
 import psycopg2.extras
 from psycopg2 import sql
 
+import table_meta
+
 API_BASE = os.getenv('AUVO_API_BASE', 'https://api.auvo.com.br/v2')
 API_KEY = os.getenv('AUVO_API_KEY')
 API_TOKEN = os.getenv('AUVO_API_TOKEN')
@@ -51,6 +53,7 @@ PG_PORT = os.getenv('PGPORT') or os.getenv('AUVO_PG_PORT', '5432')
 PG_DB = os.getenv('PGDATABASE') or os.getenv('AUVO_PG_DB')
 PG_USER = os.getenv('PGUSER') or os.getenv('AUVO_PG_USER')
 PG_PASSWORD = os.getenv('PGPASSWORD') or os.getenv('AUVO_PG_PASSWORD')
+PG_SCHEMA = 'auvo'
 
 
 def get_auth_token():
@@ -329,9 +332,8 @@ def upsert(conn, table, item):
     cur = conn.cursor()
     norm = extract_normalized(table, item)
 
-    # Get table column info for current search_path/schema
-    cur.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %s", (table,))
-    cols_info = {r[0]: r[1] for r in cur.fetchall()}
+    # Table column info (cached per process, see table_meta)
+    cols_info = table_meta.columns(conn, PG_SCHEMA, table)
 
     # Determine primary identifier strategy
     pk = get_pk_from_item(item)
@@ -489,7 +491,7 @@ def main():
         print(f"[DB] Connected but could not retrieve search_path: {e}")
 
     # Ensure project schema `auvo` exists and is used instead of `public`.
-    schema = 'auvo'
+    schema = PG_SCHEMA
     try:
         cur = conn.cursor()
         cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(schema)))
@@ -527,6 +529,8 @@ def main():
         print(f"[DB] Erro ao aplicar migrations locais: {e}")
 
     ensure_tables(conn)
+    # the migrations above may have added columns
+    table_meta.invalidate()
 
     for res in args.resources:
         print('Buscando', res)
@@ -80,6 +80,11 @@ CREATE INDEX IF NOT EXISTS idx_tasks_task_id ON tasks (task_id);
 CREATE INDEX IF NOT EXISTS idx_users_user_id ON users (user_id);
 CREATE INDEX IF NOT EXISTS idx_customers_customer_id ON customers (customer_id);
 
+-- keyset pagination of the web UI listings (ORDER BY fetched_at DESC, id DESC)
+CREATE INDEX IF NOT EXISTS idx_users_fetched_at_id ON users (fetched_at, id);
+CREATE INDEX IF NOT EXISTS idx_tasks_fetched_at_id ON tasks (fetched_at, id);
+CREATE INDEX IF NOT EXISTS idx_customers_fetched_at_id ON customers (fetched_at, id);
+
 COMMIT;
 
 -- Notes:
@@ -3,18 +3,27 @@
 
 Routes:
  - /        : links to resources
- - /db/<resource>?page=1&page_size=20 : paginated list
+ - /db/<resource>?page_size=20 : paginated list (Prev/Next use keyset tokens, ?exact=1 counts rows)
  - /db/<resource>/<id> : full JSON view
+ - /api/pool : connection pool utilization
 
 Run: set DB env vars (or use .env) and run `python web_ui.py` or `FLASK_APP=web_ui.py flask run`.
 """
-from flask import Flask, request, abort
+from flask import Flask, g, request, abort
+import base64
 import os
 import json
+import math
+import threading
+import time
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+from datetime import date, datetime
 from html import escape
 
+import table_meta
+
 API_RESOURCES = ['users', 'tasks', 'customers']
 
 # DB config (support both generic PG_* and AUVO-prefixed env vars)
@@ -24,40 +33,98 @@ PG_PORT = os.getenv('PGPORT') or os.getenv('AUVO_PG_PORT', '5432')
 PG_DB = os.getenv('PGDATABASE') or os.getenv('AUVO_PG_DB')
 PG_USER = os.getenv('PGUSER') or os.getenv('AUVO_PG_USER')
 PG_PASSWORD = os.getenv('PGPASSWORD') or os.getenv('AUVO_PG_PASSWORD')
+PG_SCHEMA = os.getenv('AUVO_PG_SCHEMA', 'auvo')
 
 
-def pg_connect():
-    """Connect to Postgres using PG_DSN or individual PG_* env vars."""
-    if PG_DSN:
-        return psycopg2.connect(PG_DSN)
-    # Require DB env values when DSN isn't provided — let psycopg2 raise if missing
-    return psycopg2.connect(host=PG_HOST, port=PG_PORT, dbname=PG_DB, user=PG_USER, password=PG_PASSWORD)
+# Connection pool of the web UI: up to POOL_MAX connections, POOL_MIN of them
+# kept open while idle; a request waits up to POOL_TIMEOUT seconds for a free
+# one (then 503).
+POOL_MIN = int(os.getenv('AUVO_WEB_POOL_MIN', '2'))
+POOL_MAX = int(os.getenv('AUVO_WEB_POOL_MAX', '10'))
+POOL_TIMEOUT = float(os.getenv('AUVO_WEB_POOL_TIMEOUT', '10'))
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_MAX)
+_pool_stats = {'checkouts': 0, 'timeouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
 
 
-def pg_connect_with_schema():
-    """Return a connection and set the search_path to AUVO_PG_SCHEMA (default 'auvo').
+def get_pool():
+    """Process-wide pool, created on first use.
 
-    This lets the web UI query unqualified table names (users, tasks, customers)
+    Connections start with search_path = AUVO_PG_SCHEMA (default 'auvo'), public,
+    so the web UI can query unqualified table names (users, tasks, customers)
     that live in the `auvo` schema created by the sync scripts.
     """
-    conn = pg_connect()
-    schema = os.getenv('AUVO_PG_SCHEMA', 'auvo')
-    if schema:
-        try:
-            cur = conn.cursor()
-            cur.execute(f"SET search_path TO {schema}, public")
-            conn.commit()
-        except Exception:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                options = f"-c search_path={PG_SCHEMA},public" if PG_SCHEMA else None
+                if PG_DSN:
+                    _pool = psycopg2.pool.ThreadedConnectionPool(POOL_MIN, POOL_MAX, PG_DSN, options=options)
+                else:
+                    _pool = psycopg2.pool.ThreadedConnectionPool(POOL_MIN, POOL_MAX, host=PG_HOST, port=PG_PORT, dbname=PG_DB,
+                                                                 user=PG_USER, password=PG_PASSWORD, options=options)
+    return _pool
+
+
+def pg_connect_with_schema():
+    """Pooled connection of the current request; returned to the pool at teardown."""
+    if 'db_conn' in g:
+        return g.db_conn
+    pool = get_pool()
+    started = time.monotonic()
+    if not _pool_slots.acquire(timeout=POOL_TIMEOUT):
+        with _pool_lock:
+            _pool_stats['timeouts'] += 1
+        abort(503, description='database pool exhausted')
+    waited = time.monotonic() - started
+    try:
+        conn = pool.getconn()
+        if conn.closed:
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+    except Exception:
+        _pool_slots.release()
+        raise
+    with _pool_lock:
+        _pool_stats['checkouts'] += 1
+        _pool_stats['wait_seconds'] += waited
+        _pool_stats['max_wait_seconds'] = max(_pool_stats['max_wait_seconds'], waited)
+    g.db_conn = conn
     return conn
 
 
+def pool_stats():
+    """Pool size and utilization counters since start."""
+    with _pool_lock:
+        out = dict(_pool_stats)
+    out.update({'min': POOL_MIN, 'max': POOL_MAX,
+                'in_use': len(_pool._used) if _pool else 0, 'idle': len(_pool._pool) if _pool else 0})
+    out['wait_seconds'] = round(out['wait_seconds'], 3)
+    out['max_wait_seconds'] = round(out['max_wait_seconds'], 3)
+    return out
+
+
 app = Flask(__name__)
 
 
+@app.teardown_appcontext
+def release_connection(exc):
+    # the pool rolls back an open transaction and discards broken connections
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        try:
+            get_pool().putconn(conn, close=bool(conn.closed))
+        finally:
+            _pool_slots.release()
+
+
+@app.route('/api/pool')
+def api_pool():
+    return pool_stats()
+
+
 @app.route('/')
 def index():
     links = ''.join([f"<li><a href='/db/{r}'>{r}</a></li>" for r in API_RESOURCES])
@@ -68,26 +135,104 @@ def index():
         <h2>Auvo DB Viewer</h2>
         <p>Recursos disponíveis:</p>
         <ul>{links}</ul>
-        <p>Use <code>?page=1&page_size=20</code> nos links para paginação.</p>
+        <p>Use <code>?page_size=20</code> nos links; a navegação usa os links Prev/Next.</p>
       </body>
     </html>
     """
     return html
 
 
+def encode_page_token(row, keys):
+    """Opaque token with the listing key of `row`."""
+    values = [v.isoformat() if isinstance(v, (datetime, date)) else v for v in (row.get(k) for k in keys)]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+# token values are bound against the key columns; these bounds keep a forged
+# token from turning into a Postgres error (500) instead of a 400
+_INT_BOUNDS = {'smallint': 2 ** 15, 'integer': 2 ** 31, 'bigint': 2 ** 63}
+
+
+def _token_value_ok(value, typ):
+    """Whether a decoded token value fits a column of type `typ` (as format_type prints it)."""
+    if isinstance(value, bool):
+        return False
+    if typ in _INT_BOUNDS:
+        return isinstance(value, int) and -_INT_BOUNDS[typ] <= value < _INT_BOUNDS[typ]
+    if typ.startswith(('timestamp', 'date')):
+        try:
+            datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return False
+        return True
+    if typ in ('double precision', 'real') or typ.startswith('numeric'):
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    return isinstance(value, str)
+
+
+def decode_page_token(token, keys, types):
+    """Key values of a token from encode_page_token, or None when it is not
+    valid: malformed, or a value of the wrong type for its column in `types`
+    ({column: type}). Only the last key is never NULL."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except Exception:
+        return None
+    if not isinstance(values, list) or len(values) != len(keys):
+        return None
+    for i, (k, v) in enumerate(zip(keys, values)):
+        if v is None and i < len(keys) - 1:
+            continue
+        if v is None or not _token_value_ok(v, types.get(k, 'text')):
+            return None
+    return values
+
+
+def keyset_clause(keys, values, forward):
+    """Condition for the rows after (`forward`) or before `values` in the
+    order `keys` DESC (NULLs of the first key come first). Column names come
+    from the catalog, values are bound parameters."""
+    op = '<' if forward else '>'
+    if len(keys) == 1:
+        return f"{keys[0]} {op} %s", list(values)
+    first, last = keys
+    value, key = values
+    if value is None:
+        if forward:
+            return f"({first} IS NOT NULL OR {last} < %s)", [key]
+        return f"({first} IS NULL AND {last} > %s)", [key]
+    if forward:
+        return f"({first}, {last}) < (%s, %s)", [value, key]
+    return f"(({first}, {last}) > (%s, %s) OR {first} IS NULL)", [value, key]
+
+
+def estimate_rows(cur, table, exact=False):
+    """(rows, exact): planner estimate from pg_class.reltuples, or count(*)
+    when `exact` or the table was never analyzed."""
+    if not exact:
+        # leaf partitions of a partitioned table, or the plain table itself
+        cur.execute("""SELECT sum(greatest(c.reltuples, 0))::bigint AS n, bool_or(c.reltuples < 0) AS unknown
+                         FROM pg_class c
+                        WHERE c.oid IN (SELECT relid FROM pg_partition_tree(to_regclass(%(t)s)) WHERE isleaf)
+                           OR (c.oid = to_regclass(%(t)s) AND c.relkind = 'r')""", {'t': table})
+        row = cur.fetchone()
+        if row and row['n'] is not None and not row['unknown']:
+            return row['n'], False
+    cur.execute(f"SELECT COUNT(*) as cnt FROM {table}")
+    return cur.fetchone()['cnt'], True
+
+
 @app.route('/db/<resource>')
 def list_resource(resource):
+    """Paginated list, newest first, with keyset pagination (?after= / ?before=
+    tokens from the Next/Prev links) and an estimated total (?exact=1 counts)."""
     if resource not in API_RESOURCES:
         abort(404)
-    try:
-        page = max(1, int(request.args.get('page', '1')))
-    except ValueError:
-        page = 1
     try:
         page_size = min(200, max(1, int(request.args.get('page_size', '20'))))
     except ValueError:
         page_size = 20
-    offset = (page - 1) * page_size
+    exact = request.args.get('exact') == '1'
 
     conn = pg_connect_with_schema()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
@@ -101,10 +246,10 @@ def list_resource(resource):
 
     # discover columns for this table
     try:
-        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (resource,))
-        db_cols = {r['column_name'] for r in cur.fetchall()}
+        db_cols = table_meta.columns(conn, PG_SCHEMA, resource)
     except Exception:
-        db_cols = set()
+        conn.rollback()
+        db_cols = {}
 
     # build the list of columns to SELECT
     cols = ['id']
@@ -126,16 +271,33 @@ def list_resource(resource):
     # always include `data` as preview
     cols.append('data')
 
+    # keyset on (timestamp, id): id breaks ties between rows fetched together
+    keys = (ts_col, 'id') if ts_col else ('id',)
+    token = request.args.get('after') or request.args.get('before')
+    forward = not request.args.get('before')
+    values = decode_page_token(token, keys, db_cols) if token else None
+    if token and values is None:
+        return {'error': 'invalid page token'}, 400
+    where, params = keyset_clause(keys, values, forward) if values else ('TRUE', [])
+    direction = 'DESC' if forward else 'ASC'
+    order_by = ', '.join(f"{k} {direction}" for k in keys)
+
     select_sql = ', '.join(cols)
-    order_by = ts_col or 'id'
-    cur.execute(f"SELECT {select_sql} FROM {resource} ORDER BY {order_by} DESC LIMIT %s OFFSET %s", (page_size, offset))
+    # one extra row tells whether there is a further page
+    cur.execute(f"SELECT {select_sql} FROM {resource} WHERE {where} ORDER BY {order_by} LIMIT %s", params + [page_size + 1])
     rows = cur.fetchall()
-    cur.execute(f"SELECT COUNT(*) as cnt FROM {resource}")
-    total = cur.fetchone()['cnt']
-    conn.close()
-
-    prev_link = f"/db/{resource}?page={page-1}&page_size={page_size}" if page > 1 else ''
-    next_link = f"/db/{resource}?page={page+1}&page_size={page_size}" if offset + page_size < total else ''
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not forward:
+        rows.reverse()
+    total, total_exact = estimate_rows(cur, resource, exact)
+
+    base_link = f"/db/{resource}?page_size={page_size}" + ('&exact=1' if exact else '')
+    has_prev = (more if not forward else bool(values)) and rows
+    has_next = (more if forward else True) and rows
+    prev_link = f"{base_link}&before={encode_page_token(rows[0], keys)}" if has_prev else ''
+    next_link = f"{base_link}&after={encode_page_token(rows[-1], keys)}" if has_next else ''
+    total_html = f"{total}" if total_exact else f"~{total} (<a href='/db/{resource}?page_size={page_size}&exact=1'>exact</a>)"
 
     rows_html = []
     for r in rows:
@@ -153,13 +315,13 @@ def list_resource(resource):
     html = f"""
     <html>
       <head>
-        <title>{resource} — page {page}</title>
+        <title>{resource}</title>
         <style>table{{width:100%;border-collapse:collapse}}td,th{{border:1px solid #ddd;padding:8px;vertical-align:top}}</style>
       </head>
       <body>
-        <h2>{resource} (total: {total})</h2>
-        <p>Page {page} — Page size {page_size}</p>
-        <p>{f'<a href="{prev_link}">Prev</a>' if prev_link else ''} {f'<a href="{next_link}">Next</a>' if next_link else ''}</p>
+        <h2>{resource} (total: {total_html})</h2>
+        <p>Page size {page_size}</p>
+        <p><a href="/db/{resource}?page_size={page_size}">First</a> {f'<a href="{prev_link}">Prev</a>' if prev_link else ''} {f'<a href="{next_link}">Next</a>' if next_link else ''}</p>
         <table>
           <thead>
             <tr>
@@ -188,8 +350,7 @@ def show_resource(resource, row_id):
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
     # fetch existing normalized columns for this resource
-    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (resource,))
-    db_cols = {r['column_name'] for r in cur.fetchall()}
+    db_cols = set(table_meta.columns(conn, PG_SCHEMA, resource))
 
     # prefer the common normalized fields if present
     candidates = {
@@ -211,7 +372,6 @@ def show_resource(resource, row_id):
     select_cols_sql = ', '.join(select_cols)
     cur.execute(f"SELECT {select_cols_sql} FROM {resource} WHERE id = %s", (row_id,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         abort(404)
 
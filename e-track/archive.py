@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""Tiered archival of closed months of `positions` and `routes` to files.
+
+Each archived month becomes a directory with one compressed NDJSON file per
+plate (rows without placa go to `_.ndjson.*`, listed as `<null>` in the
+manifest) and a `manifest.json`:
+
+    ETRAC_ARCHIVE_DIR/positions/2025-01/ABC1D23.ndjson.zst
+    ETRAC_ARCHIVE_DIR/positions/2025-01/manifest.json
+    ETRAC_ARCHIVE_DIR/routes/2025-01/ABC1D23.ndjson.zst
+
+Files are zstd-compressed when the optional `zstandard` package is installed
+and gzip otherwise (ETRAC_ARCHIVE_COMPRESSION forces one). Lines are the rows
+serialized by Postgres (`row_to_json`), sorted by time within each plate;
+positions carry their resolved `raw` (raw_payloads in 'hashed' mode), so the
+files do not depend on the database.
+
+`export` reads a month in one REPEATABLE READ snapshot, writes the files to a
+temporary directory, reads them back and compares the line counts with the
+per-plate row counts of that snapshot before renaming the directory into
+place. Only then, with `--remove`, the source rows go away: `delete` (per
+plate, refusing when the count differs from the manifest), or `detach` /
+`drop` of the month partition when `positions` is partitioned (see
+partitions.py). The manifest records the removal, and `iter_positions` /
+`read_route` (used by web_ui) serve the archived months of a plate from then
+on.
+
+Usage:
+  python e-track/archive.py list [--verify]
+  python e-track/archive.py export [--table positions] [--month 2025-01 ...] [--remove delete|detach|drop]
+  python e-track/archive.py remove --table positions --month 2025-01 --mode delete
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from datetime import date, datetime
+
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+# settings below are read at import time: load the repository root .env first
+# (existing env vars win), as the other e-track scripts do
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env'), override=False)
+
+try:
+    import zstandard
+except ImportError:  # optional: gzip is used instead
+    zstandard = None
+
+try:
+    from .partitions import add_months, is_partitioned, list_partitions, month_start, partition_name
+    from . import table_meta
+except Exception:
+    from partitions import add_months, is_partitioned, list_partitions, month_start, partition_name
+    import table_meta
+
+logger = logging.getLogger('e-track.archive')
+
+SCHEMA = os.getenv('ETRAC_SCHEMA', 'e_track')
+ARCHIVE_DIR = os.getenv('ETRAC_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+# months kept in Postgres before the current one when no --month is given
+KEEP_MONTHS = int(os.getenv('ETRAC_ARCHIVE_KEEP_MONTHS', '6'))
+COMPRESSION = os.getenv('ETRAC_ARCHIVE_COMPRESSION', 'zstd' if zstandard else 'gzip')
+COMPRESSIONS = ('zstd', 'gzip')
+ZSTD_LEVEL = int(os.getenv('ETRAC_ARCHIVE_ZSTD_LEVEL', '10'))
+REMOVE_MODES = ('delete', 'detach', 'drop')
+MANIFEST = 'manifest.json'
+EXTENSIONS = {'zstd': '.ndjson.zst', 'gzip': '.ndjson.gz'}
+
+# table -> time column the months are cut on
+TABLES = {
+    'positions': 'data_transmissao',
+    'routes': 'rota_date',
+}
+
+
+# manifest key of the rows without placa (JSON has no null keys)
+NULL_PLATE = '<null>'
+
+
+def _plate_key(plate):
+    return NULL_PLATE if plate is None else plate
+
+
+def _month_key(month):
+    return f'{month.year:04d}-{month.month:02d}'
+
+
+def month_dir(table, month, base=None):
+    return os.path.join(base or ARCHIVE_DIR, table, _month_key(month))
+
+
+def _file_name(plate, used, compression):
+    """File name for a plate: unsafe characters replaced, made unique in the month."""
+    stem = re.sub(r'[^A-Za-z0-9_.-]', '_', plate or '') or '_'
+    name, n = stem, 1
+    while name.lower() in used:
+        n += 1
+        name = f'{stem}~{n}'
+    used.add(name.lower())
+    return name + EXTENSIONS[compression]
+
+
+def _open_write(path, compression):
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd compression needs the zstandard package (pip install zstandard)')
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(path, 'wb')), encoding='utf-8')
+    return gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+
+
+def _open_read(path):
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f'{path} is zstd-compressed; install the zstandard package to read it')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')), encoding='utf-8')
+    return gzip.open(path, 'rt', encoding='utf-8')
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _count_lines(path):
+    with _open_read(path) as fh:
+        return sum(1 for _ in fh)
+
+
+def load_manifest(table, month, base=None):
+    path = os.path.join(month_dir(table, month, base), MANIFEST)
+    try:
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(directory, manifest):
+    tmp = os.path.join(directory, MANIFEST + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(directory, MANIFEST))
+
+
+def archived_months(table, base=None):
+    """Months of `table` with a manifest, oldest first."""
+    root = os.path.join(base or ARCHIVE_DIR, table)
+    months = []
+    if os.path.isdir(root):
+        for name in os.listdir(root):
+            m = re.match(r'^(\d{4})-(\d{2})$', name)
+            if m and os.path.exists(os.path.join(root, name, MANIFEST)):
+                months.append(date(int(m.group(1)), int(m.group(2)), 1))
+    return sorted(months)
+
+
+def _month_bounds(table, month):
+    hi = add_months(month, 1)
+    if TABLES[table] == 'rota_date':
+        return month, hi
+    return datetime.combine(month, datetime.min.time()), datetime.combine(hi, datetime.min.time())
+
+
+def candidate_months(conn, table, keep_months=None):
+    """Months with rows in `table` before the last `keep_months` closed months."""
+    keep_months = KEEP_MONTHS if keep_months is None else keep_months
+    cutoff = add_months(month_start(date.today()), -max(keep_months, 0))
+    col = TABLES[table]
+    cur = conn.cursor()
+    cur.execute(sql.SQL('SELECT min({}) FROM {}').format(sql.Identifier(col), sql.Identifier(table)))
+    lo = cur.fetchone()[0]
+    conn.commit()
+    months = []
+    m = month_start(lo) if lo else cutoff
+    while m < cutoff:
+        months.append(m)
+        m = add_months(m, 1)
+    return months
+
+
+def _export_sql(cur, table):
+    """SELECT of (placa, JSON line) for [%s, %s) ordered by plate and time.
+
+    Columns come from table_meta, so new ones are archived too; a
+    raw_hash is replaced by its payload. row_to_json is several times cheaper
+    than to_jsonb for this.
+    """
+    columns = list(table_meta.columns(cur.connection, SCHEMA, table))
+    join = sql.SQL('')
+    select = [sql.SQL('t.{}').format(sql.Identifier(c)) for c in columns if c not in ('raw', 'raw_hash')]
+    if 'raw_hash' in columns:
+        join = sql.SQL('LEFT JOIN raw_payloads rp ON rp.hash = t.raw_hash')
+        select.append(sql.SQL('coalesce(t.raw, rp.payload) AS raw'))
+    elif 'raw' in columns:
+        select.append(sql.SQL('t.raw'))
+    col = sql.Identifier(TABLES[table])
+    return sql.SQL("""SELECT r.placa, row_to_json(r)::text FROM (
+                          SELECT {select} FROM {table} t {join} WHERE t.{col} >= %s AND t.{col} < %s
+                      ) r ORDER BY r.placa, r.{col}""").format(
+        select=sql.SQL(', ').join(select), table=sql.Identifier(table), join=join, col=col)
+
+
+def export_month(conn, table, month, compression=None, base=None):
+    """Write one closed month of `table` to files and verify them. Returns the
+    manifest, or None when the month has no rows or is archived already."""
+    compression = compression or COMPRESSION
+    if month >= month_start(date.today()):
+        raise ValueError(f'{_month_key(month)} is not closed yet')
+    final = month_dir(table, month, base)
+    if os.path.exists(os.path.join(final, MANIFEST)):
+        logger.warning('%s %s is archived already; skipping', table, _month_key(month))
+        return None
+    col = TABLES[table]
+    lo, hi = _month_bounds(table, month)
+    started = time.monotonic()
+    cur = conn.cursor()
+    try:
+        # counts and rows come from the same snapshot
+        cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        cur.execute(sql.SQL('SELECT placa, count(*) FROM {} WHERE {} >= %s AND {} < %s GROUP BY placa').format(
+            sql.Identifier(table), sql.Identifier(col), sql.Identifier(col)), (lo, hi))
+        expected = {_plate_key(plate): n for plate, n in cur.fetchall()}
+        if not expected:
+            conn.commit()
+            return None
+        tmp = final + f'.tmp-{os.getpid()}'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        plates, used = {}, set()
+        out, current = None, object()
+        stream = conn.cursor(name=f'archive_{table}')
+        stream.itersize = 5000
+        stream.execute(_export_sql(cur, table), (lo, hi))
+        try:
+            for plate, line in stream:
+                plate = _plate_key(plate)
+                if plate != current:
+                    if out:
+                        out.close()
+                    current = plate
+                    name = _file_name(None if plate == NULL_PLATE else plate, used, compression)
+                    plates[plate] = {'file': name, 'rows': 0}
+                    out = _open_write(os.path.join(tmp, name), compression)
+                out.write(line)
+                out.write('\n')
+                plates[plate]['rows'] += 1
+        finally:
+            if out:
+                out.close()
+        stream.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    # read every file back before anything else relies on it
+    for plate, entry in plates.items():
+        path = os.path.join(tmp, entry['file'])
+        lines = _count_lines(path)
+        if lines != expected.get(plate) or lines != entry['rows']:
+            raise RuntimeError(f'{table} {_month_key(month)} {plate}: {lines} lines archived, {expected.get(plate)} rows in Postgres')
+        entry['bytes'] = os.path.getsize(path)
+        entry['sha256'] = _sha256(path)
+    missing = set(expected) - set(plates)
+    if missing:
+        raise RuntimeError(f'{table} {_month_key(month)}: plates not exported: {", ".join(sorted(map(str, missing)))}')
+    manifest = {
+        'table': table,
+        'month': _month_key(month),
+        'compression': compression,
+        'rows': sum(e['rows'] for e in plates.values()),
+        'bytes': sum(e['bytes'] for e in plates.values()),
+        'plates': plates,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'removed': None,
+    }
+    _write_manifest(tmp, manifest)
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    if os.path.isdir(final):
+        shutil.rmtree(final)  # leftover without manifest from an interrupted run
+    os.rename(tmp, final)
+    logger.info('Archived %s %s: %d rows of %d plates, %.1f MiB in %.1fs', table, manifest['month'], manifest['rows'],
+                len(plates), manifest['bytes'] / 1048576, time.monotonic() - started)
+    return manifest
+
+
+def remove_month(conn, table, month, mode, base=None):
+    """Remove the archived rows of `month` from Postgres. Returns the rows removed.
+
+    `detach` / `drop` need `positions` to be partitioned with a partition for
+    the month; otherwise the rows are deleted plate by plate, each delete
+    rolled back when it does not match the manifest count.
+    """
+    manifest = load_manifest(table, month, base)
+    if not manifest:
+        raise RuntimeError(f'{table} {_month_key(month)} has no archive; export it first')
+    directory = month_dir(table, month, base)
+    if mode in ('detach', 'drop'):
+        name = partition_name(month)
+        if table != 'positions' or not is_partitioned(conn) or name not in {n for n, _, _ in list_partitions(conn)}:
+            logger.warning('%s %s has no partition to %s; deleting the rows instead', table, _month_key(month), mode)
+            mode = 'delete'
+    # mark first: readers merge the archive from now on (and skip rows still in Postgres)
+    manifest['removed'] = mode
+    _write_manifest(directory, manifest)
+    cur = conn.cursor()
+    col = sql.Identifier(TABLES[table])
+    lo, hi = _month_bounds(table, month)
+    removed = 0
+    if mode == 'delete':
+        delete = sql.SQL('DELETE FROM {} WHERE placa = %s AND {} >= %s AND {} < %s').format(sql.Identifier(table), col, col)
+        delete_null = sql.SQL('DELETE FROM {} WHERE placa IS NULL AND {} >= %s AND {} < %s').format(sql.Identifier(table), col, col)
+        for plate, entry in manifest['plates'].items():
+            try:
+                if plate == NULL_PLATE:
+                    cur.execute(delete_null, (lo, hi))
+                else:
+                    cur.execute(delete, (plate, lo, hi))
+                if cur.rowcount not in (0, entry['rows']):
+                    raise RuntimeError(f'{table} {manifest["month"]} {plate}: {cur.rowcount} rows in Postgres, '
+                                       f'{entry["rows"]} archived; rows changed after the export')
+                removed += cur.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    else:
+        name = partition_name(month)
+        try:
+            cur.execute(sql.SQL('SELECT count(*) FROM {}').format(sql.Identifier(name)))
+            rows = cur.fetchone()[0]
+            if rows != manifest['rows']:
+                raise RuntimeError(f'{name} has {rows} rows, {manifest["rows"]} archived; rows changed after the export')
+            cur.execute(sql.SQL('ALTER TABLE {} DETACH PARTITION {}').format(sql.Identifier(table), sql.Identifier(name)))
+            if mode == 'drop':
+                cur.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(name)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        removed = rows
+    manifest['removed_at'] = datetime.now().isoformat(timespec='seconds')
+    _write_manifest(directory, manifest)
+    logger.info('Removed %d archived rows of %s %s from Postgres (%s)', removed, table, manifest['month'], mode)
+    return removed
+
+
+def verify_month(table, month, base=None):
+    """Problems found re-reading an archived month (empty list when intact)."""
+    manifest = load_manifest(table, month, base)
+    directory = month_dir(table, month, base)
+    problems = []
+    for plate, entry in manifest['plates'].items():
+        path = os.path.join(directory, entry['file'])
+        if not os.path.exists(path):
+            problems.append(f'{plate}: {entry["file"]} is missing')
+        elif _sha256(path) != entry['sha256']:
+            problems.append(f'{plate}: {entry["file"]} checksum mismatch')
+        elif _count_lines(path) != entry['rows']:
+            problems.append(f'{plate}: {entry["file"]} line count mismatch')
+    return problems
+
+
+def _iter_rows(table, month, plate, base=None):
+    """Rows of one plate in an archived month whose source rows were removed."""
+    manifest = load_manifest(table, month, base)
+    if not manifest or not manifest.get('removed'):
+        return
+    entry = manifest['plates'].get(plate)
+    if not entry:
+        return
+    with _open_read(os.path.join(month_dir(table, month, base), entry['file'])) as fh:
+        for line in fh:
+            yield json.loads(line)
+
+
+def iter_positions(plate, start=None, end=None, base=None):
+    """Archived positions of `plate` with start <= data_transmissao <= end
+    (either bound optional), oldest first, read one file at a time;
+    timestamps stay ISO strings."""
+    for month in archived_months('positions', base):
+        if (start and add_months(month, 1) <= start.date()) or (end and month > end.date()):
+            continue
+        for row in _iter_rows('positions', month, plate, base):
+            ts = row.get('data_transmissao')
+            if ts and ((start and datetime.fromisoformat(ts) < start) or (end and datetime.fromisoformat(ts) > end)):
+                continue
+            yield row
+
+
+def read_route(plate, day, base=None):
+    """Archived route of `plate` for `day` (a dict of the routes columns), or None."""
+    month = month_start(day)
+    if month not in archived_months('routes', base):
+        return None
+    for row in _iter_rows('routes', month, plate, base):
+        if row.get('rota_date') == day.isoformat():
+            return row
+    return None
+
+
+def _parse_month(value):
+    year, month = value.split('-')[:2]
+    return date(int(year), int(month), 1)
+
+
+def main():
+    try:
+        from . import collector
+    except Exception:
+        import collector
+    parser = argparse.ArgumentParser(description='Archive closed months of positions and routes to compressed files')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_list = sub.add_parser('list', help='Archived months')
+    p_list.add_argument('--verify', action='store_true', help='Re-read every file and check checksums and line counts')
+    p_export = sub.add_parser('export', help='Archive closed months')
+    p_export.add_argument('--table', choices=list(TABLES), help='Only this table (default: all)')
+    p_export.add_argument('--month', type=_parse_month, action='append',
+                          help='Month YYYY-MM (repeatable; default: months older than --keep-months)')
+    p_export.add_argument('--keep-months', type=int, default=KEEP_MONTHS,
+                          help='Months kept in Postgres before the current one (default ETRAC_ARCHIVE_KEEP_MONTHS)')
+    p_export.add_argument('--compression', choices=COMPRESSIONS, default=COMPRESSION)
+    p_export.add_argument('--remove', choices=REMOVE_MODES, help='Remove the source rows once the archive is verified')
+    p_remove = sub.add_parser('remove', help='Remove the source rows of a month archived earlier')
+    p_remove.add_argument('--table', choices=list(TABLES), required=True)
+    p_remove.add_argument('--month', type=_parse_month, required=True)
+    p_remove.add_argument('--mode', choices=REMOVE_MODES, default='delete')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for table in TABLES:
+            for month in archived_months(table):
+                m = load_manifest(table, month)
+                status = f'removed ({m["removed"]})' if m.get('removed') else 'still in Postgres'
+                print(f'{table:<10} {m["month"]}  {m["rows"]:>10} rows  {len(m["plates"]):>5} plates  '
+                      f'{m["bytes"] / 1048576:8.1f} MiB  {m["compression"]:<5} {status}')
+                if args.verify:
+                    for problem in verify_month(table, month):
+                        print(f'    {problem}')
+        return
+
+    collector.load_env()
+    conn = collector.pg_connect()
+    conn.cursor().execute(sql.SQL('SET search_path = {}, public').format(sql.Identifier(SCHEMA)))
+    conn.commit()
+    removed = 0
+    if args.command == 'export':
+        for table in ([args.table] if args.table else TABLES):
+            months = args.month or candidate_months(conn, table, args.keep_months)
+            for month in months:
+                manifest = export_month(conn, table, month, args.compression)
+                if manifest:
+                    print(f'{table} {manifest["month"]}: {manifest["rows"]} rows, {len(manifest["plates"])} plates, '
+                          f'{manifest["bytes"] / 1048576:.1f} MiB')
+                if manifest and args.remove:
+                    removed += remove_month(conn, table, month, args.remove)
+    elif args.command == 'remove':
+        removed = remove_month(conn, args.table, args.month, args.mode)
+    if removed:
+        try:
+            from .raw_store import delete_orphan_payloads
+        except Exception:
+            from raw_store import delete_orphan_payloads
+        delete_orphan_payloads(conn)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,8 @@
 """Backfill controller: populate routes for plates over a date range.
 
 This script batches plates and dates, uses advisory lock to avoid concurrent runs,
-and respects rate limits. It reuses `collector` functions.
+and respects rate limits: besides `--sleep`, an adaptive API rate limiter
+(`--rate`/`--burst`) is installed by default. It reuses `collector` functions.
 """
 import os
 import time
@@ -16,6 +17,8 @@ repo_root = os.path.abspath(os.path.join(here, '..'))
 load_dotenv(os.path.join(repo_root, '.env'), override=False)
 
 import collector
+from http_retry import DEFAULT_RATE, RATE_LIMIT, circuit_stats, limiter_stats, make_limiter, set_rate_limiter
+from http_session import get_session, session_stats
 
 LOG = logging.getLogger('e-track.backfill')
 LOG.setLevel(os.getenv('ETRAC_LOG_LEVEL', 'INFO').upper())
@@ -59,7 +62,19 @@ def main():
     parser.add_argument('--sleep', type=float, default=float(os.getenv('ETRAC_RATE_SLEEP', '0.5')),
                         help='Seconds to sleep between requests')
     parser.add_argument('--batch-size', type=int, default=int(os.getenv('ETRAC_BATCH_SIZE', '20')))
+    parser.add_argument('--loader', choices=collector.LOADERS, default=collector.LOADER,
+                        help='How fetched positions are written (row, bulk or copy)')
+    parser.add_argument('--route-agg', choices=collector.ROUTE_AGGREGATIONS, default=collector.ROUTE_AGGREGATION,
+                        help='Where route points are assembled: python (fetch rows) or sql (jsonb_agg on the server)')
+    parser.add_argument('--rate', type=float, default=RATE_LIMIT or DEFAULT_RATE,
+                        help='Initial e-Track API requests per second, adapted up/down from 429/5xx feedback '
+                             '(0 disables the limiter)')
+    parser.add_argument('--burst', type=float, default=float(os.getenv('ETRAC_RATE_BURST', '0')) or None,
+                        help='Token-bucket burst size (defaults to --rate)')
     args = parser.parse_args()
+    collector.LOADER = args.loader
+    collector.ROUTE_AGGREGATION = args.route_agg
+    set_rate_limiter(make_limiter(args.rate, burst=args.burst) if args.rate > 0 else None)
 
     try:
         start_date = datetime.fromisoformat(args.date_start).date()
@@ -79,7 +94,7 @@ def main():
         cur = conn.cursor()
         cur.execute("SET search_path = %s, public", (os.getenv('ETRAC_SCHEMA', 'e_track'),))
         conn.commit()
-        plates = collector.get_all_plates(collector.requests.Session())
+        plates = collector.get_all_plates(get_session())
         conn.close()
 
     if not plates:
@@ -97,6 +112,7 @@ def main():
         conn.close()
         return
 
+    session = get_session()
     try:
         total_plates = len(plates)
         LOG.info('Starting backfill for %d plates from %s to %s', total_plates, start_date, end_date)
@@ -107,15 +123,22 @@ def main():
                     # attempt to fetch history and compute
                     LOG.debug('Fetching history for %s on %s', p, d)
                     try:
-                        collector.fetch_terminal_history(collector.requests.Session(), conn, p, data=d.strftime('%d/%m/%Y'))
+                        collector.fetch_terminal_history(session, conn, p, data=d.strftime('%d/%m/%Y'))
                     except Exception:
                         LOG.debug('fetch_terminal_history may have failed; proceeding to compute from DB')
-                    n = collector.build_and_store_route_for_date(conn, p, d, session=collector.requests.Session())
+                    n = collector.build_and_store_route_for_date(conn, p, d, session=session)
                     LOG.info('Plate %s date %s -> %d points', p, d, n)
                 except Exception:
                     LOG.exception('Failed for plate %s date %s', p, d)
                 time.sleep(args.sleep)
     finally:
+        stats = limiter_stats()
+        if stats:
+            LOG.info('API rate limiter: %s', stats)
+        circuits = circuit_stats()
+        if circuits:
+            LOG.warning('API circuits: %s', circuits)
+        LOG.info('HTTP connection reuse: %s', session_stats())
         release_lock(conn)
         conn.close()
 
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Sequential vs `async_engine` history fetch against a local stub API.
+
+Starts an `http.server` stub on 127.0.0.1 that answers the e-Track history
+endpoint after `--latency` ms with `--items` positions per plate, points the
+collector at it (ETRAC_API_BASE) and fetches `--plates` plate histories twice:
+one plate after the other as `--engine sync` does, then through
+`async_engine.run`. The writer only counts rows and sleeps `--write-ms`
+per batch, standing in for the DB so no Postgres is needed.
+
+Both runs must return every item; the script exits with an error otherwise.
+
+Usage:
+  python e-track/bench_async_engine.py --plates 40 --latency 100 --concurrency 8
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """POST <path> -> {'posicoes': [...]} for the plate in the JSON body."""
+    latency = 0.1
+    items = 100
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        time.sleep(self.latency)
+        placa = body.get('placa')
+        data = json.dumps({'posicoes': [
+            {'placa': placa, 'data_transmissao': f'01/01/2026 00:{i // 60 % 60:02d}:{i % 60:02d}',
+             'latitude': -23.5 + i * 1e-5, 'longitude': -46.6 - i * 1e-5, 'velocidade': i % 80}
+            for i in range(self.items)
+        ]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(latency, items):
+    StubHandler.latency = latency
+    StubHandler.items = items
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the async collector engine against a stub API')
+    parser.add_argument('--plates', type=int, default=40)
+    parser.add_argument('--items', type=int, default=100, help='Positions returned per plate')
+    parser.add_argument('--latency', type=float, default=100, help='Stub response delay (ms)')
+    parser.add_argument('--write-ms', type=float, default=10, help='Simulated DB write time per batch (ms)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    server = start_stub(args.latency / 1000, args.items)
+    # collector reads these at import time
+    os.environ['ETRAC_API_BASE'] = f'http://127.0.0.1:{server.server_port}'
+    os.environ.setdefault('ETRAC_USER', 'bench')
+    os.environ.setdefault('ETRAC_KEY', 'bench')
+    # keep the stub's endpoint out of the persisted endpoint cache
+    os.environ['ETRAC_ENDPOINT_CACHE'] = ''
+    import async_engine
+    import collector
+    from http_session import get_session
+    logging.getLogger('e-track.collector').setLevel(logging.WARNING)
+
+    session = get_session(args.concurrency)
+    plates = [f'BEN{i:04d}' for i in range(args.plates)]
+    expected = args.plates * args.items
+    written = []
+
+    def write(res):
+        time.sleep(args.write_ms / 1000)
+        written.append(len(res[1]))
+
+    started = time.perf_counter()
+    for placa in plates:
+        write(collector.request_terminal_history(session, placa, data='01/01/2026'))
+    sync_s = time.perf_counter() - started
+    sync_rows = sum(written)
+
+    written.clear()
+    jobs = [(f'history {placa}', lambda placa=placa: collector.request_terminal_history(session, placa, data='01/01/2026'), write)
+            for placa in plates]
+    stats = async_engine.run(jobs, concurrency=args.concurrency)
+    async_rows = sum(written)
+    server.shutdown()
+
+    print(f'sync       {sync_rows:>8} rows  {sync_s:7.3f}s')
+    print(f'async      {async_rows:>8} rows  {stats["seconds"]:7.3f}s  (concurrency {args.concurrency}, {stats["failed"]} failed)')
+    if sync_rows != expected or async_rows != expected or stats['failed']:
+        raise SystemExit(f'Mismatch: expected {expected} rows, sync {sync_rows}, async {async_rows}')
+    print(f'speedup    {sync_s / stats["seconds"]:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
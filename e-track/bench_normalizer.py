@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Microbenchmark: position normalization rows/sec, legacy vs `normalizer`.
+
+Builds a synthetic e-Track payload and normalizes it with the previous
+per-row code (nested parse_number closure, uncompiled regex, six strptime
+attempts per timestamp) and with `normalizer.POSITIONS.rows`.
+
+Usage:
+  python e-track/bench_normalizer.py --rows 100000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import psycopg2.extras
+
+from normalizer import POSITIONS
+
+
+def legacy_parse_date(s):
+    if s is None:
+        return None
+    if isinstance(s, (int, float)):
+        try:
+            return datetime.fromtimestamp(int(s))
+        except Exception:
+            return None
+    s = str(s).strip()
+    if not s:
+        return None
+    fmts = [
+        '%Y-%m-%dT%H:%M:%S',
+        '%Y-%m-%d %H:%M:%S',
+        '%d/%m/%Y %H:%M:%S',
+        '%d/%m/%Y',
+        '%d-%m-%Y',
+        '%d-%m-%Y %H:%M:%S',
+    ]
+    for f in fmts:
+        try:
+            return datetime.strptime(s, f)
+        except Exception:
+            continue
+    try:
+        return datetime.fromisoformat(s)
+    except Exception:
+        return None
+
+
+def legacy_position_row(item):
+    """Normalization part of the previous collector.insert_position."""
+    placa = item.get('placa')
+    if not placa:
+        return None
+    dt = legacy_parse_date(item.get('data_transmissao') or item.get('data_transmissao'))
+    try:
+        lat = float(item.get('latitude')) if item.get('latitude') not in (None, '') else None
+    except Exception:
+        lat = None
+    try:
+        lon = float(item.get('longitude')) if item.get('longitude') not in (None, '') else None
+    except Exception:
+        lon = None
+
+    def parse_number(val, integer=False):
+        if val is None:
+            return None
+        if isinstance(val, (int, float)):
+            return int(val) if integer else float(val)
+        s = str(val).strip()
+        if s == '':
+            return None
+        import re
+        m = re.search(r"[-+]?[0-9]{1,3}(?:[0-9\.,]*[0-9])?", s)
+        if not m:
+            return None
+        num = m.group(0)
+        if num.count(',') == 1 and num.count('.') == 0:
+            num = num.replace(',', '.')
+        num = num.replace(',', '')
+        try:
+            return int(float(num)) if integer else float(num)
+        except Exception:
+            return None
+
+    velocidade = parse_number(item.get('velocidade'), integer=True)
+    ign = item.get('ignicao')
+    odometro = parse_number(item.get('odometro'))
+    odometro_can = parse_number(item.get('odometro_can'))
+    horimetro = parse_number(item.get('horimetro'))
+    bateria = parse_number(item.get('bateria'))
+    logradouro = item.get('logradouro')
+    equipamento_serial = item.get('equipamento_serial')
+    data_gravacao = legacy_parse_date(item.get('data_gravacao'))
+    return (
+        placa, dt, lat, lon, logradouro, velocidade,
+        (True if ign in (1, '1', True) else False if ign in (0, '0', False) else None),
+        odometro, odometro_can, horimetro, bateria, equipamento_serial, data_gravacao, psycopg2.extras.Json(item)
+    )
+
+
+def synthetic_payload(n, seed=42):
+    rnd = random.Random(seed)
+    base = datetime(2025, 10, 1)
+    items = []
+    for i in range(n):
+        dt = base + timedelta(seconds=15 * i)
+        items.append({
+            'placa': f'ABC{i % 500:04d}',
+            'data_transmissao': dt.strftime('%d/%m/%Y %H:%M:%S'),
+            'data_gravacao': (dt + timedelta(seconds=2)).strftime('%d/%m/%Y %H:%M:%S'),
+            'latitude': f'{-23.5 + rnd.random() / 10:.6f}',
+            'longitude': f'{-46.6 + rnd.random() / 10:.6f}',
+            'velocidade': f'{rnd.randint(0, 110)} km/h',
+            'ignicao': rnd.choice((0, 1)),
+            'odometro': f'{rnd.randint(1000, 900000)},{rnd.randint(0, 9)}',
+            'odometro_can': str(rnd.randint(1000, 900000)),
+            'horimetro': str(rnd.randint(0, 9000)),
+            'bateria': f'{rnd.uniform(11.5, 14.2):.1f} V'.replace('.', ','),
+            'logradouro': f'Rua {rnd.randint(1, 300)}, São Paulo',
+            'equipamento_serial': f'SER{i % 500:06d}',
+        })
+    return items
+
+
+def run(label, fn, items):
+    started = time.perf_counter()
+    rows = fn(items)
+    elapsed = time.perf_counter() - started
+    print(f'{label:<10} {len(rows):>8} rows  {elapsed:7.3f}s  {len(rows) / elapsed:>10.0f} rows/s')
+    return rows, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark e-Track position normalization')
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    items = synthetic_payload(args.rows)
+    legacy_rows, legacy_s = run('legacy', lambda its: [r for r in map(legacy_position_row, its) if r], items)
+    new_rows, new_s = run('normalizer', lambda its: POSITIONS.rows(its, source='bench'), items)
+
+    # both paths must produce the same values (Json wrappers compared by payload);
+    # the normalizer row ends with raw_hash, which the legacy row predates
+    for a, b in zip(legacy_rows, new_rows):
+        if a[:-1] != b[:-2] or a[-1].adapted is not b[-2].adapted or b[-1] is not None:
+            raise SystemExit(f'Mismatch:\n  legacy={a[:-1]}\n  new={b[:-2]}')
+    print(f'speedup    {legacy_s / new_s:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Size and speed of the route storage formats in `route_codec`.
+
+For synthetic day routes of typical sizes (a vehicle reporting every 5-30s)
+prints, per format: JSON bytes (what `/api/routes` sends), gzip bytes (what
+goes over the wire with compression), encode/decode time and, with --db, the
+size Postgres actually stores for the JSONB value after TOAST compression
+(`pg_column_size` on a temp table, using the PG* env vars / DATABASE_URL).
+
+Usage:
+  python e-track/bench_route_codec.py --points 3000,10000,17000 [--db]
+"""
+import argparse
+import gzip
+import json
+import time
+
+from bench_route_simplify import synthetic_route
+from route_codec import FORMATS, decode_points, encode_points
+
+
+def stored_sizes(values):
+    """pg_column_size of each JSONB value once stored (compressed/TOASTed)."""
+    import psycopg2.extras
+    import collector
+    conn = collector.pg_connect()
+    try:
+        cur = conn.cursor()
+        cur.execute('CREATE TEMP TABLE bench_route_codec (id int, v jsonb)')
+        for i, v in enumerate(values):
+            cur.execute('INSERT INTO bench_route_codec VALUES (%s, %s)', (i, psycopg2.extras.Json(v)))
+        cur.execute('SELECT pg_column_size(v) FROM bench_route_codec ORDER BY id')
+        return [r[0] for r in cur.fetchall()]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark route storage formats')
+    parser.add_argument('--points', default='3000,10000,17000', help='Comma-separated route sizes')
+    parser.add_argument('--db', action='store_true', help='Also measure stored JSONB size in Postgres')
+    args = parser.parse_args()
+
+    for n in [int(x) for x in args.points.split(',') if x.strip()]:
+        pts = synthetic_route(n)
+        print(f'\n{n} points')
+        print(f'{"format":<10} {"JSON KiB":>9} {"gzip KiB":>9} {"encode ms":>10} {"decode ms":>10}' + (f' {"stored KiB":>11}' if args.db else ''))
+        encoded = {}
+        rows = []
+        for fmt in FORMATS:
+            started = time.perf_counter()
+            value = encode_points(pts, fmt)
+            enc_ms = (time.perf_counter() - started) * 1000
+            text = json.dumps(value)
+            started = time.perf_counter()
+            decoded = decode_points(json.loads(text))
+            dec_ms = (time.perf_counter() - started) * 1000
+            if decoded != pts:
+                raise SystemExit(f'{fmt}: decoded route differs from the original')
+            encoded[fmt] = value
+            rows.append((fmt, len(text), len(gzip.compress(text.encode())), enc_ms, dec_ms))
+        sizes = stored_sizes([encoded[f] for f in FORMATS]) if args.db else None
+        base = rows[0][1]
+        for i, (fmt, size, gz, enc_ms, dec_ms) in enumerate(rows):
+            line = f'{fmt:<10} {size / 1024:9.0f} {gz / 1024:9.0f} {enc_ms:10.1f} {dec_ms:10.1f}'
+            if sizes:
+                line += f' {sizes[i] / 1024:11.0f}'
+            print(line + (f'   ({size / base:.0%} of points JSON)' if i else ''))
+
+
+if __name__ == '__main__':
+    main()
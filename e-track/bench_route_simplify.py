@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Microbenchmark: Douglas-Peucker cost and size reduction per tolerance level.
+
+Builds a synthetic day route (a vehicle reporting every few seconds, with
+turns and stops) and times `route_simplify` on it, reporting milliseconds per
+10k points, points kept and JSON size for each level in TOLERANCES.
+
+Usage:
+  python e-track/bench_route_simplify.py --points 10000
+"""
+import argparse
+import json
+import math
+import random
+import time
+from datetime import datetime, timedelta
+
+from route_simplify import TOLERANCES, level_key, project, douglas_peucker, simplify_levels
+
+
+def synthetic_route(n, seed=42):
+    rnd = random.Random(seed)
+    lat, lon = -23.55, -46.63
+    heading = rnd.uniform(0, 2 * math.pi)
+    ts = datetime(2025, 10, 1, 6, 0, 0)
+    pts = []
+    for i in range(n):
+        stopped = (i // 300) % 5 == 4
+        speed = 0 if stopped else rnd.uniform(20, 60)
+        if rnd.random() < 0.03:
+            heading += rnd.uniform(-math.pi / 2, math.pi / 2)
+        step = speed / 3.6 * 5  # meters in 5 seconds
+        # GPS jitter of a few meters even when stopped
+        lat += (step * math.cos(heading) + rnd.gauss(0, 2)) / 111320.0
+        lon += (step * math.sin(heading) + rnd.gauss(0, 2)) / (111320.0 * math.cos(math.radians(lat)))
+        ts += timedelta(seconds=5)
+        pts.append({'lat': round(lat, 6), 'lon': round(lon, 6), 'ts': ts.isoformat(), 'vel': int(speed), 'addr': f'Rua {i // 50}'})
+    return pts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark route simplification')
+    parser.add_argument('--points', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    pts = synthetic_route(args.points)
+    full_bytes = len(json.dumps(pts))
+    per_10k = 10000.0 / len(pts)
+    print(f'{len(pts)} points, {full_bytes / 1024:.0f} KiB as JSON')
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        xy = project(pts)
+    project_ms = (time.perf_counter() - started) / args.repeat * 1000
+    print(f'{"project":<12} {project_ms * per_10k:8.1f} ms/10k pts')
+
+    for t in TOLERANCES:
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            kept = douglas_peucker(xy, t)
+        ms = (time.perf_counter() - started) / args.repeat * 1000
+        size = len(json.dumps([pts[i] for i in kept]))
+        print(f'{level_key(t) + " m":<12} {ms * per_10k:8.1f} ms/10k pts  {len(kept):>7} pts kept '
+              f'({len(kept) / len(pts):6.1%})  {size / 1024:7.0f} KiB')
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        simplify_levels(pts)
+    ms = (time.perf_counter() - started) / args.repeat * 1000
+    print(f'{"all levels":<12} {ms * per_10k:8.1f} ms/10k pts')
+
+
+if __name__ == '__main__':
+    main()
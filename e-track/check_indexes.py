@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Check that the hot `positions` queries use the indexes meant for them.
+
+Runs EXPLAIN (FORMAT JSON) for each query below against the configured
+database, lists the scans in the plan and compares the indexes used with the
+expected ones (partition indexes are mapped back to the index on the parent).
+Planner choices depend on table statistics: on a tiny table a sequential scan
+is legitimately cheaper, so run it against production-sized data (after
+ANALYZE).
+
+Usage:
+  python e-track/check_indexes.py [--plate ABC1D23] [--date 2025-10-01] [--analyze] [--strict]
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+from psycopg2 import sql
+
+import collector
+
+# (name, query, acceptable indexes, params builder)
+HOT_QUERIES = [
+    ('route day window', collector.ROUTE_POSITIONS_SQL, ('positions_placa_ts_idx',),
+     lambda plate, day: (plate, day, day + timedelta(days=1))),
+    # reads raw, so not index-only: any index led by (placa, data_transmissao) will do
+    ('api positions', """SELECT placa, data_transmissao, latitude, longitude, velocidade, ignicao, raw FROM positions
+        WHERE placa = %s AND data_transmissao BETWEEN %s AND %s ORDER BY data_transmissao ASC""",
+     ('positions_placa_ts_idx', 'positions_unique_idx'),
+     lambda plate, day: (plate, day, day + timedelta(days=1) - timedelta(seconds=1))),
+    # any index led by placa serves the skip scan
+    ('distinct plates', collector.DISTINCT_PLATES_SQL, ('positions_placa_ts_idx', 'positions_unique_idx'),
+     lambda plate, day: ()),
+    ('fleet day window', """SELECT placa, count(*) FROM positions
+        WHERE data_transmissao >= %s AND data_transmissao < %s GROUP BY placa""", ('positions_data_transmissao_brin',),
+     lambda plate, day: (day, day + timedelta(days=1))),
+]
+
+
+def plan_scans(node, out=None):
+    """[(node type, relation, index)] for every scan node in a JSON plan."""
+    out = [] if out is None else out
+    if 'Relation Name' in node or 'Index Name' in node:
+        out.append((node['Node Type'], node.get('Relation Name'), node.get('Index Name')))
+    for child in node.get('Plans', []):
+        plan_scans(child, out)
+    return out
+
+
+def root_index(cur, name):
+    """Name of the parent index for a partition's index (the name itself otherwise)."""
+    cur.execute('SELECT coalesce(pg_partition_root(to_regclass(%s)), to_regclass(%s))::regclass::text', (name, name))
+    return cur.fetchone()[0].split('.')[-1]
+
+
+def sample_params(cur, plate=None, day=None):
+    """Default to the first plate and the latest day it has positions."""
+    if not plate:
+        cur.execute(collector.DISTINCT_PLATES_SQL + ' LIMIT 1')
+        row = cur.fetchone()
+        if not row:
+            raise SystemExit('positions is empty; pass --plate/--date or load data first')
+        plate = row[0]
+    if not day:
+        cur.execute('SELECT max(data_transmissao) FROM positions WHERE placa = %s', (plate,))
+        latest = cur.fetchone()[0] or datetime.now()
+        day = datetime(latest.year, latest.month, latest.day)
+    return plate, day
+
+
+def main():
+    parser = argparse.ArgumentParser(description='EXPLAIN the hot positions queries and check their indexes')
+    parser.add_argument('--plate', help='Plate used in the per-plate queries (default: first plate in the table)')
+    parser.add_argument('--date', help='Day YYYY-MM-DD (default: latest day of the plate)')
+    parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (runs the queries and reports timings)')
+    parser.add_argument('--strict', action='store_true', help='Exit with status 1 when a query misses its index')
+    args = parser.parse_args()
+
+    conn = collector.pg_connect()
+    cur = conn.cursor()
+    cur.execute(sql.SQL('SET search_path = {}, public').format(sql.Identifier(os.getenv('ETRAC_SCHEMA', 'e_track'))))
+    day = datetime.strptime(args.date, '%Y-%m-%d') if args.date else None
+    plate, day = sample_params(cur, args.plate, day)
+    print(f'plate {plate}, day {day.date()}')
+
+    missed = 0
+    explain = 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' if args.analyze else 'EXPLAIN (FORMAT JSON) '
+    for name, query, expected, params in HOT_QUERIES:
+        cur.execute(explain + query, params(plate, day))
+        plan = cur.fetchone()[0]
+        plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+        scans = plan_scans(plan['Plan'])
+        used = {root_index(cur, index) for _, _, index in scans if index}
+        ok = bool(used.intersection(expected))
+        missed += not ok
+        timing = f'  {plan["Execution Time"]:.2f} ms' if args.analyze else ''
+        print(f'\n[{"OK" if ok else "MISS"}] {name} (expects {" or ".join(expected)}){timing}')
+        for node_type, relation, index in scans:
+            print(f'    {node_type:<22} {relation or "":<24} {index or ""}')
+    conn.rollback()
+    conn.close()
+    if missed:
+        print(f'\n{missed} queries did not use their index (small tables may prefer sequential scans)')
+    if missed and args.strict:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,20 +12,41 @@ import os
 import argparse
 import requests
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import calendar
 import psycopg2
 import psycopg2.extras
 from psycopg2 import sql
 import re
+import time
 from dotenv import load_dotenv
 import logging
 try:
     # when running as part of package
     from .http_retry import post_with_retries
+    from .normalizer import POSITIONS, RAW_MODES, TERMINALS, TRIP_RAW, parse_date, set_raw_mode
+    from .endpoint_cache import EndpointResolver
+    from .http_session import get_session, session_stats
+    from .route_simplify import TOLERANCES, simplify_levels
+    from .route_codec import FORMATS as ROUTE_FORMATS, decode_points, encode_points
+    from . import route_metrics
+    from . import partitions
+    from .recent_keys import RecentKeys
+    from . import async_engine
+    from . import table_meta
 except Exception:
     # when running as script from repository root
     from http_retry import post_with_retries
+    from normalizer import POSITIONS, RAW_MODES, TERMINALS, TRIP_RAW, parse_date, set_raw_mode
+    from endpoint_cache import EndpointResolver
+    from http_session import get_session, session_stats
+    from route_simplify import TOLERANCES, simplify_levels
+    from route_codec import FORMATS as ROUTE_FORMATS, decode_points, encode_points
+    import route_metrics
+    import partitions
+    from recent_keys import RecentKeys
+    import async_engine
+    import table_meta
 
 # configure logging
 LOG_LEVEL = os.getenv('ETRAC_LOG_LEVEL', 'INFO').upper()
@@ -45,6 +66,177 @@ PG_DB = os.getenv('PGDATABASE')
 PG_USER = os.getenv('PGUSER')
 PG_PASSWORD = os.getenv('PGPASSWORD')
 
+# remembers which candidate path worked for each probed operation (see endpoint_cache.py)
+ENDPOINTS = EndpointResolver()
+
+# How API payloads are written to Postgres: 'row' (one INSERT + commit per item),
+# 'bulk' (multi-row INSERTs, one commit per batch) or 'copy' (COPY into a temp
+# staging table, then one INSERT ... SELECT into positions).
+LOADERS = ('row', 'bulk', 'copy')
+LOADER = os.getenv('ETRAC_LOADER', 'row')
+BULK_BATCH_SIZE = int(os.getenv('ETRAC_BULK_BATCH_SIZE', '1000'))
+
+# Keys of positions known to be stored, so repeated --fetch-latest runs and
+# overlapping history windows drop duplicates before the INSERT (0 disables).
+RECENT_KEYS = RecentKeys(int(os.getenv('ETRAC_RECENT_KEYS', '100000')))
+RECENT_KEYS_WARM_HOURS = float(os.getenv('ETRAC_RECENT_KEYS_WARM_HOURS', '6'))
+
+# How much of each API item is kept in positions/trips besides the normalized
+# columns: 'full' raw, 'residual' (non-normalized keys only) or 'hashed'
+# (residual shared through raw_payloads). See normalizer.RawPolicy / raw_store.py.
+RAW_MODE = os.getenv('ETRAC_RAW_MODE', 'full')
+set_raw_mode(RAW_MODE)
+
+TERMINAL_COLUMNS = TERMINALS.columns
+POSITION_COLUMNS = POSITIONS.columns
+
+# How build_and_store_route_for_date assembles the points array: 'python'
+# (fetch the day's rows and build the list here) or 'sql' (jsonb_agg on the
+# server, so one JSONB value per route crosses the wire).
+ROUTE_AGGREGATIONS = ('python', 'sql')
+ROUTE_AGGREGATION = os.getenv('ETRAC_ROUTE_AGG', 'python')
+
+# Incremental refresh: routes that already have a watermark only get the
+# positions newer than it appended (see append_route_points).
+ROUTE_INCREMENTAL = os.getenv('ETRAC_ROUTE_INCREMENTAL', '0') == '1'
+
+# How routes.points / routes.simplified are stored: 'points' (list of point
+# dicts) or a compact form from route_codec ('columnar', 'polyline'). SQL-side
+# builds write lists and are re-encoded afterwards; incremental appends only
+# apply to routes stored as lists, compact ones are rebuilt.
+ROUTE_STORAGE = os.getenv('ETRAC_ROUTE_STORAGE', 'points')
+
+# distinct plates as a skip scan: one index probe on positions_placa_ts_idx per
+# plate instead of reading every position (SELECT DISTINCT walks the whole table)
+DISTINCT_PLATES_SQL = """WITH RECURSIVE plates AS (
+     (SELECT placa FROM positions WHERE placa IS NOT NULL ORDER BY placa LIMIT 1)
+     UNION ALL
+     SELECT (SELECT p.placa FROM positions p WHERE p.placa > plates.placa ORDER BY p.placa LIMIT 1)
+       FROM plates WHERE plates.placa IS NOT NULL
+   )
+   SELECT placa FROM plates WHERE placa IS NOT NULL
+"""
+
+ROUTE_POSITIONS_SQL = """SELECT data_transmissao, latitude, longitude, velocidade, logradouro
+   FROM positions
+   WHERE placa = %s AND data_transmissao >= %s AND data_transmissao < %s
+   ORDER BY data_transmissao ASC
+"""
+
+# one route point as built server-side (same keys/format as load_route_points in python mode)
+ROUTE_POINT_JSON = """jsonb_build_object(
+     'lat', latitude, 'lon', longitude,
+     'ts', to_char(data_transmissao, 'YYYY-MM-DD"T"HH24:MI:SS'),
+     'vel', velocidade, 'addr', logradouro)"""
+
+ROUTE_POINTS_AGG_SQL = """SELECT jsonb_agg({point} ORDER BY data_transmissao) AS points,
+          max(data_transmissao) AS last_ts
+   FROM positions
+   WHERE placa = %s AND data_transmissao >= %s AND data_transmissao < %s
+     AND latitude IS NOT NULL AND longitude IS NOT NULL
+""".format(point=ROUTE_POINT_JSON)
+
+# every plate's route for one day in a single statement (see build_routes_for_fleet)
+FLEET_ROUTES_SQL = """INSERT INTO routes (placa, rota_date, points, start_ts, end_ts, point_count, watermark, raw)
+   SELECT placa, %(day)s, jsonb_agg({point} ORDER BY data_transmissao),
+          min(data_transmissao), max(data_transmissao), count(*), max(data_transmissao),
+          jsonb_build_object('generated', true)
+   FROM positions
+   WHERE data_transmissao >= %(start)s AND data_transmissao < %(end)s
+     AND placa IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL {{plate_filter}}
+   GROUP BY placa
+   ON CONFLICT (placa, rota_date) DO UPDATE SET
+     points = EXCLUDED.points,
+     start_ts = EXCLUDED.start_ts,
+     end_ts = EXCLUDED.end_ts,
+     point_count = EXCLUDED.point_count,
+     watermark = EXCLUDED.watermark,
+     raw = EXCLUDED.raw,
+     created_at = now()
+   RETURNING placa, point_count
+""".format(point=ROUTE_POINT_JSON)
+
+# append positions newer than each route's watermark to the stored points, in place
+APPEND_ROUTE_POINTS_SQL = """WITH fresh AS (
+     SELECT r.placa, jsonb_agg({point} ORDER BY p.data_transmissao) AS pts,
+            max(p.data_transmissao) AS last_ts, count(*) AS n
+     FROM routes r
+     JOIN positions p ON p.placa = r.placa
+       AND p.data_transmissao > r.watermark AND p.data_transmissao < %(end)s
+     WHERE r.rota_date = %(day)s AND r.watermark IS NOT NULL AND jsonb_typeof(r.points) = 'array'
+       AND p.latitude IS NOT NULL AND p.longitude IS NOT NULL {{plate_filter}}
+     GROUP BY r.placa
+   )
+   UPDATE routes r SET
+     points = r.points || fresh.pts,
+     end_ts = fresh.last_ts,
+     point_count = r.point_count + fresh.n,
+     watermark = fresh.last_ts,
+     created_at = now()
+   FROM fresh
+   WHERE r.placa = fresh.placa AND r.rota_date = %(day)s
+   RETURNING r.placa, r.point_count
+""".format(point=ROUTE_POINT_JSON)
+
+TERMINAL_UPSERT_SQL = """INSERT INTO terminals (placa, descricao, frota, equipamento_serial, data_gravacao, data)
+   VALUES {values}
+   ON CONFLICT (placa) DO UPDATE SET descricao = EXCLUDED.descricao,
+     frota = EXCLUDED.frota, equipamento_serial = EXCLUDED.equipamento_serial,
+     data_gravacao = EXCLUDED.data_gravacao, data = EXCLUDED.data, data_atualizacao = now()
+"""
+POSITION_INSERT_SQL = """INSERT INTO positions (placa, data_transmissao, latitude, longitude, logradouro, velocidade,
+    ignicao, odometro, odometro_can, horimetro, bateria, equipamento_serial, data_gravacao, raw, raw_hash)
+   VALUES {values}
+   ON CONFLICT (placa, data_transmissao, latitude, longitude) DO NOTHING
+"""
+
+# Session-local staging table for --loader copy. Rows vanish at commit, after
+# the merge into positions has been applied.
+POSITIONS_STAGE_DDL = """CREATE TEMP TABLE IF NOT EXISTS positions_stage (
+    placa TEXT,
+    data_transmissao TIMESTAMP,
+    latitude DOUBLE PRECISION,
+    longitude DOUBLE PRECISION,
+    logradouro TEXT,
+    velocidade INTEGER,
+    ignicao BOOLEAN,
+    odometro DOUBLE PRECISION,
+    odometro_can DOUBLE PRECISION,
+    horimetro DOUBLE PRECISION,
+    bateria DOUBLE PRECISION,
+    equipamento_serial TEXT,
+    data_gravacao TIMESTAMP,
+    raw JSONB,
+    raw_hash TEXT
+) ON COMMIT DELETE ROWS"""
+RAW_PAYLOADS_INSERT_SQL = """INSERT INTO raw_payloads (hash, payload) VALUES %s
+   ON CONFLICT (hash) DO NOTHING
+"""
+POSITIONS_MERGE_SQL = """INSERT INTO positions ({cols})
+   SELECT {cols} FROM positions_stage
+   ON CONFLICT (placa, data_transmissao, latitude, longitude) DO NOTHING
+""".format(cols=', '.join(POSITION_COLUMNS))
+
+
+def load_env():
+    """Load the repository root .env (without overriding existing env vars) and
+    re-read the Postgres settings and API credentials, whose module-level
+    defaults were evaluated at import time. Scripts call it before pg_connect."""
+    here = os.path.dirname(__file__)
+    repo_root = os.path.abspath(os.path.join(here, '..'))
+    load_dotenv(os.path.join(repo_root, '.env'), override=False)
+
+    global PG_DSN, PG_HOST, PG_PORT, PG_DB, PG_USER, PG_PASSWORD
+    PG_DSN = os.getenv('DATABASE_URL') or PG_DSN
+    PG_HOST = os.getenv('PGHOST', PG_HOST or 'localhost')
+    PG_PORT = os.getenv('PGPORT', PG_PORT or '5432')
+    PG_DB = os.getenv('PGDATABASE') or PG_DB
+    PG_USER = os.getenv('PGUSER') or PG_USER
+    PG_PASSWORD = os.getenv('PGPASSWORD') or PG_PASSWORD
+    global ETRAC_USER, ETRAC_KEY
+    ETRAC_USER = os.getenv('ETRAC_USER') or ETRAC_USER
+    ETRAC_KEY = os.getenv('ETRAC_KEY') or ETRAC_KEY
+
 
 def pg_connect():
     logger.debug('Connecting to Postgres: host=%s port=%s dbname=%s user=%s', PG_HOST, PG_PORT, PG_DB, PG_USER)
@@ -91,41 +283,20 @@ def ensure_tables(conn):
         logger.exception('Failed to create unique index positions_unique_idx (continuing)')
         conn.rollback()
     conn.commit()
+    # monthly partitions of positions (see partitions.py)
+    if partitions.PARTITIONED and not partitions.is_partitioned(conn):
+        cur.execute('SELECT EXISTS (SELECT 1 FROM positions)')
+        if cur.fetchone()[0]:
+            logger.warning('ETRAC_POSITIONS_PARTITIONED=1 but positions already has rows; run "partitions.py migrate" to convert it')
+        else:
+            partitions.migrate(conn, drop_legacy=True)
+    if partitions.is_partitioned(conn):
+        partitions.ensure_partitions(conn)
+    # columns may have changed: drop cached metadata (web UI running in this process)
+    table_meta.invalidate()
     logger.info('Schema and tables ensured')
 
 
-def parse_date(s):
-    if s is None:
-        return None
-    if isinstance(s, (int, float)):
-        # assume epoch seconds
-        try:
-            return datetime.fromtimestamp(int(s))
-        except Exception:
-            return None
-    s = str(s).strip()
-    if not s:
-        return None
-    fmts = [
-        '%Y-%m-%dT%H:%M:%S',
-        '%Y-%m-%d %H:%M:%S',
-        '%d/%m/%Y %H:%M:%S',
-        '%d/%m/%Y',
-        '%d-%m-%Y',
-        '%d-%m-%Y %H:%M:%S',
-    ]
-    for f in fmts:
-        try:
-            return datetime.strptime(s, f)
-        except Exception:
-            continue
-    # fallback: try ISO parser via fromisoformat
-    try:
-        return datetime.fromisoformat(s)
-    except Exception:
-        return None
-
-
 def auth():
     if not ETRAC_USER or not ETRAC_KEY:
         raise RuntimeError('Set ETRAC_USER and ETRAC_KEY in environment')
@@ -157,25 +328,24 @@ def extract_list(resp_json):
     return []
 
 
-def upsert_terminal(conn, item):
-    placa = item.get('placa') or item.get('placaVeiculo') or item.get('plate')
-    if not placa:
+def normalize_terminal(item, source=None):
+    """Return a row tuple matching TERMINAL_COLUMNS, or None if the item has no plate."""
+    return TERMINALS.row(item, source)
+
+
+def normalize_position(item, source=None):
+    """Return a row tuple matching POSITION_COLUMNS, or None if the item has no plate."""
+    return POSITIONS.row(item, source)
+
+
+def upsert_terminal(conn, item, source=None):
+    row = normalize_terminal(item, source)
+    if row is None:
         return
-    descricao = item.get('descricao')
-    frota = item.get('frota')
-    equipamento_serial = item.get('equipamento_serial')
-    data_gravacao = parse_date(item.get('data_gravacao') or item.get('data_gravacao'))
+    placa = row[0]
     cur = conn.cursor()
     try:
-        cur.execute(
-            """INSERT INTO terminals (placa, descricao, frota, equipamento_serial, data_gravacao, data)
-               VALUES (%s, %s, %s, %s, %s, %s)
-               ON CONFLICT (placa) DO UPDATE SET descricao = EXCLUDED.descricao,
-                 frota = EXCLUDED.frota, equipamento_serial = EXCLUDED.equipamento_serial,
-                 data_gravacao = EXCLUDED.data_gravacao, data = EXCLUDED.data, data_atualizacao = now()
-            """,
-            (placa, descricao, frota, equipamento_serial, data_gravacao, psycopg2.extras.Json(item)),
-        )
+        cur.execute(TERMINAL_UPSERT_SQL.format(values='(%s, %s, %s, %s, %s, %s)'), row)
         conn.commit()
         logger.debug('Upserted terminal %s', placa)
     except Exception:
@@ -183,71 +353,36 @@ def upsert_terminal(conn, item):
         conn.rollback()
 
 
+def store_raw_payloads(cur):
+    """Write the payloads referenced by rows normalized in 'hashed' raw mode
+    (call in the transaction that inserts those rows)."""
+    pending = POSITIONS.raw_policy.take_pending()
+    pending.update(TRIP_RAW.take_pending())
+    if pending:
+        psycopg2.extras.execute_values(cur, RAW_PAYLOADS_INSERT_SQL,
+                                       [(h, psycopg2.extras.Json(p)) for h, p in pending.items()], page_size=BULK_BATCH_SIZE)
+
 
-def insert_position(conn, item):
-    placa = item.get('placa')
-    if not placa:
+def insert_position(conn, item, source=None, count=True):
+    """Insert one position. `count=False` when the item was already counted by
+    RECENT_KEYS (row-by-row replay of a failed batch)."""
+    row = normalize_position(item, source)
+    if row is None:
+        return
+    placa, dt = row[0], row[1]
+    rows, keys = RECENT_KEYS.filter([row], count=count)
+    if not rows:
+        logger.debug('Skipped known position for %s at %s', placa, dt)
         return
-    dt = parse_date(item.get('data_transmissao') or item.get('data_transmissao'))
-    lat = None
-    lon = None
-    try:
-        lat = float(item.get('latitude')) if item.get('latitude') not in (None, '') else None
-    except Exception:
-        lat = None
-    try:
-        lon = float(item.get('longitude')) if item.get('longitude') not in (None, '') else None
-    except Exception:
-        lon = None
-    # sanitize numeric-like fields: velocidade may come as '0 km/h', bateria as '12.6 V', etc.
-    def parse_number(val, integer=False):
-        if val is None:
-            return None
-        if isinstance(val, (int, float)):
-            return int(val) if integer else float(val)
-        s = str(val).strip()
-        if s == '':
-            return None
-        # extract first occurrence of number (handles commas and dots)
-        import re
-        m = re.search(r"[-+]?[0-9]{1,3}(?:[0-9\.,]*[0-9])?", s)
-        if not m:
-            return None
-        num = m.group(0)
-        # normalize comma as decimal if needed
-        if num.count(',') == 1 and num.count('.') == 0:
-            num = num.replace(',', '.')
-        # remove thousands separators
-        num = num.replace(',', '')
-        try:
-            return int(float(num)) if integer else float(num)
-        except Exception:
-            return None
-
-    velocidade = parse_number(item.get('velocidade'), integer=True)
-    ign = item.get('ignicao')
-    odometro = parse_number(item.get('odometro'))
-    odometro_can = parse_number(item.get('odometro_can'))
-    horimetro = parse_number(item.get('horimetro'))
-    bateria = parse_number(item.get('bateria'))
-    logradouro = item.get('logradouro')
-    equipamento_serial = item.get('equipamento_serial')
-    data_gravacao = parse_date(item.get('data_gravacao'))
     cur = conn.cursor()
     try:
-        cur.execute(
-            """INSERT INTO positions (placa, data_transmissao, latitude, longitude, logradouro, velocidade,
-                ignicao, odometro, odometro_can, horimetro, bateria, equipamento_serial, data_gravacao, raw)
-               VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-               ON CONFLICT (placa, data_transmissao, latitude, longitude) DO NOTHING
-            """,
-            (
-                placa, dt, lat, lon, logradouro, velocidade,
-                (True if ign in (1, '1', True) else False if ign in (0, '0', False) else None),
-                odometro, odometro_can, horimetro, bateria, equipamento_serial, data_gravacao, psycopg2.extras.Json(item)
-            ),
-        )
+        cur.execute(POSITION_INSERT_SQL.format(values='(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)'), row)
+        # read before the raw_payloads insert reuses the cursor
+        inserted = cur.rowcount
+        store_raw_payloads(cur)
         conn.commit()
+        RECENT_KEYS.record_inserted(inserted)
+        RECENT_KEYS.add_many(keys)
         logger.info('Inserted position for %s at %s', placa, dt)
     except Exception as e:
         # Log the error and the problematic item, but don't raise so processing continues
@@ -259,19 +394,191 @@ def insert_position(conn, item):
         conn.rollback()
 
 
-def fetch_latest_positions(session, conn):
+def bulk_ingest(conn, items, batch_size=None, source=None):
+    """Write terminals and positions for `items` with multi-row INSERTs.
+
+    Each batch is committed once. If a batch fails it is rolled back and
+    replayed row by row, so a single bad item only loses itself. Positions
+    already in RECENT_KEYS are not sent.
+    Returns the number of position rows sent to Postgres.
+    """
+    batch_size = batch_size or BULK_BATCH_SIZE
+    sent = 0
+    for i in range(0, len(items), batch_size):
+        batch = items[i:i + batch_size]
+        # ON CONFLICT DO UPDATE cannot touch the same row twice in one statement:
+        # keep only the last terminal payload per plate within the batch.
+        terminals = {}
+        positions = []
+        for it in batch:
+            t = normalize_terminal(it, source)
+            if t is not None:
+                terminals[t[0]] = t
+            p = normalize_position(it, source)
+            if p is not None:
+                positions.append(p)
+        positions, keys = RECENT_KEYS.filter(positions)
+        cur = conn.cursor()
+        try:
+            if terminals:
+                psycopg2.extras.execute_values(cur, TERMINAL_UPSERT_SQL.format(values='%s'), list(terminals.values()), page_size=batch_size)
+            inserted = 0
+            if positions:
+                psycopg2.extras.execute_values(cur, POSITION_INSERT_SQL.format(values='%s'), positions, page_size=batch_size)
+                inserted = cur.rowcount
+            store_raw_payloads(cur)
+            conn.commit()
+            RECENT_KEYS.record_inserted(inserted)
+            RECENT_KEYS.add_many(keys)
+            logger.debug('Bulk batch %d..%d committed (%d terminals, %d positions)', i + 1, i + len(batch), len(terminals), len(positions))
+        except Exception:
+            logger.exception('Bulk batch %d..%d failed; retrying row by row', i + 1, i + len(batch))
+            conn.rollback()
+            # the batch was counted by RECENT_KEYS above; replay without counting again
+            for it in batch:
+                upsert_terminal(conn, it, source)
+                insert_position(conn, it, source, count=False)
+        sent += len(positions)
+    return sent
+
+
+def _copy_field(val):
+    """Render one value in COPY text format."""
+    if val is None:
+        return '\\N'
+    if isinstance(val, psycopg2.extras.Json):
+        val = json.dumps(val.adapted, ensure_ascii=False)
+    elif isinstance(val, bool):
+        val = 't' if val else 'f'
+    elif isinstance(val, datetime):
+        val = val.isoformat(' ')
+    else:
+        val = str(val)
+    return val.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+class _CopyStream:
+    """Read-only file object that feeds COPY FROM STDIN from a row iterator,
+    so a large response is never rendered into one big string."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buf = ''
+
+    def read(self, size=-1):
+        chunks = [self._buf]
+        have = len(self._buf)
+        while size < 0 or have < size:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+            line = '\t'.join(_copy_field(v) for v in row) + '\n'
+            chunks.append(line)
+            have += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            self._buf = ''
+            return data
+        self._buf = data[size:]
+        return data[:size]
+
+
+def copy_ingest(conn, items, source=None):
+    """Stream positions into a temp staging table with COPY and merge them into
+    `positions` with one INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+
+    Terminals are upserted in the same transaction before the merge. On any
+    failure the transaction is rolled back and the items go through the bulk
+    loader instead. Positions already in RECENT_KEYS are not staged.
+    Returns the number of position rows staged.
+    """
+    terminals = {}
+    staged = [0]
+    skipped = [0]
+    keys = []
+    in_stream = set()
+
+    def rows():
+        # counted into RECENT_KEYS only after the commit: on failure the bulk
+        # loader filters (and counts) the same items itself
+        for it in items:
+            t = normalize_terminal(it, source)
+            if t is not None:
+                terminals[t[0]] = t
+            p = normalize_position(it, source)
+            if p is None:
+                continue
+            fresh, fresh_keys = RECENT_KEYS.filter([p], count=False)
+            key = fresh_keys[0] if fresh_keys else None
+            # repeated within this response: not in RECENT_KEYS until the commit
+            if fresh and (key is None or key not in in_stream):
+                if key is not None:
+                    in_stream.add(key)
+                staged[0] += 1
+                keys.extend(fresh_keys)
+                yield p
+            else:
+                skipped[0] += 1
+
+    cur = conn.cursor()
+    try:
+        cur.execute(POSITIONS_STAGE_DDL)
+        cur.copy_expert('COPY positions_stage ({}) FROM STDIN'.format(', '.join(POSITION_COLUMNS)), _CopyStream(rows()))
+        if terminals:
+            psycopg2.extras.execute_values(cur, TERMINAL_UPSERT_SQL.format(values='%s'), list(terminals.values()), page_size=BULK_BATCH_SIZE)
+        cur.execute(POSITIONS_MERGE_SQL)
+        merged = cur.rowcount
+        store_raw_payloads(cur)
+        conn.commit()
+        RECENT_KEYS.record_filtered(staged[0], skipped[0])
+        RECENT_KEYS.record_inserted(merged)
+        RECENT_KEYS.add_many(keys)
+        logger.debug('COPY loader staged %d positions, merged %d new', staged[0], merged)
+        return staged[0]
+    except Exception:
+        logger.exception('COPY load failed; falling back to bulk loader')
+        conn.rollback()
+        return bulk_ingest(conn, items, source=source)
+
+
+def ingest_items(conn, items, loader=None, source=None):
+    """Store terminals and positions from an API response using the selected loader.
+    `source` names the endpoint the items came from (used to cache date formats).
+    Returns number of items processed.
+    """
+    loader = loader or LOADER
+    started = time.monotonic()
+    if loader == 'copy':
+        copy_ingest(conn, items, source=source)
+    elif loader == 'bulk':
+        bulk_ingest(conn, items, source=source)
+    else:
+        for it in items:
+            upsert_terminal(conn, it, source)
+            insert_position(conn, it, source)
+    elapsed = time.monotonic() - started
+    if items:
+        logger.info('Loader %s wrote %d items in %.2fs (%.0f rows/s)', loader, len(items), elapsed,
+                    len(items) / elapsed if elapsed > 0 else 0)
+    return len(items)
+
+
+def request_latest_positions(session):
+    """Fetch the fleet's latest positions; returns the list of items."""
     url = f"{API_BASE.rstrip('/')}/ultimas-posicoes"
     r = post_with_retries(session, url, auth=auth(), timeout=60)
     r.raise_for_status()
     j = r.json()
     items = extract_list(j)
     logger.info('Fetched %d items from %s', len(items), url)
-    processed = 0
-    for it in items:
-        # cada item deve ser um terminal com campos descritos no manual
-        upsert_terminal(conn, it)
-        insert_position(conn, it)
-        processed += 1
+    return items
+
+
+def fetch_latest_positions(session, conn):
+    items = request_latest_positions(session)
+    # cada item deve ser um terminal com campos descritos no manual
+    processed = ingest_items(conn, items, source='ultimas-posicoes')
     logger.info('Processed %d positions from latest-positions', processed)
 
 
@@ -282,12 +589,11 @@ def fetch_last_position_for_plate(session, conn, placa):
     j = r.json()
     items = extract_list(j)
     logger.info('Fetched %d items for plate %s from %s', len(items), placa, url)
-    for it in items:
-        upsert_terminal(conn, it)
-        insert_position(conn, it)
+    ingest_items(conn, items, source='ultimaposicao')
 
 
-def fetch_terminal_history(session, conn, placa, data=None, inicio=None, fim=None):
+def request_terminal_history(session, placa, data=None, inicio=None, fim=None):
+    """Fetch history items for `placa`; returns (endpoint path, items)."""
     # The eTrac API has slightly varying endpoint names across installations.
     # Try a set of likely endpoint paths and use the first that responds with 200.
     payload = {'placa': placa}
@@ -301,13 +607,11 @@ def fetch_terminal_history(session, conn, placa, data=None, inicio=None, fim=Non
     candidate_paths = [
         'ultimasposicoesterminal',
         'ultimas-posicoes-terminal',
-        'ultimas-posicoes-terminal',
-        'ultimasposicoesterminal',
         'historico-terminal',
         'historico-posicoes-terminal',
     ]
     last_exc = None
-    for p in candidate_paths:
+    for p in ENDPOINTS.candidates('terminal_history', candidate_paths):
         url = f"{API_BASE.rstrip('/')}/{p}"
         try:
             r = post_with_retries(session, url, auth=auth(), json=payload, timeout=60)
@@ -316,6 +620,7 @@ def fetch_terminal_history(session, conn, placa, data=None, inicio=None, fim=Non
             continue
         # if endpoint not found, try next candidate
         if r.status_code == 404:
+            ENDPOINTS.forget('terminal_history', p)
             last_exc = requests.exceptions.HTTPError(f'404 for {url}')
             continue
         try:
@@ -324,6 +629,7 @@ def fetch_terminal_history(session, conn, placa, data=None, inicio=None, fim=Non
             last_exc = e
             # for other HTTP errors, stop and re-raise
             raise
+        ENDPOINTS.remember('terminal_history', p)
         j = r.json()
         # response likely contains 'posicoes' list
         items = []
@@ -332,7 +638,6 @@ def fetch_terminal_history(session, conn, placa, data=None, inicio=None, fim=Non
         else:
             items = extract_list(j)
         logger.info('Fetched %d history items for plate %s from %s', len(items), placa, url)
-        processed = 0
         for it in items:
             # some installations return history items without a 'placa' field
             # ensure the item has the requested placa so upsert/insert work
@@ -341,12 +646,7 @@ def fetch_terminal_history(session, conn, placa, data=None, inicio=None, fim=Non
                     it['placa'] = placa
                 except Exception:
                     pass
-            upsert_terminal(conn, it)
-            insert_position(conn, it)
-            processed += 1
-        logger.info('Processed %d historical positions for %s from %s', processed, placa, url)
-        # success: return after processing
-        return
+        return p, items
 
     # if we reach here, no candidate endpoint worked
     if last_exc:
@@ -354,18 +654,23 @@ def fetch_terminal_history(session, conn, placa, data=None, inicio=None, fim=Non
     raise RuntimeError(f'Could not fetch terminal history: attempted endpoints {candidate_paths} but none succeeded')
 
 
+def fetch_terminal_history(session, conn, placa, data=None, inicio=None, fim=None):
+    p, items = request_terminal_history(session, placa, data=data, inicio=inicio, fim=fim)
+    processed = ingest_items(conn, items, source=p)
+    logger.info('Processed %d historical positions for %s from %s', processed, placa, p)
+
+
 def get_all_plates(session):
     """Return a list of plate strings from the latest-positions endpoint."""
     candidate_paths = [
         'ultimas-posicoes',
         'ultimasposicoes',
-        'ultimas-posicoes',
         'ultimas-posicoes-frota',
         'ultimasposicoesfrota',
     ]
     plates = []
     last_exc = None
-    for p in candidate_paths:
+    for p in ENDPOINTS.candidates('fleet_plates', candidate_paths):
         url = f"{API_BASE.rstrip('/')}/{p}"
         try:
             r = post_with_retries(session, url, auth=auth(), timeout=60)
@@ -375,6 +680,7 @@ def get_all_plates(session):
             continue
         if r.status_code == 404:
             logger.debug('Endpoint not found: %s', url)
+            ENDPOINTS.forget('fleet_plates', p)
             last_exc = requests.exceptions.HTTPError(f'404 for {url}')
             continue
         try:
@@ -395,6 +701,7 @@ def get_all_plates(session):
             if pval:
                 plates.append(pval)
         if plates:
+            ENDPOINTS.remember('fleet_plates', p)
             logger.info('Discovered %d plates from %s', len(plates), url)
             return plates
     # none succeeded
@@ -405,25 +712,22 @@ def get_all_plates(session):
     return []
 
 
-def build_and_store_route_for_date(conn, placa, date_obj, session=None, min_points_for_route=3):
-    """Aggregate positions for a given placa and date (datetime.date) and store into routes table.
-    Returns number of points stored.
+def load_route_points(conn, placa, start, end, aggregation=None):
+    """Return the [start, end) positions of a plate as route points, oldest first,
+    and the data_transmissao of the last one (the route's watermark).
+
+    Point 'ts' strings are truncated to seconds in 'sql' mode, so the watermark
+    is the stored timestamp, not the last point's 'ts'.
     """
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    start = datetime(date_obj.year, date_obj.month, date_obj.day, 0, 0, 0)
-    last_day = calendar.monthrange(date_obj.year, date_obj.month)[1]
-    end = datetime(date_obj.year, date_obj.month, last_day, 23, 59, 59)
-    cur.execute(
-        """SELECT data_transmissao, latitude, longitude, velocidade, raw
-           FROM positions
-           WHERE placa = %s AND data_transmissao BETWEEN %s AND %s
-           ORDER BY data_transmissao ASC
-        """,
-        (placa, start, end),
-    )
-    rows = cur.fetchall()
+    if (aggregation or ROUTE_AGGREGATION) == 'sql':
+        cur.execute(ROUTE_POINTS_AGG_SQL, (placa, start, end))
+        row = cur.fetchone()
+        return ((row and row.get('points')) or []), (row and row.get('last_ts'))
+    cur.execute(ROUTE_POSITIONS_SQL, (placa, start, end))
     pts = []
-    for r in rows:
+    last_ts = None
+    for r in cur.fetchall():
         lat = r.get('latitude')
         lon = r.get('longitude')
         if lat is None or lon is None:
@@ -435,9 +739,140 @@ def build_and_store_route_for_date(conn, placa, date_obj, session=None, min_poin
             continue
         ts = r.get('data_transmissao')
         ts_iso = ts.isoformat() if isinstance(ts, datetime) else str(ts)
-        # include textual address/location fields when available
-        addr = r.get('logradouro') or r.get('endereco')
-        pts.append({'lat': latf, 'lon': lonf, 'ts': ts_iso, 'vel': r.get('velocidade'), 'addr': addr})
+        pts.append({'lat': latf, 'lon': lonf, 'ts': ts_iso, 'vel': r.get('velocidade'), 'addr': r.get('logradouro')})
+        last_ts = ts
+    return pts, last_ts
+
+
+def _day_params(date_obj, plates=None):
+    start = datetime(date_obj.year, date_obj.month, date_obj.day, 0, 0, 0)
+    params = {'day': date_obj, 'start': start, 'end': start + timedelta(days=1)}
+    if plates is not None:
+        params['plates'] = list(plates)
+    return params
+
+
+def routes_with_watermark(conn, date_obj, plates=None):
+    """Return {placa: point_count} of the day's routes that can be refreshed incrementally."""
+    params = _day_params(date_obj, plates)
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT placa, point_count FROM routes WHERE rota_date = %(day)s AND watermark IS NOT NULL AND jsonb_typeof(points) = 'array'"
+        + (' AND placa = ANY(%(plates)s)' if plates is not None else ''),
+        params,
+    )
+    return dict(cur.fetchall())
+
+
+def append_route_points(conn, date_obj, plates=None):
+    """Append positions newer than each route's watermark to routes.points in place.
+
+    Only routes with a watermark are touched; positions that arrive with a
+    data_transmissao older than the watermark are picked up by the next full
+    rebuild. Returns {placa: point_count} of the routes that grew.
+    """
+    params = _day_params(date_obj, plates)
+    plate_filter = 'AND r.placa = ANY(%(plates)s)' if plates is not None else ''
+    cur = conn.cursor()
+    try:
+        cur.execute(APPEND_ROUTE_POINTS_SQL.format(plate_filter=plate_filter), params)
+        grown = dict(cur.fetchall())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return grown
+
+
+def _simplified_stage(pts):
+    levels = simplify_levels(pts)
+    return {'simplified': psycopg2.extras.Json({k: encode_points(v, ROUTE_STORAGE) for k, v in levels.items()})}
+
+
+def _metrics_stage(pts):
+    return route_metrics.compute_metrics(pts)
+
+
+# Columns derived from a route's points, stored next to them. Each stage maps
+# the points list to {column: value}; they run for every route that is built
+# or extended (see route_stage_columns / refresh_route_stages).
+ROUTE_STAGES = [_simplified_stage] if TOLERANCES else []
+if route_metrics.AVAILABLE:
+    ROUTE_STAGES.append(_metrics_stage)
+else:
+    logger.warning('numpy not installed; route metrics (distance, moving time, stops) are not computed')
+
+
+def route_stage_columns(pts):
+    columns = {}
+    for stage in ROUTE_STAGES:
+        columns.update(stage(pts))
+    return columns
+
+
+def _store_route_stages(cur, date_obj, rows):
+    """rows: [(placa, {column: value})] with the same columns in every row."""
+    if not rows or not rows[0][1]:
+        return
+    assignments = sql.SQL(', ').join(
+        sql.SQL('{} = {}').format(sql.Identifier(col), sql.Placeholder(col)) for col in rows[0][1]
+    )
+    query = sql.SQL('UPDATE routes SET {} WHERE placa = %(placa)s AND rota_date = %(day)s').format(assignments)
+    psycopg2.extras.execute_batch(cur, query, [dict(cols, placa=placa, day=date_obj) for placa, cols in rows])
+
+
+def refresh_route_stages(conn, date_obj, plates, batch_size=100):
+    """Recompute ROUTE_STAGES columns for routes written by the SQL-only paths
+    (fleet build, incremental append), streaming their points in batches.
+    Also re-encodes their points when ROUTE_STORAGE is a compact format."""
+    if not plates or (not ROUTE_STAGES and ROUTE_STORAGE == 'points'):
+        return
+    started = time.monotonic()
+    read = conn.cursor(name='route_stages')
+    write = conn.cursor()
+    try:
+        read.itersize = batch_size
+        read.execute('SELECT placa, points FROM routes WHERE rota_date = %s AND placa = ANY(%s)', (date_obj, list(plates)))
+        while True:
+            batch = read.fetchmany(batch_size)
+            if not batch:
+                break
+            rows = []
+            for placa, points in batch:
+                pts = decode_points(points)
+                columns = route_stage_columns(pts)
+                if ROUTE_STORAGE != 'points':
+                    columns['points'] = psycopg2.extras.Json(encode_points(pts, ROUTE_STORAGE))
+                rows.append((placa, columns))
+            _store_route_stages(write, date_obj, rows)
+        read.close()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.debug('Route stages refreshed for %d routes on %s in %.2fs', len(plates), date_obj, time.monotonic() - started)
+
+
+def build_and_store_route_for_date(conn, placa, date_obj, session=None, min_points_for_route=3, incremental=None):
+    """Aggregate positions for a given placa and date (datetime.date) and store into routes table.
+    With `incremental` (default ROUTE_INCREMENTAL) an existing route is only extended
+    with positions newer than its watermark.
+    Returns number of points stored.
+    """
+    if ROUTE_INCREMENTAL if incremental is None else incremental:
+        current = routes_with_watermark(conn, date_obj, [placa])
+        if placa in current:
+            grown = append_route_points(conn, date_obj, [placa])
+            if placa in grown:
+                logger.info('Appended %d points to route for %s on %s', grown[placa] - current[placa], placa, date_obj)
+                refresh_route_stages(conn, date_obj, [placa])
+            return grown.get(placa, current[placa])
+
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    start = datetime(date_obj.year, date_obj.month, date_obj.day, 0, 0, 0)
+    end = start + timedelta(days=1)
+    pts, last_ts = load_route_points(conn, placa, start, end)
+    from_positions = True
 
     if not pts:
         # If we have no (or too few) positions, try to fetch terminal history from the API
@@ -448,41 +883,22 @@ def build_and_store_route_for_date(conn, placa, date_obj, session=None, min_poin
                 date_str = date_obj.strftime('%d/%m/%Y')
                 fetch_terminal_history(session, conn, placa, data=date_str)
                 # re-query positions after attempting to fetch history
-                cur.execute(
-                    """SELECT data_transmissao, latitude, longitude, velocidade, raw
-                       FROM positions
-                       WHERE placa = %s AND data_transmissao BETWEEN %s AND %s
-                       ORDER BY data_transmissao ASC
-                    """,
-                    (placa, start, end),
-                )
-                rows = cur.fetchall()
-                pts = []
-                for r in rows:
-                    lat = r.get('latitude')
-                    lon = r.get('longitude')
-                    if lat is None or lon is None:
-                        continue
-                    try:
-                        latf = float(lat)
-                        lonf = float(lon)
-                    except Exception:
-                        continue
-                    ts = r.get('data_transmissao')
-                    ts_iso = ts.isoformat() if isinstance(ts, datetime) else str(ts)
-                    pts.append({'lat': latf, 'lon': lonf, 'ts': ts_iso, 'vel': r.get('velocidade')})
+                pts, last_ts = load_route_points(conn, placa, start, end)
             except Exception:
                 logger.exception('History fetch failed for %s on %s', placa, date_obj)
 
         if not pts:
+            # trip endpoints are not positions, so a route built from them gets no watermark
+            from_positions = False
             logger.info('No positions found for %s on %s after history fetch', placa, date_obj)
             # attempt to extract trip endpoints as fallback (trips may have lat/lon and textual locations)
             try:
                 cur.execute(
                     """SELECT latitude_inicio_conducao, longitude_inicio_conducao,
-                               latitude_fim_conducao, longitude_fim_conducao
+                               latitude_fim_conducao, longitude_fim_conducao,
+                               localizacao_inicio_conducao, localizacao_fim_conducao
                        FROM trips
-                       WHERE placa = %s AND data_inicio_conducao BETWEEN %s AND %s
+                       WHERE placa = %s AND data_inicio_conducao >= %s AND data_inicio_conducao < %s
                     """,
                     (placa, start, end),
                 )
@@ -499,7 +915,7 @@ def build_and_store_route_for_date(conn, placa, date_obj, session=None, min_poin
                             pass
                     if lat2 and lon2:
                         try:
-                            pts.append({'lat': float(lat2), 'lon': float(lon2), 'ts': end.isoformat(), 'vel': None, 'addr': tr.get('localizacao_fim_conducao') or None})
+                            pts.append({'lat': float(lat2), 'lon': float(lon2), 'ts': (end - timedelta(seconds=1)).isoformat(), 'vel': None, 'addr': tr.get('localizacao_fim_conducao') or None})
                         except Exception:
                             pass
             except Exception:
@@ -511,6 +927,7 @@ def build_and_store_route_for_date(conn, placa, date_obj, session=None, min_poin
     start_ts = pts[0]['ts']
     end_ts = pts[-1]['ts']
     point_count = len(pts)
+    watermark = last_ts if from_positions else None
 
     # If we have too few points, optionally skip storing or still store depending on threshold
     if point_count < min_points_for_route:
@@ -520,18 +937,21 @@ def build_and_store_route_for_date(conn, placa, date_obj, session=None, min_poin
     # insert or update routes table
     try:
         cur.execute(
-            """INSERT INTO routes (placa, rota_date, points, start_ts, end_ts, point_count, raw)
-               VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """INSERT INTO routes (placa, rota_date, points, start_ts, end_ts, point_count, watermark, raw)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                ON CONFLICT (placa, rota_date) DO UPDATE SET
                  points = EXCLUDED.points,
                  start_ts = EXCLUDED.start_ts,
                  end_ts = EXCLUDED.end_ts,
                  point_count = EXCLUDED.point_count,
+                 watermark = EXCLUDED.watermark,
                  raw = EXCLUDED.raw,
                  created_at = now()
             """,
-            (placa, date_obj, psycopg2.extras.Json(pts), start_ts, end_ts, point_count, psycopg2.extras.Json({'generated': True}))
+            (placa, date_obj, psycopg2.extras.Json(encode_points(pts, ROUTE_STORAGE)), start_ts, end_ts, point_count, watermark,
+             psycopg2.extras.Json({'generated': True}))
         )
+        _store_route_stages(cur, date_obj, [(placa, route_stage_columns(pts))])
         conn.commit()
         logger.info('Stored route for %s on %s (%d points)', placa, date_obj, point_count)
         return point_count
@@ -541,6 +961,61 @@ def build_and_store_route_for_date(conn, placa, date_obj, session=None, min_poin
         return 0
 
 
+def build_routes_for_fleet(conn, date_obj, plates=None, session=None, min_points_for_route=3, incremental=None):
+    """Compute the routes of every plate for `date_obj` in one INSERT ... SELECT ... GROUP BY placa.
+
+    `plates` restricts the statement to those plates; any of them without
+    positions on that day then goes through build_and_store_route_for_date
+    (API history fetch when `session` is given, then the trips fallback).
+    With `incremental` (default ROUTE_INCREMENTAL) routes that have a
+    watermark are extended in place and only the others are rebuilt.
+    Returns {placa: point_count}.
+    """
+    started = time.monotonic()
+    incremental = ROUTE_INCREMENTAL if incremental is None else incremental
+    params = _day_params(date_obj, plates)
+    filters = []
+    if plates is not None:
+        filters.append('AND placa = ANY(%(plates)s)')
+    counts = {}
+    grown = {}
+    if incremental:
+        counts = routes_with_watermark(conn, date_obj, plates)
+        grown = append_route_points(conn, date_obj, plates)
+        counts.update(grown)
+        logger.info('Incremental refresh for %s: %d routes up to date, %d extended',
+                    date_obj, len(counts) - len(grown), len(grown))
+        filters.append("AND placa NOT IN (SELECT placa FROM routes WHERE rota_date = %(day)s"
+                       " AND watermark IS NOT NULL AND jsonb_typeof(points) = 'array')")
+    cur = conn.cursor()
+    try:
+        cur.execute(FLEET_ROUTES_SQL.format(plate_filter=' '.join(filters)), params)
+        built = dict(cur.fetchall())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    counts.update(built)
+    refresh_route_stages(conn, date_obj, list(built) + list(grown))
+    short = sum(1 for n in built.values() if n < min_points_for_route)
+    logger.info('Fleet routes for %s: %d plates stored in %.2fs (%d with < %d points)',
+                date_obj, len(built), time.monotonic() - started, short, min_points_for_route)
+
+    missing = [p for p in (plates or []) if p not in counts]
+    if missing:
+        logger.info('%d plates had no positions on %s; trying per-plate fallback', len(missing), date_obj)
+    for p in missing:
+        try:
+            n = build_and_store_route_for_date(conn, p, date_obj, session=session,
+                                               min_points_for_route=min_points_for_route, incremental=False)
+        except Exception:
+            logger.exception('Fallback route build failed for %s on %s', p, date_obj)
+            continue
+        if n:
+            counts[p] = n
+    return counts
+
+
 def fetch_month_for_plate(session, conn, placa, year, month):
     # build start and end strings in format DD/MM/YYYY HH:MM:SS
     first_day = datetime(year, month, 1)
@@ -563,11 +1038,10 @@ def fetch_month_for_plate(session, conn, placa, year, month):
     candidate_paths = [
         'ultimas-posicoes',
         'ultimasposicoes',
-        'ultimas-posicoes',
         'ultimas-posicoes-por-terminal',
     ]
-    found = 0
-    for p in candidate_paths:
+    matched = []
+    for p in ENDPOINTS.candidates('latest_positions_fallback', candidate_paths):
         url = f"{API_BASE.rstrip('/')}/{p}"
         try:
             r = post_with_retries(session, url, auth=auth(), timeout=60)
@@ -576,6 +1050,7 @@ def fetch_month_for_plate(session, conn, placa, year, month):
             continue
         if r.status_code == 404:
             print('Fallback: endpoint not found', url)
+            ENDPOINTS.forget('latest_positions_fallback', p)
             continue
         try:
             r.raise_for_status()
@@ -595,24 +1070,31 @@ def fetch_month_for_plate(session, conn, placa, year, month):
                 continue
             if dt < start_dt or dt > end_dt:
                 continue
-            # insert
-            upsert_terminal(conn, it)
-            insert_position(conn, it)
-            found += 1
-        if found > 0:
+            matched.append(it)
+        if matched:
+            ENDPOINTS.remember('latest_positions_fallback', p)
+            found = ingest_items(conn, matched, source=p)
             print(f'Fallback: found {found} positions for {placa} using {url}')
             return
 
     print('Fallback complete: no positions found for', placa)
 
 
-def fetch_trips(session, conn, placa, data_str):
+def request_trips(session, placa, data_str):
+    """Fetch the trip summary items for `placa` on `data_str` (DD/MM/YYYY)."""
     url = f"{API_BASE.rstrip('/')}/resumoviagens"
     payload = {'placa': placa, 'data': data_str}
     r = post_with_retries(session, url, auth=auth(), json=payload, timeout=60)
     r.raise_for_status()
     j = r.json()
-    items = extract_list(j)
+    return extract_list(j)
+
+
+def fetch_trips(session, conn, placa, data_str):
+    store_trips(conn, request_trips(session, placa, data_str))
+
+
+def store_trips(conn, items):
     cur = conn.cursor()
     for it in items:
         # map known fields
@@ -621,8 +1103,8 @@ def fetch_trips(session, conn, placa, data_str):
                 """INSERT INTO trips (placa, cliente, cliente_fantasia, data_inicio_conducao, data_fim_conducao,
                     latitude_inicio_conducao, longitude_inicio_conducao, latitude_fim_conducao, longitude_fim_conducao,
                     localizacao_inicio_conducao, localizacao_fim_conducao, odometro_inicio_conducao, odometro_fim_conducao,
-                    duracao_conducao, distancia_conducao, condutor_nome, condutor_identificacao, raw)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                    duracao_conducao, distancia_conducao, condutor_nome, condutor_identificacao, raw, raw_hash)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
                 """,
                 (
                     it.get('placa'), it.get('cliente'), it.get('cliente_fantasia'), parse_date(it.get('data_inicio_conducao')),
@@ -631,23 +1113,44 @@ def fetch_trips(session, conn, placa, data_str):
                     it.get('latitude_fim_conducao'), it.get('longitude_fim_conducao'),
                     it.get('localizacao_inicio_conducao'), it.get('localizacao_fim_conducao'),
                     it.get('odometro_inicio_conducao'), it.get('odometro_fim_conducao'),
-                    it.get('duracao_conducao'), it.get('distancia_conducao'), it.get('condutor_nome'), it.get('condutor_identificacao'), psycopg2.extras.Json(it)
+                    it.get('duracao_conducao'), it.get('distancia_conducao'), it.get('condutor_nome'), it.get('condutor_identificacao'),
+                    TRIP_RAW.raw(it), TRIP_RAW.raw_hash(it)
                 ),
             )
         except Exception as e:
             print('Erro inserindo viagem:', e, 'item:', it)
+    store_raw_payloads(cur)
     conn.commit()
 
 
+def build_async_jobs(session, conn, latest, history_plates, trips_plates, data=None, inicio=None, fim=None):
+    """Build (label, fetch, write) jobs for async_engine from collector operations."""
+    jobs = []
+    if latest:
+        jobs.append(('ultimas-posicoes',
+                     lambda: request_latest_positions(session),
+                     lambda items: ingest_items(conn, items, source='ultimas-posicoes')))
+    for placa in history_plates:
+        jobs.append((f'history {placa}',
+                     lambda placa=placa: request_terminal_history(session, placa, data=data, inicio=inicio, fim=fim),
+                     lambda res: ingest_items(conn, res[1], source=res[0])))
+    for placa in trips_plates:
+        jobs.append((f'trips {placa}',
+                     lambda placa=placa: request_trips(session, placa, data),
+                     lambda items: store_trips(conn, items)))
+    return jobs
+
+
 def main():
+    global LOADER, BULK_BATCH_SIZE, ROUTE_AGGREGATION, ROUTE_INCREMENTAL, ROUTE_STORAGE, RAW_MODE
     parser = argparse.ArgumentParser(description='Coletor eTrac -> Postgres')
     parser.add_argument('--fetch-latest', action='store_true')
     parser.add_argument('--fetch-plate', help='Buscar última posição da placa informada')
-    parser.add_argument('--fetch-history', help='Buscar histórico de terminal (placa)')
+    parser.add_argument('--fetch-history', help='Buscar histórico de terminal (placa; várias separadas por vírgula)')
     parser.add_argument('--date', help='Data (DD/MM/YYYY ou DD-MM-YYYY) para histórico ou viagens')
     parser.add_argument('--date-start', help='Data/hora início para histórico')
     parser.add_argument('--date-end', help='Data/hora fim para histórico')
-    parser.add_argument('--fetch-trips', help='Buscar resumo de viagens para placa (requer --date)')
+    parser.add_argument('--fetch-trips', help='Buscar resumo de viagens para placa (várias separadas por vírgula; requer --date)')
     parser.add_argument('--fetch-current-month-plate', help='Buscar histórico do mês atual para a placa informada')
     parser.add_argument('--fetch-current-month-all', action='store_true', help='Buscar histórico do mês atual para todas as placas')
     parser.add_argument('--compute-route-plate', help='Compute and store route for a plate for given date (use --date)')
@@ -655,28 +1158,42 @@ def main():
     parser.add_argument('--compute-routes-current-day-all', action='store_true', help='Compute and store routes for current day for all plates')
     parser.add_argument('--plates-file', help='Path to file with one plate per line to operate on (overrides discovery)')
     parser.add_argument('--plates', help='Comma-separated list of plates to operate on (overrides discovery)')
+    parser.add_argument('--loader', choices=LOADERS, default=LOADER,
+                        help='How positions are written: row (per-item commit), bulk (batched multi-row INSERTs) '
+                             'or copy (COPY into a staging table + single merge)')
+    parser.add_argument('--bulk-batch-size', type=int, default=BULK_BATCH_SIZE, help='Rows per batch for --loader bulk')
+    parser.add_argument('--engine', choices=('sync', 'async'), default=os.getenv('ETRAC_ENGINE', 'sync'),
+                        help='sync: one request at a time; async: concurrent requests for --fetch-latest/--fetch-history/--fetch-trips '
+                             'with DB writes overlapped')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('ETRAC_CONCURRENCY', '8')),
+                        help='Max in-flight API requests for --engine async')
+    parser.add_argument('--fleet', action='store_true',
+                        help='With --compute-routes-current-day-all: build all routes in one SQL statement '
+                             '(per-plate fallback only for plates without positions)')
+    parser.add_argument('--route-agg', choices=ROUTE_AGGREGATIONS, default=ROUTE_AGGREGATION,
+                        help='Where route points are assembled: python (fetch rows) or sql (jsonb_agg on the server)')
+    parser.add_argument('--incremental', action='store_true', default=ROUTE_INCREMENTAL,
+                        help='Extend existing routes with positions newer than their watermark instead of rebuilding them')
+    parser.add_argument('--route-storage', choices=ROUTE_FORMATS, default=ROUTE_STORAGE,
+                        help='How routes.points is stored: points (list of dicts), columnar or polyline (compact)')
+    parser.add_argument('--raw-mode', choices=RAW_MODES, default=RAW_MODE,
+                        help='Raw payload kept per position/trip: full, residual (non-normalized keys) or hashed (shared in raw_payloads)')
+    parser.add_argument('--recent-keys', type=int, default=RECENT_KEYS.maxsize,
+                        help='Position keys kept in memory to skip known duplicates before inserting (0 disables)')
     args = parser.parse_args()
 
-    # load environment from repository root .env (do not override existing env vars)
-    here = os.path.dirname(__file__)
-    repo_root = os.path.abspath(os.path.join(here, '..'))
-    load_dotenv(os.path.join(repo_root, '.env'), override=False)
+    LOADER = args.loader
+    BULK_BATCH_SIZE = max(1, args.bulk_batch_size)
+    ROUTE_AGGREGATION = args.route_agg
+    ROUTE_INCREMENTAL = args.incremental
+    ROUTE_STORAGE = args.route_storage
+    RECENT_KEYS.maxsize = max(0, args.recent_keys)
+    RAW_MODE = args.raw_mode
+    set_raw_mode(RAW_MODE)
 
-    # Re-read Postgres-related env vars after loading .env so module-level
-    # defaults (evaluated at import time) are updated with values from .env.
-    global PG_DSN, PG_HOST, PG_PORT, PG_DB, PG_USER, PG_PASSWORD
-    PG_DSN = os.getenv('DATABASE_URL') or PG_DSN
-    PG_HOST = os.getenv('PGHOST', PG_HOST or 'localhost')
-    PG_PORT = os.getenv('PGPORT', PG_PORT or '5432')
-    PG_DB = os.getenv('PGDATABASE') or PG_DB
-    PG_USER = os.getenv('PGUSER') or PG_USER
-    PG_PASSWORD = os.getenv('PGPASSWORD') or PG_PASSWORD
-    # Re-read e-Track API credentials as well so auth() sees .env values
-    global ETRAC_USER, ETRAC_KEY
-    ETRAC_USER = os.getenv('ETRAC_USER') or ETRAC_USER
-    ETRAC_KEY = os.getenv('ETRAC_KEY') or ETRAC_KEY
+    load_env()
 
-    session = requests.Session()
+    session = get_session(args.concurrency if args.engine == 'async' else None)
     conn = pg_connect()
 
     # Apply schema search_path based on env or default to e_track
@@ -690,6 +1207,28 @@ def main():
 
     ensure_tables(conn)
 
+    if RECENT_KEYS.enabled and (args.fetch_latest or args.fetch_plate or args.fetch_history
+                                or args.fetch_current_month_plate or args.fetch_current_month_all):
+        now = datetime.now()
+        RECENT_KEYS.warm(conn, now - timedelta(hours=RECENT_KEYS_WARM_HOURS), now + timedelta(days=1))
+
+    history_plates = [p.strip() for p in (args.fetch_history or '').split(',') if p.strip()]
+    trips_plates = [p.strip() for p in (args.fetch_trips or '').split(',') if p.strip()]
+    if args.fetch_trips and not args.date:
+        print('Para buscar trips informe --date')
+        trips_plates = []
+
+    if args.engine == 'async':
+        jobs = build_async_jobs(session, conn, args.fetch_latest, history_plates, trips_plates,
+                                data=args.date, inicio=args.date_start, fim=args.date_end)
+        if jobs:
+            print(f'Executando {len(jobs)} requisições com engine async (concorrência {args.concurrency})...')
+            async_engine.run(jobs, concurrency=args.concurrency)
+            print('Concluído engine async')
+        # handled above; skip the sequential versions below
+        args.fetch_latest = False
+        history_plates = trips_plates = []
+
     if args.fetch_latest:
         print('Buscando últimas posições da frota...')
         fetch_latest_positions(session, conn)
@@ -698,17 +1237,14 @@ def main():
         print('Buscando última posição para', args.fetch_plate)
         fetch_last_position_for_plate(session, conn, args.fetch_plate)
         print('Concluído fetch-plate')
-    if args.fetch_history:
-        print('Buscando histórico para', args.fetch_history)
-        fetch_terminal_history(session, conn, args.fetch_history, data=args.date, inicio=args.date_start, fim=args.date_end)
+    for placa in history_plates:
+        print('Buscando histórico para', placa)
+        fetch_terminal_history(session, conn, placa, data=args.date, inicio=args.date_start, fim=args.date_end)
         print('Concluído fetch-history')
-    if args.fetch_trips:
-        if not args.date:
-            print('Para buscar trips informe --date')
-        else:
-            print('Buscando trips para', args.fetch_trips, 'data', args.date)
-            fetch_trips(session, conn, args.fetch_trips, args.date)
-            print('Concluído fetch-trips')
+    for placa in trips_plates:
+        print('Buscando trips para', placa, 'data', args.date)
+        fetch_trips(session, conn, placa, args.date)
+        print('Concluído fetch-trips')
     if args.fetch_current_month_plate:
         placa = args.fetch_current_month_plate
         now = datetime.now()
@@ -756,7 +1292,7 @@ def main():
             # Prefer plates from DB (includes newly discovered ones from fetch_latest_positions)
             try:
                 cur = conn.cursor()
-                cur.execute("SELECT DISTINCT placa FROM positions WHERE placa IS NOT NULL")
+                cur.execute(DISTINCT_PLATES_SQL)
                 rows = cur.fetchall()
                 plates = [r[0] for r in rows if r and r[0]]
                 logger.info('Discovered %d plates from DB', len(plates))
@@ -766,6 +1302,12 @@ def main():
 
         if not plates:
             logger.warning('No plates to process for compute-routes-current-day-all')
+        elif args.fleet:
+            try:
+                build_routes_for_fleet(conn, date_obj, plates, session=session)
+            except Exception:
+                logger.exception('Fleet route build failed for %s', date_obj)
+            plates = []
         for p in plates:
             try:
                 build_and_store_route_for_date(conn, p, date_obj, session=session)
@@ -783,6 +1325,9 @@ def main():
                 print('Erro ao buscar mês para', p, e)
         print('Concluído fetch-current-month-all')
     conn.close()
+    logger.debug('HTTP session: %s', session_stats())
+    if RECENT_KEYS.sent or RECENT_KEYS.skipped:
+        logger.info('Recent-key filter: %s', RECENT_KEYS.stats())
 
 
 if __name__ == '__main__':
@@ -5,10 +5,13 @@ Reuses logic in `collector.py`. Features:
 - advisory lock to avoid concurrent runs
 - configurable sleep between plates (rate-limit)
 - batch processing and simple logging
+- optional thread pool (`--workers`) sharing one token-bucket API rate limit
 """
 import os
 import time
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import logging
 from dotenv import load_dotenv
@@ -18,6 +21,8 @@ repo_root = os.path.abspath(os.path.join(here, '..'))
 load_dotenv(os.path.join(repo_root, '.env'), override=False)
 
 import collector
+from http_retry import DEFAULT_RATE, RATE_LIMIT, circuit_stats, limiter_stats, make_limiter, set_rate_limiter
+from http_session import get_session, session_stats
 
 LOG = logging.getLogger('e-track.daily_runner')
 LOG.setLevel(os.getenv('ETRAC_LOG_LEVEL', 'INFO').upper())
@@ -49,42 +54,148 @@ def release_lock(conn):
 def discover_plates_from_db(conn):
     cur = conn.cursor()
     try:
-        cur.execute("SELECT DISTINCT placa FROM positions WHERE placa IS NOT NULL")
+        cur.execute(collector.DISTINCT_PLATES_SQL)
         rows = cur.fetchall()
         plates = [r[0] for r in rows if r and r[0]]
         LOG.info('Discovered %d plates from DB', len(plates))
         return plates
     except Exception:
         LOG.exception('Failed to discover plates from DB; falling back to API discovery')
-        session = collector.requests.Session()
-        return collector.get_all_plates(session)
+        return collector.get_all_plates(get_session())
 
 
-def process_plates(conn, plates, date_obj, sleep_between=0.2, batch_size=50):
-    session = collector.requests.Session()
+def process_plate(conn, session, p, date_obj, build=True):
+    """Fetch history and (unless `build` is false) build the route for one plate.
+    Returns (plate, ok, points, seconds).
+    """
+    started = time.monotonic()
+    try:
+        LOG.info('Fetching history for %s', p)
+        # API expects DD/MM/YYYY
+        date_str = date_obj.strftime('%d/%m/%Y')
+        try:
+            collector.fetch_terminal_history(session, conn, p, data=date_str)
+        except Exception:
+            LOG.debug('fetch_terminal_history did not succeed (may be optional), continuing to compute')
+        if not build:
+            return p, True, 0, time.monotonic() - started
+
+        n = collector.build_and_store_route_for_date(conn, p, date_obj, session=session)
+        LOG.info('Stored route for %s -> %d points', p, n)
+        return p, True, n, time.monotonic() - started
+    except Exception:
+        LOG.exception('Failed processing plate %s', p)
+        return p, False, 0, time.monotonic() - started
+
+
+def report(results, elapsed):
+    """Log aggregated progress, failures and per-plate latency."""
+    if not results:
+        return
+    latencies = sorted(r[3] for r in results)
+    failed = [r[0] for r in results if not r[1]]
+
+    def pct(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    LOG.info('Completed %d plates in %.1fs: %d ok, %d failed, %d points stored',
+             len(results), elapsed, len(results) - len(failed), len(failed), sum(r[2] for r in results))
+    LOG.info('Per-plate latency: avg %.2fs p50 %.2fs p95 %.2fs max %.2fs',
+             sum(latencies) / len(latencies), pct(0.50), pct(0.95), latencies[-1])
+    if failed:
+        LOG.warning('Failed plates: %s', ', '.join(failed))
+    stats = limiter_stats()
+    if stats:
+        LOG.info('API rate limiter: %s', stats)
+    circuits = circuit_stats()
+    if circuits:
+        LOG.warning('API circuits: %s', circuits)
+    LOG.info('HTTP connection reuse: %s', session_stats())
+    if collector.RECENT_KEYS.enabled:
+        LOG.info('Recent-key filter: %s', collector.RECENT_KEYS.stats())
+
+
+def process_plates(conn, plates, date_obj, sleep_between=0.2, batch_size=50, build=True):
+    session = get_session()
     total = len(plates)
     LOG.info('Processing %d plates for date %s', total, date_obj)
-    processed = 0
+    started = time.monotonic()
+    results = []
     for i in range(0, total, batch_size):
         batch = plates[i:i+batch_size]
         LOG.info('Processing batch %d..%d', i+1, i+len(batch))
         for p in batch:
+            results.append(process_plate(conn, session, p, date_obj, build))
+            time.sleep(sleep_between)
+    report(results, time.monotonic() - started)
+    return results
+
+
+def process_plates_concurrent(plates, date_obj, workers, build=True):
+    """Process plates on a thread pool; each worker has its own DB connection,
+    HTTP goes through the shared session sized for `workers`. API pacing comes
+    from the shared limiter in http_retry."""
+    local = threading.local()
+    opened = []
+    opened_lock = threading.Lock()
+
+    session = get_session(workers)
+
+    def worker_conn():
+        if not hasattr(local, 'conn'):
+            local.conn = connect()
+            with opened_lock:
+                opened.append(local.conn)
+        return local.conn
+
+    def run(p):
+        try:
+            conn = worker_conn()
+        except Exception:
+            LOG.exception('Worker could not connect to Postgres for plate %s', p)
+            return p, False, 0, 0.0
+        return process_plate(conn, session, p, date_obj, build)
+
+    total = len(plates)
+    LOG.info('Processing %d plates for date %s with %d workers', total, date_obj, workers)
+    started = time.monotonic()
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='plate') as pool:
+            futures = [pool.submit(run, p) for p in plates]
+            for fut in as_completed(futures):
+                results.append(fut.result())
+                if len(results) % 50 == 0 or len(results) == total:
+                    LOG.info('Progress: %d/%d plates', len(results), total)
+    finally:
+        for c in opened:
             try:
-                LOG.info('Fetching history for %s', p)
-                # API expects DD/MM/YYYY
-                date_str = date_obj.strftime('%d/%m/%Y')
-                try:
-                    collector.fetch_terminal_history(session, conn, p, data=date_str)
-                except Exception:
-                    LOG.debug('fetch_terminal_history did not succeed (may be optional), continuing to compute')
-
-                n = collector.build_and_store_route_for_date(conn, p, date_obj, session=session)
-                LOG.info('Stored route for %s -> %d points', p, n)
+                c.close()
             except Exception:
-                LOG.exception('Failed processing plate %s', p)
-            processed += 1
-            time.sleep(sleep_between)
-    LOG.info('Completed processing %d plates', processed)
+                pass
+    report(results, time.monotonic() - started)
+    return results
+
+
+def build_fleet_routes(conn, plates, date_obj):
+    """Build every plate's route with one set-based statement after the history fetch."""
+    started = time.monotonic()
+    # histories were fetched already; the per-plate fallback only needs the trips lookup
+    counts = collector.build_routes_for_fleet(conn, date_obj, plates)
+    missing = len(plates) - len(counts)
+    LOG.info('Fleet build: %d routes, %d points in %.1fs; %d plates without route',
+             len(counts), sum(counts.values()), time.monotonic() - started, missing)
+    return counts
+
+
+def connect():
+    """Open a connection with search_path set to the e-track schema."""
+    conn = collector.pg_connect()
+    schema = os.getenv('ETRAC_SCHEMA', 'e_track')
+    cur = conn.cursor()
+    cur.execute(collector.sql.SQL("SET search_path = {}, public").format(collector.sql.Identifier(schema)))
+    conn.commit()
+    return conn
 
 
 def main():
@@ -96,7 +207,25 @@ def main():
                         help='Seconds to sleep between plates (rate-limit)')
     parser.add_argument('--batch-size', type=int, default=int(os.getenv('ETRAC_BATCH_SIZE', '50')),
                         help='Number of plates per batch')
+    parser.add_argument('--loader', choices=collector.LOADERS, default=collector.LOADER,
+                        help='How fetched positions are written (row, bulk or copy)')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('ETRAC_WORKERS', '1')),
+                        help='Plates processed in parallel (each worker has its own DB connection)')
+    parser.add_argument('--rate', type=float, default=RATE_LIMIT or DEFAULT_RATE,
+                        help='Initial e-Track API requests per second shared by all workers (with --workers > 1); '
+                             'adapted up/down from 429/5xx feedback')
+    parser.add_argument('--burst', type=float, default=float(os.getenv('ETRAC_RATE_BURST', '0')) or None,
+                        help='Token-bucket burst size (defaults to --rate)')
+    parser.add_argument('--fleet', action='store_true',
+                        help='Fetch histories per plate, then build all routes in one SQL statement')
+    parser.add_argument('--route-agg', choices=collector.ROUTE_AGGREGATIONS, default=collector.ROUTE_AGGREGATION,
+                        help='Where route points are assembled: python (fetch rows) or sql (jsonb_agg on the server)')
+    parser.add_argument('--incremental', action='store_true', default=collector.ROUTE_INCREMENTAL,
+                        help='Extend existing routes with positions newer than their watermark instead of rebuilding them')
     args = parser.parse_args()
+    collector.LOADER = args.loader
+    collector.ROUTE_AGGREGATION = args.route_agg
+    collector.ROUTE_INCREMENTAL = args.incremental
 
     # determine date
     if args.date:
@@ -109,12 +238,8 @@ def main():
         # default to yesterday
         date_obj = (datetime.now() - timedelta(days=1)).date()
 
-    conn = collector.pg_connect()
     # ensure schema set as collector does in main
-    schema = os.getenv('ETRAC_SCHEMA', 'e_track')
-    cur = conn.cursor()
-    cur.execute(collector.sql.SQL("SET search_path = {}, public").format(collector.sql.Identifier(schema)))
-    conn.commit()
+    conn = connect()
 
     # try to acquire advisory lock
     if not acquire_lock(conn):
@@ -135,7 +260,19 @@ def main():
             LOG.warning('No plates found to process')
             return
 
-        process_plates(conn, plates, date_obj, sleep_between=args.sleep, batch_size=args.batch_size)
+        if collector.RECENT_KEYS.enabled:
+            # re-running a day skips the positions already stored for it
+            day = datetime.combine(date_obj, datetime.min.time())
+            collector.RECENT_KEYS.warm(conn, day, day + timedelta(days=1), plates)
+
+        build = not args.fleet
+        if args.workers > 1:
+            set_rate_limiter(make_limiter(args.rate, burst=args.burst))
+            process_plates_concurrent(plates, date_obj, args.workers, build)
+        else:
+            process_plates(conn, plates, date_obj, sleep_between=args.sleep, batch_size=args.batch_size, build=build)
+        if args.fleet:
+            build_fleet_routes(conn, plates, date_obj)
 
     finally:
         release_lock(conn)
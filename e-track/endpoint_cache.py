@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Remember which candidate path answers each logical e-Track operation.
+
+Endpoint names vary across e-Track installations, so the collector probes a
+list of candidates. The resolver keeps the path that worked per operation in a
+small JSON file (with a TTL) so later calls go straight to it; the cached path
+is dropped, and the candidates probed again, only after it returns 404.
+
+Set ETRAC_ENDPOINT_CACHE to an empty string to keep the cache in memory only.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+LOG = logging.getLogger('e-track.endpoint_cache')
+
+DEFAULT_PATH = os.getenv('ETRAC_ENDPOINT_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.endpoint_cache.json'))
+DEFAULT_TTL = float(os.getenv('ETRAC_ENDPOINT_CACHE_TTL', str(7 * 24 * 3600)))
+
+
+class EndpointResolver:
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fh:
+                data = json.load(fh)
+            return data if isinstance(data, dict) else {}
+        except Exception:
+            LOG.warning('Ignoring unreadable endpoint cache %s', self.path)
+            return {}
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as fh:
+                json.dump(self._entries, fh, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+        except Exception:
+            LOG.warning('Could not persist endpoint cache to %s', self.path, exc_info=True)
+
+    def cached(self, operation):
+        """Return the remembered path for `operation`, or None if missing/expired."""
+        with self._lock:
+            entry = self._entries.get(operation)
+        if not entry:
+            return None
+        if self.ttl and time.time() - entry.get('resolved_at', 0) > self.ttl:
+            return None
+        return entry.get('path')
+
+    def candidates(self, operation, paths):
+        """Return `paths` without duplicates, with the cached path (if any) first."""
+        ordered = []
+        cached = self.cached(operation)
+        if cached:
+            ordered.append(cached)
+        for p in paths:
+            if p not in ordered:
+                ordered.append(p)
+        return ordered
+
+    def remember(self, operation, path):
+        with self._lock:
+            entry = self._entries.get(operation)
+            if entry and entry.get('path') == path and time.time() - entry.get('resolved_at', 0) < self.ttl / 2:
+                return
+            self._entries[operation] = {'path': path, 'resolved_at': time.time()}
+            self._save()
+        LOG.debug('Resolved %s -> %s', operation, path)
+
+    def forget(self, operation, path):
+        """Drop the cached entry for `operation` if it points at `path`."""
+        with self._lock:
+            entry = self._entries.get(operation)
+            if not entry or entry.get('path') != path:
+                return
+            del self._entries[operation]
+            self._save()
+        LOG.info('Cached endpoint %s for %s returned 404; re-probing candidates', path, operation)
@@ -2,9 +2,22 @@
 """Small HTTP helper with retries and backoff for e-track collector.
 
 Does not add external dependencies; uses simple exponential backoff.
+A process-wide adaptive rate limiter (see `set_rate_limiter`) paces every
+request made through `post_with_retries`, across threads: it honors
+`Retry-After` and adjusts the request rate with AIMD on 429/5xx feedback.
+It is off unless ETRAC_RATE_LIMIT (initial req/s) is set; ETRAC_RATE_MIN and
+ETRAC_RATE_MAX bound the adapted rate. `daily_routes_runner --workers` installs
+one at DEFAULT_RATE when ETRAC_RATE_LIMIT is unset.
+Each endpoint URL also has a circuit breaker: after ETRAC_CIRCUIT_THRESHOLD
+consecutive failed attempts (network errors or 5xx) calls fail fast with
+`CircuitOpenError` until ETRAC_CIRCUIT_COOLDOWN seconds have passed, then a
+single probe decides whether the circuit closes again.
 """
+import os
 import time
 import logging
+import threading
+from email.utils import parsedate_to_datetime
 from typing import Any, Optional
 import random
 import requests
@@ -12,13 +25,230 @@ import requests
 LOG = logging.getLogger('e-track.http_retry')
 
 
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second, bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.capacity = float(burst) if burst else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and consume it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """Token bucket whose rate follows AIMD: every successful response adds
+    `increase` req/s (up to `max_rate`), a 429/5xx multiplies the rate by
+    `decrease` (down to `min_rate`). A `Retry-After` pauses all callers.
+    """
+
+    def __init__(self, rate: float, min_rate: float = 0.2, max_rate: Optional[float] = None,
+                 increase: float = 0.05, decrease: float = 0.5, burst: Optional[float] = None):
+        super().__init__(rate, burst)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate) if max_rate else self.rate * 4
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self.successes = 0
+        self.throttled = 0
+        self.server_errors = 0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                wait = self._paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        super().acquire()
+
+    def on_success(self):
+        with self._lock:
+            self.successes += 1
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, status: int, retry_after: Optional[float] = None):
+        now = time.monotonic()
+        with self._lock:
+            if status == 429:
+                self.throttled += 1
+            else:
+                self.server_errors += 1
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            # concurrent callers report the same congestion event; cut once per interval
+            if now - self._last_decrease >= 1.0 / self.rate:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._tokens = min(self._tokens, 1.0)
+                self._last_decrease = now
+                LOG.info('Throttled (status %d): request rate lowered to %.2f req/s', status, self.rate)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'rate': round(self.rate, 3),
+                'successes': self.successes,
+                'throttled': self.throttled,
+                'server_errors': self.server_errors,
+                'paused_for': round(max(0.0, self._paused_until - time.monotonic()), 3),
+            }
+
+
+# initial req/s of a limiter installed without ETRAC_RATE_LIMIT (e.g. runner --workers)
+DEFAULT_RATE = 5.0
+# 0 (unset) leaves the process-wide limiter off
+RATE_LIMIT = float(os.getenv('ETRAC_RATE_LIMIT', '0'))
+
+
+def make_limiter(rate: float, burst: Optional[float] = None) -> AdaptiveRateLimiter:
+    """AdaptiveRateLimiter starting at `rate`, bounded by ETRAC_RATE_MIN/ETRAC_RATE_MAX."""
+    return AdaptiveRateLimiter(rate, min_rate=float(os.getenv('ETRAC_RATE_MIN', '0.2')),
+                               max_rate=float(os.getenv('ETRAC_RATE_MAX', '0')) or None, burst=burst)
+
+
+_RATE_LIMITER: Optional[TokenBucket] = make_limiter(RATE_LIMIT) if RATE_LIMIT > 0 else None
+
+
+def set_rate_limiter(limiter: Optional[TokenBucket]):
+    """Install (or remove, with None) the limiter shared by all post_with_retries calls."""
+    global _RATE_LIMITER
+    _RATE_LIMITER = limiter
+
+
+def get_rate_limiter() -> Optional[TokenBucket]:
+    return _RATE_LIMITER
+
+
+def limiter_stats() -> dict:
+    """Current rate and throttle counters of the shared limiter ({} if none/not adaptive)."""
+    limiter = _RATE_LIMITER
+    return limiter.stats() if hasattr(limiter, 'stats') else {}
+
+
+def parse_retry_after(value: Optional[str], cap: float = 300.0) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except Exception:
+            return None
+    return min(cap, max(0.0, seconds))
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling an endpoint whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one endpoint.
+
+    closed -> open after `threshold` consecutive failures; open -> half-open
+    once `cooldown` seconds have passed, letting one probe through; the probe
+    closes the circuit on success or re-opens it on failure.
+    """
+
+    def __init__(self, name: str, threshold: int = 5, cooldown: float = 30.0):
+        self.name = name
+        self.threshold = int(threshold)
+        self.cooldown = float(cooldown)
+        self.state = 'closed'
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str):
+        if state != self.state:
+            LOG.warning('Circuit for %s: %s -> %s (%d consecutive failures)', self.name, self.state, state, self.failures)
+            self.state = state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.cooldown:
+                self._transition('half-open')
+            if self.state == 'half-open' and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._probing = False
+            self.failures = 0
+            self._transition('closed')
+
+    def record_failure(self):
+        with self._lock:
+            self._probing = False
+            self.failures += 1
+            if self.state == 'half-open' or self.failures >= self.threshold:
+                self._opened_at = time.monotonic()
+                self._transition('open')
+
+    def retry_in(self) -> float:
+        with self._lock:
+            return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+
+CIRCUIT_THRESHOLD = int(os.getenv('ETRAC_CIRCUIT_THRESHOLD', '5'))
+CIRCUIT_COOLDOWN = float(os.getenv('ETRAC_CIRCUIT_COOLDOWN', '30'))
+_CIRCUITS = {}
+_CIRCUITS_LOCK = threading.Lock()
+
+
+def get_circuit(url: str) -> Optional[CircuitBreaker]:
+    """Breaker for `url` (created on first use); None when ETRAC_CIRCUIT_THRESHOLD is 0."""
+    if CIRCUIT_THRESHOLD <= 0:
+        return None
+    with _CIRCUITS_LOCK:
+        breaker = _CIRCUITS.get(url)
+        if breaker is None:
+            breaker = _CIRCUITS[url] = CircuitBreaker(url, CIRCUIT_THRESHOLD, CIRCUIT_COOLDOWN)
+        return breaker
+
+
+def circuit_stats() -> dict:
+    """State and counters of circuits that are not closed or have rejected calls."""
+    with _CIRCUITS_LOCK:
+        breakers = list(_CIRCUITS.values())
+    return {b.name: {'state': b.state, 'failures': b.failures, 'rejected': b.rejected}
+            for b in breakers if b.state != 'closed' or b.rejected}
+
+
 def post_with_retries(session: requests.Session, url: str, auth: Optional[Any] = None, json: Optional[dict] = None,
                       timeout: Any = (10, 60), max_attempts: int = 4, backoff_factor: float = 0.5):
     """POST with simple retry/backoff.
 
     timeout: either a single number (total timeout) or a (connect, read) tuple. Default is (10, 60).
     Retries on network errors, timeouts, and 5xx responses. For 429 will also backoff.
-    Raises the final exception or returns the successful Response.
+    Raises the final exception or returns the successful Response; raises
+    CircuitOpenError without calling the endpoint while its circuit is open.
     """
     attempt = 0
     # normalize timeout: if a single number is provided, treat it as the total/read timeout
@@ -27,13 +257,21 @@ def post_with_retries(session: requests.Session, url: str, auth: Optional[Any] =
         total_timeout = float(timeout)
         connect_timeout = 10.0 if total_timeout > 10.0 else total_timeout
         timeout = (connect_timeout, total_timeout)
+    breaker = get_circuit(url)
     while True:
         attempt += 1
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(f'Circuit open for {url}; retry in {breaker.retry_in():.0f}s')
+        limiter = _RATE_LIMITER
+        if limiter is not None:
+            limiter.acquire()
         try:
             resp = session.post(url, auth=auth, json=json, timeout=timeout)
         except Exception as e:
             # log exception class to help distinguish connect vs read timeouts
             LOG.warning('Request exception attempt %d for %s: %s (%s)', attempt, url, type(e).__name__, e)
+            if breaker is not None:
+                breaker.record_failure()
             if attempt >= max_attempts:
                 LOG.exception('Max attempts reached for %s', url)
                 raise
@@ -46,6 +284,15 @@ def post_with_retries(session: requests.Session, url: str, auth: Optional[Any] =
         # if response is 429 or 5xx, retry
         if resp.status_code == 429 or 500 <= resp.status_code < 600:
             LOG.warning('Retryable status %d for %s (attempt %d)', resp.status_code, url, attempt)
+            retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+            if hasattr(limiter, 'on_throttle'):
+                limiter.on_throttle(resp.status_code, retry_after)
+            if breaker is not None:
+                # 429 means the endpoint is alive but busy; leave it to the rate limiter
+                if resp.status_code == 429:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
             if attempt >= max_attempts:
                 try:
                     resp.raise_for_status()
@@ -57,7 +304,13 @@ def post_with_retries(session: requests.Session, url: str, auth: Optional[Any] =
             else:
                 sleep = backoff_factor * (2 ** (attempt - 1))
             sleep = sleep * (1.0 + random.random() * 0.2)
+            if retry_after is not None:
+                sleep = max(sleep, retry_after)
             time.sleep(sleep)
             continue
 
+        if hasattr(limiter, 'on_success'):
+            limiter.on_success()
+        if breaker is not None:
+            breaker.record_success()
         return resp
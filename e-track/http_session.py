@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Shared HTTP session for the e-Track tools.
+
+Collector, runners, backfill and the web UI refresh all go through
+`get_session()`, so keep-alive connections and TLS sessions to the API are
+reused across plates, days and threads instead of being rebuilt for every
+call. The mounted `HTTPAdapter` keeps as many connections per host as there
+are workers (`pool_size`, env ETRAC_HTTP_POOL_SIZE) and responses are
+requested gzip-compressed. `session_stats()` reports how many requests were
+served over an already open connection.
+"""
+import os
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+LOG = logging.getLogger('e-track.http_session')
+
+DEFAULT_POOL_SIZE = int(os.getenv('ETRAC_HTTP_POOL_SIZE', '10'))
+
+_SESSION = None
+_POOL_SIZE = 0
+_LOCK = threading.Lock()
+# counters of adapters replaced by a larger pool (see get_session)
+_RETIRED = {'connections': 0, 'requests': 0}
+
+
+def _adapter_counts(adapter):
+    pools = adapter.poolmanager.pools
+    connections = requests_ = 0
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is not None:
+            connections += pool.num_connections
+            requests_ += pool.num_requests
+    return connections, requests_
+
+
+def _mount(session, pool_size):
+    # retries are done by http_retry.post_with_retries, not by urllib3
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+def get_session(pool_size=None):
+    """Return the process-wide session, creating it on first use.
+
+    `pool_size` is the number of threads expected to share it; a later call
+    with a larger value re-mounts the adapter with a bigger pool.
+    """
+    global _SESSION, _POOL_SIZE
+    pool_size = max(int(pool_size or 0), DEFAULT_POOL_SIZE)
+    with _LOCK:
+        if _SESSION is None:
+            _SESSION = requests.Session()
+            _SESSION.headers['Accept-Encoding'] = 'gzip, deflate'
+            _mount(_SESSION, pool_size)
+            _POOL_SIZE = pool_size
+            LOG.debug('Created shared HTTP session (pool size %d)', pool_size)
+        elif pool_size > _POOL_SIZE:
+            old = _SESSION.get_adapter('https://')
+            connections, requests_ = _adapter_counts(old)
+            _RETIRED['connections'] += connections
+            _RETIRED['requests'] += requests_
+            _mount(_SESSION, pool_size)
+            old.close()
+            _POOL_SIZE = pool_size
+            LOG.debug('Grew shared HTTP session pool to %d', pool_size)
+        return _SESSION
+
+
+def session_stats():
+    """Connection reuse counters of the shared session ({} before first use)."""
+    with _LOCK:
+        if _SESSION is None:
+            return {}
+        connections, requests_ = _adapter_counts(_SESSION.get_adapter('https://'))
+        connections += _RETIRED['connections']
+        requests_ += _RETIRED['requests']
+        pool_size = _POOL_SIZE
+    reused = max(0, requests_ - connections)
+    return {
+        'pool_size': pool_size,
+        'requests': requests_,
+        'connections': connections,
+        'reused': reused,
+        'reuse_ratio': round(reused / requests_, 3) if requests_ else 0.0,
+    }
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""Schema-driven normalizer for e-Track payloads.
+
+Per-field converters are built once when a `RecordNormalizer` is created,
+and timestamp parsing remembers which format matched for each source
+(endpoint) and field, so following rows try that format first.
+
+How much of the API item is kept next to the normalized columns is decided by
+a `RawPolicy` (see RAW_MODES / set_raw_mode).
+"""
+import hashlib
+import json
+import re
+import threading
+from datetime import datetime
+import psycopg2.extras
+
+# first occurrence of a number in strings like '0 km/h', '12,6 V', '1.234,5'
+NUMBER_RE = re.compile(r"[-+]?[0-9]{1,3}(?:[0-9\.,]*[0-9])?")
+
+# formats accepted by the e-Track API, in the order they are tried on a cache miss
+DATE_FORMATS = (
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y',
+    '%d-%m-%Y',
+    '%d-%m-%Y %H:%M:%S',
+)
+
+_DIRECTIVES = {
+    '%Y': r'(?P<Y>\d{4})',
+    '%m': r'(?P<m>\d{1,2})',
+    '%d': r'(?P<d>\d{1,2})',
+    '%H': r'(?P<H>\d{1,2})',
+    '%M': r'(?P<M>\d{1,2})',
+    '%S': r'(?P<S>\d{1,2})',
+}
+
+
+def _compile_format(fmt):
+    """Translate a strptime format made of the directives above into a regex.
+
+    Returns (regex, group names in datetime() argument order).
+    """
+    pattern = re.escape(fmt).replace(r'\ ', r'\s+')
+    names = []
+    for directive, group in _DIRECTIVES.items():
+        if directive in fmt:
+            pattern = pattern.replace(re.escape(directive), group)
+            names.append(directive[1])
+    return re.compile(pattern + '$'), tuple(names)
+
+
+def parse_number(val, integer=False):
+    """Sanitize numeric-like fields: velocidade may come as '0 km/h', bateria as '12.6 V', etc."""
+    if val is None:
+        return None
+    if isinstance(val, (int, float)):
+        return int(val) if integer else float(val)
+    s = str(val).strip()
+    if s == '':
+        return None
+    m = NUMBER_RE.search(s)
+    if not m:
+        return None
+    num = m.group(0)
+    if ',' in num:
+        # normalize comma as decimal if needed, otherwise drop thousands separators
+        if num.count(',') == 1 and '.' not in num:
+            num = num.replace(',', '.')
+        else:
+            num = num.replace(',', '')
+    try:
+        return int(float(num)) if integer else float(num)
+    except Exception:
+        return None
+
+
+class DateParser:
+    """Parse API timestamps, remembering the last matching format per key."""
+
+    def __init__(self, formats=DATE_FORMATS):
+        self.formats = tuple(formats)
+        self._compiled = {f: _compile_format(f) for f in self.formats}
+        self._preferred = {}
+
+    def _try(self, fmt, s):
+        regex, names = self._compiled[fmt]
+        m = regex.match(s)
+        if not m:
+            return None
+        try:
+            return datetime(*[int(v) for v in m.group(*names)])
+        except ValueError:
+            return None
+
+    def parse(self, s, key=None):
+        if s is None:
+            return None
+        if isinstance(s, (int, float)):
+            # assume epoch seconds
+            try:
+                return datetime.fromtimestamp(int(s))
+            except Exception:
+                return None
+        s = str(s).strip()
+        if not s:
+            return None
+        preferred = self._preferred.get(key)
+        if preferred is not None:
+            dt = self._try(preferred, s)
+            if dt is not None:
+                return dt
+        for f in self.formats:
+            if f == preferred:
+                continue
+            dt = self._try(f, s)
+            if dt is not None:
+                self._preferred[key] = f
+                return dt
+        # slow path for inputs the fast patterns reject (e.g. space-padded fields)
+        for f in self.formats:
+            try:
+                return datetime.strptime(s, f)
+            except Exception:
+                continue
+        # fallback: try ISO parser via fromisoformat
+        try:
+            return datetime.fromisoformat(s)
+        except Exception:
+            return None
+
+
+DATE_PARSER = DateParser()
+
+
+def parse_date(s, key=None):
+    return DATE_PARSER.parse(s, key)
+
+
+def _to_float(val):
+    if val in (None, ''):
+        return None
+    try:
+        return float(val)
+    except Exception:
+        return None
+
+
+def _to_bool(val):
+    return True if val in (1, '1', True) else False if val in (0, '0', False) else None
+
+
+RAW_MODES = ('full', 'residual', 'hashed')
+
+
+def payload_hash(payload):
+    """Content hash of a payload: md5 of its canonical JSON (sorted keys, no spaces)."""
+    text = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+class RawPolicy:
+    """What is kept of each API item besides the normalized columns.
+
+    - 'full': the whole item in `raw`;
+    - 'residual': only the keys that were not normalized into columns, in
+      `raw` (NULL when nothing is left);
+    - 'hashed': that residual stored once per distinct content in
+      `raw_payloads` and referenced from `raw_hash`, so rows repeating the
+      same payload share it.
+
+    In 'hashed' mode the payloads seen since the last `take_pending` (per
+    thread) must be written to `raw_payloads` in the same transaction as the
+    rows that reference them.
+    """
+
+    def __init__(self, normalized_keys, mode='full'):
+        self.normalized = frozenset(normalized_keys)
+        self.mode = mode
+        self._local = threading.local()
+
+    def residual(self, item):
+        return {k: v for k, v in item.items() if k not in self.normalized}
+
+    def raw(self, item):
+        if self.mode == 'full':
+            return psycopg2.extras.Json(item)
+        if self.mode == 'residual':
+            rest = self.residual(item)
+            return psycopg2.extras.Json(rest) if rest else None
+        return None
+
+    def raw_hash(self, item):
+        if self.mode != 'hashed':
+            return None
+        rest = self.residual(item)
+        if not rest:
+            return None
+        digest = payload_hash(rest)
+        self._pending()[digest] = rest
+        return digest
+
+    def _pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = {}
+        return pending
+
+    def take_pending(self):
+        """Return {hash: payload} collected by this thread and start a new batch."""
+        pending = self._pending()
+        self._local.pending = {}
+        return pending
+
+
+def _make_converter(column, kind, keys, date_parser, raw_policy=None):
+    """Build the function that extracts and converts one column from an item."""
+    if kind == 'json':
+        return lambda item, source: psycopg2.extras.Json(item)
+    if kind == 'raw':
+        return lambda item, source: raw_policy.raw(item)
+    if kind == 'raw_hash':
+        return lambda item, source: raw_policy.raw_hash(item)
+    if len(keys) == 1:
+        key = keys[0]
+        # single-key fields are the hot path: bind dict.get lookups directly
+        if kind == 'text':
+            return lambda item, source: item.get(key)
+        if kind == 'float':
+            return lambda item, source: _to_float(item.get(key))
+        if kind == 'number':
+            return lambda item, source: parse_number(item.get(key))
+        if kind == 'int':
+            return lambda item, source: parse_number(item.get(key), True)
+        if kind == 'bool':
+            return lambda item, source: _to_bool(item.get(key))
+        if kind == 'date':
+            parse = date_parser.parse
+            return lambda item, source: parse(item.get(key), (source, column))
+        raise ValueError(f'Unknown field kind {kind!r} for column {column}')
+
+    def get(item):
+        for k in keys:
+            v = item.get(k)
+            if v:
+                return v
+        return None
+
+    if kind == 'text':
+        return lambda item, source: get(item)
+    if kind == 'float':
+        return lambda item, source: _to_float(get(item))
+    if kind == 'number':
+        return lambda item, source: parse_number(get(item))
+    if kind == 'int':
+        return lambda item, source: parse_number(get(item), True)
+    if kind == 'bool':
+        return lambda item, source: _to_bool(get(item))
+    if kind == 'date':
+        parse = date_parser.parse
+        return lambda item, source: parse(get(item), (source, column))
+    raise ValueError(f'Unknown field kind {kind!r} for column {column}')
+
+
+class RecordNormalizer:
+    """Turn raw API dicts into tuples ordered like `columns`.
+
+    `schema` is a sequence of (column, kind, source_keys). Items whose
+    `required` column converts to an empty value are dropped. 'raw' and
+    'raw_hash' columns follow `raw_policy`, which by default treats every
+    source key of the schema as normalized.
+    """
+
+    def __init__(self, schema, required='placa', date_parser=None, raw_policy=None):
+        date_parser = date_parser or DATE_PARSER
+        self.columns = tuple(col for col, _, _ in schema)
+        self.raw_policy = raw_policy or RawPolicy(k for _, _, keys in schema for k in keys)
+        self._converters = tuple(_make_converter(col, kind, keys, date_parser, self.raw_policy)
+                                 for col, kind, keys in schema)
+        self._required = self.columns.index(required)
+
+    def row(self, item, source=None):
+        values = tuple([conv(item, source) for conv in self._converters])
+        if not values[self._required]:
+            return None
+        return values
+
+    def rows(self, items, source=None):
+        convs = self._converters
+        req = self._required
+        out = [tuple([conv(item, source) for conv in convs]) for item in items]
+        return [values for values in out if values[req]]
+
+
+TERMINAL_SCHEMA = (
+    ('placa', 'text', ('placa', 'placaVeiculo', 'plate')),
+    ('descricao', 'text', ('descricao',)),
+    ('frota', 'text', ('frota',)),
+    ('equipamento_serial', 'text', ('equipamento_serial',)),
+    ('data_gravacao', 'date', ('data_gravacao',)),
+    ('data', 'json', ()),
+)
+
+POSITION_SCHEMA = (
+    ('placa', 'text', ('placa',)),
+    ('data_transmissao', 'date', ('data_transmissao',)),
+    ('latitude', 'float', ('latitude',)),
+    ('longitude', 'float', ('longitude',)),
+    ('logradouro', 'text', ('logradouro',)),
+    ('velocidade', 'int', ('velocidade',)),
+    ('ignicao', 'bool', ('ignicao',)),
+    ('odometro', 'number', ('odometro',)),
+    ('odometro_can', 'number', ('odometro_can',)),
+    ('horimetro', 'number', ('horimetro',)),
+    ('bateria', 'number', ('bateria',)),
+    ('equipamento_serial', 'text', ('equipamento_serial',)),
+    ('data_gravacao', 'date', ('data_gravacao',)),
+    ('raw', 'raw', ()),
+    ('raw_hash', 'raw_hash', ()),
+)
+
+# API keys of a trip item stored in trips columns (see collector.store_trips)
+TRIP_KEYS = (
+    'placa', 'cliente', 'cliente_fantasia', 'data_inicio_conducao', 'data_fim_conducao',
+    'latitude_inicio_conducao', 'longitude_inicio_conducao', 'latitude_fim_conducao', 'longitude_fim_conducao',
+    'localizacao_inicio_conducao', 'localizacao_fim_conducao', 'odometro_inicio_conducao', 'odometro_fim_conducao',
+    'duracao_conducao', 'distancia_conducao', 'condutor_nome', 'condutor_identificacao',
+)
+
+TERMINALS = RecordNormalizer(TERMINAL_SCHEMA)
+POSITIONS = RecordNormalizer(POSITION_SCHEMA)
+TRIP_RAW = RawPolicy(TRIP_KEYS)
+
+
+def set_raw_mode(mode):
+    """Select the RAW_MODES entry used for positions and trips."""
+    if mode not in RAW_MODES:
+        raise ValueError(f'Unknown raw mode {mode!r}; expected one of {RAW_MODES}')
+    POSITIONS.raw_policy.mode = mode
+    TRIP_RAW.mode = mode
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""Monthly range partitioning of `positions` on `data_transmissao`.
+
+Layout once partitioned:
+
+- `positions` is a partitioned parent; each month lives in
+  `positions_yYYYYmMM` with its own copy of every index (the dedup key
+  `positions_unique_idx` includes `data_transmissao`, so uniqueness holds per
+  partition and ON CONFLICT keeps working on the parent);
+- `positions_default` catches rows outside any monthly partition (and rows
+  without `data_transmissao`); `ensure_partitions` moves them out as soon as
+  their month gets a partition.
+
+`ensure_tables` calls `ensure_partitions` whenever `positions` is
+partitioned, which keeps the current month plus ETRAC_PARTITION_MONTHS_AHEAD
+months created ahead of time. A fresh install is created partitioned when
+ETRAC_POSITIONS_PARTITIONED=1; an existing table is converted with
+`python partitions.py migrate`, which renames it to `positions_legacy`,
+creates the partitioned parent with the same columns and indexes, and copies
+the history one month per transaction (writers use the new table as soon as
+it exists).
+
+Usage:
+  python e-track/partitions.py status
+  python e-track/partitions.py migrate [--drop-legacy]
+  python e-track/partitions.py ensure [--ahead 3] [--from 2025-01]
+  python e-track/partitions.py detach --keep-months 12 [--drop]
+"""
+import argparse
+import logging
+import os
+import re
+import time
+from datetime import date
+
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+# settings below are read at import time: load the repository root .env first
+# (existing env vars win), as the other e-track scripts do
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env'), override=False)
+
+logger = logging.getLogger('e-track.partitions')
+
+PARTITIONED = os.getenv('ETRAC_POSITIONS_PARTITIONED', '0') == '1'
+MONTHS_AHEAD = int(os.getenv('ETRAC_PARTITION_MONTHS_AHEAD', '2'))
+
+TABLE = 'positions'
+DEFAULT_PARTITION = 'positions_default'
+LEGACY_TABLE = 'positions_legacy'
+_NAME_RE = re.compile(r'^positions_y(\d{4})m(\d{2})$')
+
+
+def month_start(d):
+    return date(d.year, d.month, 1)
+
+
+def add_months(d, n):
+    months = d.year * 12 + d.month - 1 + n
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'{TABLE}_y{month.year:04d}m{month.month:02d}'
+
+
+def partition_month(name):
+    """Inverse of partition_name (None for other tables, e.g. the default partition)."""
+    m = _NAME_RE.match(name)
+    return date(int(m.group(1)), int(m.group(2)), 1) if m else None
+
+
+def is_partitioned(conn, table=TABLE):
+    cur = conn.cursor()
+    cur.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', (table,))
+    return cur.fetchone() is not None
+
+
+def table_exists(conn, table):
+    cur = conn.cursor()
+    cur.execute('SELECT to_regclass(%s) IS NOT NULL', (table,))
+    return cur.fetchone()[0]
+
+
+def list_partitions(conn):
+    """[(name, bound expression, estimated rows)] of the positions partitions, by name."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+          FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+         WHERE i.inhparent = to_regclass(%s)
+         ORDER BY c.relname
+    """, (TABLE,))
+    return cur.fetchall()
+
+
+def _create_partition(cur, month):
+    """Create the partition for `month`, moving its rows out of the default
+    partition first (Postgres refuses to add a partition whose range still
+    has rows in the default one)."""
+    name = partition_name(month)
+    lo, hi = month, add_months(month, 1)
+    cur.execute(sql.SQL('SELECT count(*) FROM {} WHERE data_transmissao >= %s AND data_transmissao < %s').format(
+        sql.Identifier(DEFAULT_PARTITION)), (lo, hi))
+    stray = cur.fetchone()[0]
+    if not stray:
+        cur.execute(sql.SQL('CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)').format(
+            sql.Identifier(name), sql.Identifier(TABLE)), (lo, hi))
+        return 0
+    # build it detached, move the rows, then attach (indexes are created on attach)
+    cur.execute(sql.SQL('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)').format(sql.Identifier(name), sql.Identifier(TABLE)))
+    cur.execute(sql.SQL("""
+        WITH moved AS (
+            DELETE FROM {default} WHERE data_transmissao >= %s AND data_transmissao < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """).format(default=sql.Identifier(DEFAULT_PARTITION), name=sql.Identifier(name)), (lo, hi))
+    cur.execute(sql.SQL('ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)').format(
+        sql.Identifier(TABLE), sql.Identifier(name)), (lo, hi))
+    return stray
+
+
+def _rename_detached(cur, name):
+    """Move a table named like a partition but not attached (left by `detach`
+    or `archive.py --remove detach`) out of the way, so the month gets a new,
+    empty partition instead of CREATE TABLE IF NOT EXISTS silently skipping it.
+    The old table and its rows are kept as `<name>_detached[_N]`."""
+    cur.execute('SELECT to_regclass(%s) IS NOT NULL', (name,))
+    if not cur.fetchone()[0]:
+        return None
+    target, n = f'{name}_detached', 1
+    while True:
+        cur.execute('SELECT to_regclass(%s) IS NOT NULL', (target,))
+        if not cur.fetchone()[0]:
+            break
+        n += 1
+        target = f'{name}_detached_{n}'
+    cur.execute(sql.SQL('ALTER TABLE {} RENAME TO {}').format(sql.Identifier(name), sql.Identifier(target)))
+    logger.warning('%s exists but is not a partition of %s (detached); renamed it to %s and creating a new partition',
+                   name, TABLE, target)
+    return target
+
+
+def ensure_partitions(conn, start=None, end=None, ahead=None):
+    """Create the monthly partitions from `start` (default: this month) to
+    `end` (default: `ahead` months later), plus one for every month that has
+    rows sitting in the default partition. Returns the partitions created."""
+    ahead = MONTHS_AHEAD if ahead is None else ahead
+    first = month_start(start or date.today())
+    last = month_start(end) if end else add_months(month_start(date.today()), ahead)
+    months = set()
+    m = first
+    while m <= last:
+        months.add(m)
+        m = add_months(m, 1)
+    cur = conn.cursor()
+    cur.execute(sql.SQL("""SELECT DISTINCT date_trunc('month', data_transmissao)::date FROM {}
+                           WHERE data_transmissao IS NOT NULL""").format(sql.Identifier(DEFAULT_PARTITION)))
+    months.update(r[0] for r in cur.fetchall())
+    existing = {name for name, _, _ in list_partitions(conn)}
+    created = []
+    try:
+        for month in sorted(months):
+            if partition_name(month) in existing:
+                continue
+            _rename_detached(cur, partition_name(month))
+            moved = _create_partition(cur, month)
+            created.append(partition_name(month))
+            if moved:
+                logger.info('Created partition %s (moved %d rows from %s)', partition_name(month), moved, DEFAULT_PARTITION)
+            else:
+                logger.info('Created partition %s', partition_name(month))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return created
+
+
+def create_partitioned(cur, source):
+    """Create partitioned `positions` with the columns and indexes of `source`.
+
+    Index definitions are read from `source` before it was renamed (see
+    migrate) and replayed on the new parent; the primary key on `id` alone is
+    not allowed on a partitioned table and becomes a plain index.
+    """
+    cur.execute(sql.SQL('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) PARTITION BY RANGE (data_transmissao)').format(
+        sql.Identifier(TABLE), sql.Identifier(source)))
+    cur.execute(sql.SQL('CREATE TABLE {} PARTITION OF {} DEFAULT').format(sql.Identifier(DEFAULT_PARTITION), sql.Identifier(TABLE)))
+    cur.execute(sql.SQL('CREATE INDEX IF NOT EXISTS positions_id_idx ON {} (id)').format(sql.Identifier(TABLE)))
+    cur.execute(sql.SQL("""ALTER TABLE {} ADD CONSTRAINT positions_placa_fkey
+                           FOREIGN KEY (placa) REFERENCES terminals(placa) ON DELETE CASCADE""").format(sql.Identifier(TABLE)))
+
+
+def _source_indexes(cur, table):
+    """[(name, definition, is_primary)] for the indexes of `table`."""
+    cur.execute("""
+        SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indisprimary
+          FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+         WHERE i.indrelid = to_regclass(%s)
+    """, (table,))
+    return cur.fetchall()
+
+
+def migrate(conn, drop_legacy=False):
+    """Convert an existing plain `positions` into the partitioned layout.
+
+    Step 1 (one short transaction): rename the table and its indexes to
+    *_legacy, create the partitioned parent with the same columns, indexes and
+    id sequence, plus the partitions for every month present. Step 2: copy the
+    rows month by month (ON CONFLICT DO NOTHING, so an interrupted migration
+    can simply be run again). Step 3: compare counts and optionally drop the
+    legacy table.
+    """
+    cur = conn.cursor()
+    if not is_partitioned(conn):
+        if not table_exists(conn, TABLE):
+            raise RuntimeError('positions does not exist; run ensure_tables first')
+        if table_exists(conn, LEGACY_TABLE):
+            raise RuntimeError(f'{LEGACY_TABLE} already exists; drop or rename it before migrating')
+        try:
+            cur.execute(sql.SQL('LOCK TABLE {} IN ACCESS EXCLUSIVE MODE').format(sql.Identifier(TABLE)))
+            indexes = _source_indexes(cur, TABLE)
+            cur.execute(sql.SQL('ALTER TABLE {} RENAME TO {}').format(sql.Identifier(TABLE), sql.Identifier(LEGACY_TABLE)))
+            for name, _, _ in indexes:
+                cur.execute(sql.SQL('ALTER INDEX {} RENAME TO {}').format(
+                    sql.Identifier(name), sql.Identifier(name.replace(TABLE, LEGACY_TABLE, 1))))
+            cur.execute("SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(%s) AND conname = 'positions_placa_fkey'",
+                        (LEGACY_TABLE,))
+            if cur.fetchone():
+                cur.execute(sql.SQL('ALTER TABLE {} RENAME CONSTRAINT positions_placa_fkey TO positions_legacy_placa_fkey').format(
+                    sql.Identifier(LEGACY_TABLE)))
+            create_partitioned(cur, LEGACY_TABLE)
+            for name, definition, primary in indexes:
+                if primary:
+                    continue
+                if ' UNIQUE ' in definition and 'data_transmissao' not in definition:
+                    logger.warning('Skipping unique index %s: it does not include the partition key', name)
+                    continue
+                cur.execute(definition.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1)
+                            .replace('CREATE UNIQUE INDEX ', 'CREATE UNIQUE INDEX IF NOT EXISTS ', 1))
+            # the id sequence must survive dropping the legacy table
+            cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (LEGACY_TABLE,))
+            seq = cur.fetchone()[0]
+            if seq:
+                cur.execute(sql.SQL('ALTER SEQUENCE {} OWNED BY {}.id').format(sql.SQL(seq), sql.Identifier(TABLE)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info('positions is now partitioned; copying history from %s', LEGACY_TABLE)
+    elif not table_exists(conn, LEGACY_TABLE):
+        logger.info('positions is already partitioned and there is nothing to migrate')
+        return 0
+
+    cur.execute(sql.SQL("""SELECT DISTINCT date_trunc('month', data_transmissao)::date FROM {}
+                           WHERE data_transmissao IS NOT NULL ORDER BY 1""").format(sql.Identifier(LEGACY_TABLE)))
+    months = [r[0] for r in cur.fetchall()]
+    if months:
+        ensure_partitions(conn, start=months[0], end=max(months[-1], add_months(month_start(date.today()), MONTHS_AHEAD)))
+    copied = 0
+    copy_sql = sql.SQL('INSERT INTO {} SELECT * FROM {} WHERE {} ON CONFLICT DO NOTHING')
+    ranges = [(sql.SQL('data_transmissao >= %s AND data_transmissao < %s'), (m, add_months(m, 1))) for m in months]
+    ranges.append((sql.SQL('data_transmissao IS NULL'), ()))
+    for where, params in ranges:
+        started = time.monotonic()
+        try:
+            cur.execute(copy_sql.format(sql.Identifier(TABLE), sql.Identifier(LEGACY_TABLE), where), params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        copied += cur.rowcount
+        logger.info('Copied %d rows for %s in %.1fs', cur.rowcount, params[0] if params else 'NULL data_transmissao',
+                    time.monotonic() - started)
+
+    cur.execute(sql.SQL('ANALYZE {}').format(sql.Identifier(TABLE)))
+    cur.execute(sql.SQL('SELECT (SELECT count(*) FROM {}), (SELECT count(*) FROM {})').format(
+        sql.Identifier(LEGACY_TABLE), sql.Identifier(TABLE)))
+    legacy_rows, new_rows = cur.fetchone()
+    logger.info('Migration copied %d rows: %s has %d rows, positions has %d', copied, LEGACY_TABLE, legacy_rows, new_rows)
+    if drop_legacy:
+        if new_rows < legacy_rows:
+            raise RuntimeError(f'positions has fewer rows than {LEGACY_TABLE}; not dropping it')
+        cur.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(LEGACY_TABLE)))
+        conn.commit()
+        logger.info('Dropped %s', LEGACY_TABLE)
+    return copied
+
+
+def detach_old(conn, keep_months, drop=False):
+    """Detach (and optionally drop) monthly partitions older than `keep_months`
+    months before the current one. Detached tables keep their data and can be
+    archived or re-attached. Returns the affected partition names."""
+    cutoff = add_months(month_start(date.today()), -keep_months)
+    cur = conn.cursor()
+    done = []
+    for name, _, _ in list_partitions(conn):
+        month = partition_month(name)
+        if month is None or month >= cutoff:
+            continue
+        try:
+            cur.execute(sql.SQL('ALTER TABLE {} DETACH PARTITION {}').format(sql.Identifier(TABLE), sql.Identifier(name)))
+            if drop:
+                cur.execute(sql.SQL('DROP TABLE {}').format(sql.Identifier(name)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info('%s partition %s', 'Dropped' if drop else 'Detached', name)
+        done.append(name)
+    return done
+
+
+def _parse_month(value):
+    year, month = value.split('-')[:2]
+    return date(int(year), int(month), 1)
+
+
+def main():
+    try:
+        from . import collector
+    except Exception:
+        import collector
+    parser = argparse.ArgumentParser(description='Manage monthly partitions of e_track.positions')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help='List partitions and estimated row counts')
+    p_migrate = sub.add_parser('migrate', help='Convert the existing positions table to monthly partitions')
+    p_migrate.add_argument('--drop-legacy', action='store_true', help='Drop positions_legacy once every row was copied')
+    p_ensure = sub.add_parser('ensure', help='Create upcoming partitions')
+    p_ensure.add_argument('--ahead', type=int, default=MONTHS_AHEAD, help='Months to create after the current one')
+    p_ensure.add_argument('--from', dest='start', type=_parse_month, help='First month (YYYY-MM), e.g. before a backfill')
+    p_detach = sub.add_parser('detach', help='Detach partitions older than --keep-months')
+    p_detach.add_argument('--keep-months', type=int, required=True)
+    p_detach.add_argument('--drop', action='store_true', help='Drop the detached partitions')
+    args = parser.parse_args()
+
+    collector.load_env()
+    conn = collector.pg_connect()
+    schema = os.getenv('ETRAC_SCHEMA', 'e_track')
+    conn.cursor().execute(sql.SQL('SET search_path = {}, public').format(sql.Identifier(schema)))
+    if args.command == 'migrate':
+        migrate(conn, drop_legacy=args.drop_legacy)
+        return
+    if not is_partitioned(conn):
+        raise SystemExit('positions is not partitioned; run "partitions.py migrate" first')
+    if args.command == 'ensure':
+        created = ensure_partitions(conn, start=args.start, ahead=args.ahead)
+        print(f'{len(created)} partitions created')
+    elif args.command == 'detach':
+        done = detach_old(conn, args.keep_months, drop=args.drop)
+        print(f'{len(done)} partitions {"dropped" if args.drop else "detached"}')
+    for name, bound, rows in list_partitions(conn):
+        print(f'{name:<24} {max(rows, 0):>12} rows  {bound}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Maintenance of the raw API payloads kept in `positions` and `trips`.
+
+New rows follow ETRAC_RAW_MODE / `collector.py --raw-mode` (see
+normalizer.RawPolicy): 'full' keeps the whole item in `raw`, 'residual' only
+the keys not normalized into columns, 'hashed' stores that residual once per
+distinct content in `raw_payloads` and references it from `raw_hash`.
+
+This script handles the rows already stored:
+
+- report: current raw bytes per table and, from a sample, the size each
+  mode would take and the bytes it would save;
+- compact: rewrite existing rows into a mode (one batch per transaction);
+- prune: drop raw/raw_hash of rows older than N days (ETRAC_RAW_TTL_DAYS),
+  then delete payloads no row references any more.
+
+Sizes are logical (`pg_column_size` of the stored values); the disk space of
+updated rows is reused after VACUUM (VACUUM FULL / pg_repack to shrink files).
+
+Usage:
+  python e-track/raw_store.py report [--sample 10000]
+  python e-track/raw_store.py compact --mode hashed [--table positions] [--batch 5000]
+  python e-track/raw_store.py prune [--days 90]
+"""
+import argparse
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import psycopg2.extras
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+# settings below are read at import time: load the repository root .env first
+# (existing env vars win), as the other e-track scripts do
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env'), override=False)
+
+try:
+    from .normalizer import POSITIONS, RAW_MODES, TRIP_RAW, RawPolicy
+except Exception:
+    from normalizer import POSITIONS, RAW_MODES, TRIP_RAW, RawPolicy
+
+logger = logging.getLogger('e-track.raw_store')
+
+RAW_TTL_DAYS = int(os.getenv('ETRAC_RAW_TTL_DAYS', '0'))
+
+# table -> (time column, keys normalized into columns)
+TABLES = {
+    'positions': ('data_transmissao', POSITIONS.raw_policy.normalized),
+    'trips': ('data_inicio_conducao', TRIP_RAW.normalized),
+}
+
+HASH_BYTES = 33  # md5 hex in a TEXT column (32 chars + 1 byte header)
+
+
+def _table_bytes(cur, table):
+    """Total size of a table (all partitions, TOAST and indexes included)."""
+    cur.execute('SELECT coalesce(sum(pg_total_relation_size(relid)), 0) FROM pg_partition_tree(to_regclass(%s))', (table,))
+    return int(cur.fetchone()[0])
+
+
+def raw_usage(conn, table):
+    """Rows, rows with raw / raw_hash and logical raw bytes of `table`."""
+    cur = conn.cursor()
+    cur.execute(sql.SQL('SELECT count(*), count(raw), count(raw_hash), coalesce(sum(pg_column_size(raw)), 0) FROM {}').format(
+        sql.Identifier(table)))
+    rows, with_raw, with_hash, raw_bytes = cur.fetchone()
+    return {'rows': rows, 'with_raw': with_raw, 'with_hash': with_hash, 'raw_bytes': int(raw_bytes),
+            'table_bytes': _table_bytes(cur, table)}
+
+
+def estimate_modes(conn, table, sample=10000):
+    """Bytes per row of each mode, measured on up to `sample` rows that still have raw.
+
+    The 'hashed' figure scales the distinct payloads of the sample linearly,
+    so it is an upper bound (repeated payloads grow slower than rows).
+    """
+    _, keys = TABLES[table]
+    cur = conn.cursor()
+    cur.execute(sql.SQL("""
+        WITH s AS (SELECT raw FROM {} WHERE raw IS NOT NULL LIMIT %s),
+             r AS (SELECT raw, nullif(raw - %s::text[], '{{}}'::jsonb) AS rest FROM s)
+        SELECT count(*), coalesce(sum(pg_column_size(raw)), 0), coalesce(sum(pg_column_size(rest)), 0),
+               (SELECT coalesce(sum(pg_column_size(rest)), 0) FROM (SELECT DISTINCT rest FROM r WHERE rest IS NOT NULL) d),
+               count(rest)
+          FROM r
+    """).format(sql.Identifier(table)), (sample, sorted(keys)))
+    n, full, residual, distinct, with_rest = cur.fetchone()
+    if not n:
+        return None
+    return {
+        'sampled': n,
+        'full': full / n,
+        'residual': residual / n,
+        'hashed': (with_rest * HASH_BYTES + distinct) / n,
+    }
+
+
+def report(conn, sample=10000):
+    for table in TABLES:
+        usage = raw_usage(conn, table)
+        print(f'\n{table}: {usage["rows"]} rows ({usage["with_raw"]} with raw, {usage["with_hash"]} with raw_hash), '
+              f'raw {usage["raw_bytes"] / 1048576:.1f} MiB of {usage["table_bytes"] / 1048576:.1f} MiB')
+        est = estimate_modes(conn, table, sample)
+        if not est:
+            continue
+        print(f'  sample of {est["sampled"]} rows with raw:')
+        for mode in RAW_MODES:
+            per_row = est[mode]
+            projected = per_row * usage['with_raw']
+            saved = usage['raw_bytes'] - projected
+            print(f'  {mode:<9} {per_row:8.0f} B/row  {projected / 1048576:9.1f} MiB  saves {saved / 1048576:9.1f} MiB '
+                  f'({saved / usage["raw_bytes"]:.0%})' if usage['raw_bytes'] else f'  {mode:<9} {per_row:8.0f} B/row')
+
+
+def compact(conn, table, mode, batch_size=5000):
+    """Rewrite the raw of existing rows of `table` into `mode`; returns
+    (rows updated, logical bytes before, logical bytes after)."""
+    _, keys = TABLES[table]
+    policy = RawPolicy(keys, mode)
+    ident = sql.Identifier(table)
+    cur = conn.cursor()
+    select = sql.SQL('SELECT id, raw FROM {} WHERE raw IS NOT NULL AND id > %s ORDER BY id LIMIT %s').format(ident)
+    measure = sql.SQL('SELECT coalesce(sum(pg_column_size(raw)), 0) + count(raw_hash) * %s FROM {} WHERE id = ANY(%s)').format(ident)
+    update = sql.SQL("""UPDATE {} t SET raw = v.raw::jsonb, raw_hash = v.h
+                        FROM (VALUES %s) AS v(id, raw, h) WHERE t.id = v.id""").format(ident).as_string(conn)
+    before = after = updated = 0
+    last_id = -1
+    started = time.monotonic()
+    while True:
+        try:
+            cur.execute(select, (last_id, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            ids = [row_id for row_id, _ in rows]
+            cur.execute(measure, (HASH_BYTES, ids))
+            before += int(cur.fetchone()[0])
+            values = [(row_id, policy.raw(raw), policy.raw_hash(raw)) for row_id, raw in rows if isinstance(raw, dict)]
+            pending = policy.take_pending()
+            if pending:
+                psycopg2.extras.execute_values(cur, 'INSERT INTO raw_payloads (hash, payload) VALUES %s ON CONFLICT (hash) DO NOTHING',
+                                               [(h, psycopg2.extras.Json(p)) for h, p in pending.items()])
+            if values:
+                psycopg2.extras.execute_values(cur, update, values, page_size=batch_size)
+            cur.execute(measure, (HASH_BYTES, ids))
+            after += int(cur.fetchone()[0])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        updated += len(values)
+        logger.info('%s: compacted %d rows (%.0fs)', table, updated, time.monotonic() - started)
+    return updated, before, after
+
+
+def prune(conn, days, chunk_days=31):
+    """Drop raw/raw_hash of rows older than `days` days, one time chunk per
+    transaction, then delete unreferenced payloads. Returns {table: (rows, bytes)}."""
+    cutoff = datetime.now() - timedelta(days=days)
+    cur = conn.cursor()
+    result = {}
+    for table, (ts_col, _) in TABLES.items():
+        ident, col = sql.Identifier(table), sql.Identifier(ts_col)
+        cur.execute(sql.SQL('SELECT min({}) FROM {} WHERE raw IS NOT NULL OR raw_hash IS NOT NULL').format(col, ident))
+        lo = cur.fetchone()[0]
+        rows = freed = 0
+        while lo is not None and lo < cutoff:
+            hi = min(lo + timedelta(days=chunk_days), cutoff)
+            where = sql.SQL('{col} >= %s AND {col} < %s AND (raw IS NOT NULL OR raw_hash IS NOT NULL)').format(col=col)
+            try:
+                cur.execute(sql.SQL('SELECT coalesce(sum(pg_column_size(raw)), 0) + count(raw_hash) * %s FROM {} WHERE {}').format(
+                    ident, where), (HASH_BYTES, lo, hi))
+                freed += int(cur.fetchone()[0])
+                cur.execute(sql.SQL('UPDATE {} SET raw = NULL, raw_hash = NULL WHERE {}').format(ident, where), (lo, hi))
+                rows += cur.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            lo = hi
+        result[table] = (rows, freed)
+        logger.info('%s: dropped raw of %d rows older than %s (%.1f MiB)', table, rows, cutoff.date(), freed / 1048576)
+    result['raw_payloads'] = (delete_orphan_payloads(conn), 0)
+    return result
+
+
+def delete_orphan_payloads(conn):
+    """Delete the raw_payloads no position or trip references any more."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""DELETE FROM raw_payloads rp
+                        WHERE NOT EXISTS (SELECT 1 FROM positions p WHERE p.raw_hash = rp.hash)
+                          AND NOT EXISTS (SELECT 1 FROM trips t WHERE t.raw_hash = rp.hash)""")
+        orphans = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info('Deleted %d unreferenced raw payloads', orphans)
+    return orphans
+
+
+def main():
+    try:
+        from . import collector
+    except Exception:
+        import collector
+    parser = argparse.ArgumentParser(description='Report, compact or prune raw API payloads')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_report = sub.add_parser('report', help='Raw bytes per table and estimated savings per mode')
+    p_report.add_argument('--sample', type=int, default=10000, help='Rows sampled for the per-mode estimate')
+    p_compact = sub.add_parser('compact', help='Rewrite existing rows into a raw mode')
+    p_compact.add_argument('--mode', choices=[m for m in RAW_MODES if m != 'full'], required=True)
+    p_compact.add_argument('--table', choices=list(TABLES), help='Only this table (default: all)')
+    p_compact.add_argument('--batch', type=int, default=5000)
+    p_prune = sub.add_parser('prune', help='Drop raw of rows older than --days')
+    p_prune.add_argument('--days', type=int, default=RAW_TTL_DAYS or None, required=not RAW_TTL_DAYS,
+                         help='Age in days (default: ETRAC_RAW_TTL_DAYS)')
+    args = parser.parse_args()
+
+    collector.load_env()
+    conn = collector.pg_connect()
+    conn.cursor().execute(sql.SQL('SET search_path = {}, public').format(sql.Identifier(os.getenv('ETRAC_SCHEMA', 'e_track'))))
+    collector.ensure_tables(conn)
+    if args.command == 'report':
+        report(conn, args.sample)
+    elif args.command == 'compact':
+        for table in ([args.table] if args.table else TABLES):
+            updated, before, after = compact(conn, table, args.mode, args.batch)
+            print(f'{table}: {updated} rows compacted to {args.mode}, raw {before / 1048576:.1f} MiB -> '
+                  f'{after / 1048576:.1f} MiB (saved {(before - after) / 1048576:.1f} MiB)')
+    elif args.command == 'prune':
+        for table, (rows, freed) in prune(conn, args.days).items():
+            print(f'{table}: {rows} rows' + (f', {freed / 1048576:.1f} MiB of raw dropped' if freed else ''))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
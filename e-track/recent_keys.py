@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Bounded in-memory filter of recently stored position keys.
+
+`--fetch-latest` runs over and over and history windows overlap, so most
+positions sent to Postgres are rejected by ON CONFLICT on
+`positions_unique_idx` after a full round-trip (raw payload included).
+`RecentKeys` remembers the `(placa, data_transmissao, latitude, longitude)`
+keys that are known to be stored, with least-recently-used eviction once
+`maxsize` is reached, so known duplicates are dropped before the INSERT.
+
+The filter is exact (no false positives): a key is only remembered after the
+transaction that wrote it committed, or when it was read back from the table
+by `warm`. A miss just means the row goes to Postgres and ON CONFLICT decides,
+as before. Rows with a NULL in any key column are never filtered: the unique
+index treats NULLs as distinct, so Postgres would insert them.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger('e-track.recent_keys')
+
+WARM_SQL = """SELECT placa, data_transmissao, latitude, longitude FROM positions
+   WHERE data_transmissao >= %s AND data_transmissao < %s {plate_filter}
+   ORDER BY data_transmissao DESC LIMIT %s
+"""
+
+
+def position_key(row):
+    """Dedup key of a normalized position row (POSITION_COLUMNS order), or None."""
+    key = (row[0], row[1], row[2], row[3])
+    if None in key:
+        return None
+    return key
+
+
+class RecentKeys:
+    """Thread-safe LRU set of position keys with skipped/sent/inserted counters."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.sent = 0
+        self.inserted = 0
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def add_many(self, keys):
+        if not self.enabled:
+            return
+        with self._lock:
+            for key in keys:
+                if key is None:
+                    continue
+                self._keys[key] = None
+                self._keys.move_to_end(key)
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+
+    def filter(self, rows, count=True):
+        """Return (rows to send, their keys), dropping known and repeated keys.
+
+        With `count=False` the skipped/sent counters are left alone: used when
+        the same rows are filtered again by a fallback loader, or counted later
+        with `record_filtered` once the load committed.
+        """
+        if not self.enabled:
+            return rows, []
+        fresh, keys, seen = [], [], set()
+        skipped = 0
+        with self._lock:
+            for row in rows:
+                key = position_key(row)
+                if key is not None:
+                    if key in self._keys or key in seen:
+                        if key in self._keys:
+                            self._keys.move_to_end(key)
+                        skipped += 1
+                        continue
+                    seen.add(key)
+                fresh.append(row)
+                keys.append(key)
+            if count:
+                self.skipped += skipped
+                self.sent += len(fresh)
+        return fresh, keys
+
+    def record_filtered(self, sent, skipped):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.sent += sent
+            self.skipped += skipped
+
+    def record_inserted(self, count):
+        with self._lock:
+            self.inserted += max(count, 0)
+
+    def warm(self, conn, start, end, plates=None):
+        """Load the stored keys of [start, end) (newest first, up to maxsize)."""
+        if not self.enabled:
+            return 0
+        plate_filter = 'AND placa = ANY(%s)' if plates else ''
+        params = [start, end] + ([list(plates)] if plates else []) + [self.maxsize]
+        cur = conn.cursor()
+        cur.execute(WARM_SQL.format(plate_filter=plate_filter), params)
+        rows = cur.fetchall()
+        conn.commit()
+        # oldest first, so the newest keys end up most recently used
+        self.add_many(position_key(r) for r in reversed(rows))
+        logger.info('Warmed recent-key filter with %d keys from %s to %s', len(rows), start, end)
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            total = self.skipped + self.sent
+            return {
+                'size': len(self._keys),
+                'maxsize': self.maxsize,
+                'skipped': self.skipped,
+                'sent': self.sent,
+                'inserted': self.inserted,
+                'skip_ratio': round(self.skipped / total, 3) if total else 0.0,
+            }
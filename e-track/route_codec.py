@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Compact encodings for route point lists.
+
+The canonical route is a list of {'lat', 'lon', 'ts', 'vel', 'addr'} dicts,
+which repeats every key per point. Two compact forms are available:
+
+- 'columnar': parallel arrays, timestamps as a start epoch plus per-point
+  deltas in seconds, addresses deduplicated into `addrs` and referenced by
+  index;
+- 'polyline': the same, with coordinates as a delta-encoded polyline string
+  (Google polyline algorithm at 1e-6 degrees, like OSRM's polyline6).
+
+Both are JSON objects tagged with 'format'; `decode_points` accepts them as
+well as the plain list, so readers do not need to know how a route was
+stored. Timestamps are naive ISO strings and round-trip at one-second
+resolution; coordinates round-trip at 6 decimals.
+"""
+import calendar
+from datetime import datetime, timedelta
+
+FORMATS = ('points', 'columnar', 'polyline')
+
+POLYLINE_PRECISION = 1e6
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_epoch(ts):
+    if not ts:
+        return None
+    dt = ts if isinstance(ts, datetime) else datetime.fromisoformat(str(ts))
+    return calendar.timegm(dt.timetuple())
+
+
+def _from_epoch(seconds):
+    return (_EPOCH + timedelta(seconds=seconds)).isoformat() if seconds is not None else None
+
+
+def _encode_signed(value, out):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode_polyline(coords, precision=POLYLINE_PRECISION):
+    """Encode [(lat, lon)] as a polyline string."""
+    out = []
+    prev_lat = prev_lon = 0
+    for lat, lon in coords:
+        ilat = int(round(lat * precision))
+        ilon = int(round(lon * precision))
+        _encode_signed(ilat - prev_lat, out)
+        _encode_signed(ilon - prev_lon, out)
+        prev_lat, prev_lon = ilat, ilon
+    return ''.join(out)
+
+
+def decode_polyline(text, precision=POLYLINE_PRECISION):
+    """Decode a polyline string into [(lat, lon)]."""
+    coords = []
+    index = lat = lon = 0
+    length = len(text)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(text[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append((lat / precision, lon / precision))
+    return coords
+
+
+def _columns(points):
+    """Columns shared by both compact formats (everything except coordinates)."""
+    epochs = [_to_epoch(p.get('ts')) for p in points]
+    t0 = next((e for e in epochs if e is not None), 0)
+    dt = []
+    prev = t0
+    for e in epochs:
+        if e is None:
+            dt.append(None)
+            continue
+        dt.append(e - prev)
+        prev = e
+    addrs = []
+    index = {}
+    addr = []
+    for p in points:
+        a = p.get('addr')
+        if a is None:
+            addr.append(None)
+            continue
+        if a not in index:
+            index[a] = len(addrs)
+            addrs.append(a)
+        addr.append(index[a])
+    return {'t0': t0, 'dt': dt, 'vel': [p.get('vel') for p in points], 'addr': addr, 'addrs': addrs}
+
+
+def encode_points(points, fmt):
+    """Encode a point list as `fmt` ('points' returns the list unchanged)."""
+    if points is None:
+        return None
+    if isinstance(points, dict):
+        if points.get('format') == fmt:
+            return points
+        points = decode_points(points)
+    if fmt == 'points':
+        return points
+    encoded = {'format': fmt, 'n': len(points)}
+    if fmt == 'columnar':
+        encoded['lat'] = [round(p['lat'], 6) for p in points]
+        encoded['lon'] = [round(p['lon'], 6) for p in points]
+    elif fmt == 'polyline':
+        encoded['coords'] = encode_polyline((p['lat'], p['lon']) for p in points)
+    else:
+        raise ValueError(f'Unknown route format {fmt!r}')
+    encoded.update(_columns(points))
+    return encoded
+
+
+def decode_points(value):
+    """Return the plain point list for a stored route in any format."""
+    if value is None or isinstance(value, list):
+        return value
+    fmt = value.get('format')
+    if fmt == 'columnar':
+        coords = zip(value['lat'], value['lon'])
+    elif fmt == 'polyline':
+        coords = decode_polyline(value['coords'])
+    else:
+        raise ValueError(f'Unknown route format {fmt!r}')
+    addrs = value.get('addrs') or []
+    points = []
+    t = value.get('t0') or 0
+    for (lat, lon), dt, vel, addr in zip(coords, value['dt'], value['vel'], value['addr']):
+        if dt is not None:
+            t += dt
+        points.append({
+            'lat': lat,
+            'lon': lon,
+            'ts': _from_epoch(t) if dt is not None else None,
+            'vel': vel,
+            'addr': addrs[addr] if addr is not None else None,
+        })
+    return points
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Per-route driving metrics computed with NumPy.
+
+`compute_metrics(points)` turns a route's point list into the values stored
+in the `routes` metric columns: distance, moving and idle time, max/average
+speed and number of stops. Work is vectorized over the consecutive-point
+segments (haversine distance, time delta, speed), so a route with thousands of
+points costs a few array operations instead of a Python loop per point.
+
+A segment counts as moving when the speed reported at its end (or, without
+one, the speed implied by distance/time) reaches ETRAC_STOP_SPEED km/h; idle
+runs of at least ETRAC_STOP_MIN_SECONDS are stops. Gaps longer than
+ETRAC_MAX_GAP_SECONDS (device off / no signal) count as neither. Route points
+do not carry ignition, so stops are detected from speed alone.
+
+NumPy is optional: without it `AVAILABLE` is False and callers skip the stage.
+"""
+import os
+
+try:
+    import numpy as np
+    AVAILABLE = True
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+    AVAILABLE = False
+
+STOP_SPEED_KMH = float(os.getenv('ETRAC_STOP_SPEED', '3'))
+STOP_MIN_SECONDS = float(os.getenv('ETRAC_STOP_MIN_SECONDS', '120'))
+MAX_GAP_SECONDS = float(os.getenv('ETRAC_MAX_GAP_SECONDS', '600'))
+
+EARTH_RADIUS_KM = 6371.0088
+
+COLUMNS = ('distance_km', 'moving_seconds', 'idle_seconds', 'max_speed', 'avg_speed', 'stop_count')
+
+EMPTY = {'distance_km': 0.0, 'moving_seconds': 0, 'idle_seconds': 0, 'max_speed': None, 'avg_speed': None, 'stop_count': 0}
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between arrays of coordinates (degrees)."""
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def _runs(mask):
+    """(start, end) index pairs of the True runs in a boolean array (end exclusive)."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def compute_metrics(points, stop_speed=STOP_SPEED_KMH, stop_min_seconds=STOP_MIN_SECONDS, max_gap=MAX_GAP_SECONDS):
+    """Return {column: value} for COLUMNS from a list of route point dicts."""
+    if not points:
+        return dict(EMPTY)
+    lat = np.array([p['lat'] for p in points], dtype=float)
+    lon = np.array([p['lon'] for p in points], dtype=float)
+    vel = np.array([p.get('vel') if p.get('vel') is not None else np.nan for p in points], dtype=float)
+    ts = np.array([p.get('ts') or 'NaT' for p in points], dtype='datetime64[s]')
+    metrics = dict(EMPTY)
+    if not np.isnan(vel).all():
+        metrics['max_speed'] = float(np.nanmax(vel))
+    if len(points) < 2:
+        return metrics
+
+    dist = haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    dt = (ts[1:] - ts[:-1]).astype('float64')
+    dt[np.isnat(ts[1:]) | np.isnat(ts[:-1])] = np.nan
+    valid = (dt > 0) & (dt <= max_gap)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        implied = np.where(valid, dist / (dt / 3600.0), np.nan)
+    seg_speed = np.where(np.isnan(vel[1:]), implied, vel[1:])
+    moving = valid & (seg_speed >= stop_speed)
+    idle = valid & ~moving
+
+    distance = float(dist[moving].sum())
+    moving_s = float(dt[moving].sum())
+    metrics['distance_km'] = round(distance, 3)
+    metrics['moving_seconds'] = int(moving_s)
+    metrics['idle_seconds'] = int(dt[idle].sum())
+    metrics['avg_speed'] = round(distance / (moving_s / 3600.0), 2) if moving_s else 0.0
+    if metrics['max_speed'] is None and moving.any():
+        metrics['max_speed'] = float(np.nanmax(implied[moving]))
+
+    # a stop is a run of consecutive idle segments lasting at least stop_min_seconds
+    starts, ends = _runs(idle)
+    if len(starts):
+        elapsed = np.concatenate(([0.0], np.cumsum(np.where(idle, dt, 0.0))))
+        durations = elapsed[ends] - elapsed[starts]
+        metrics['stop_count'] = int((durations >= stop_min_seconds).sum())
+    return metrics
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Douglas-Peucker simplification of stored routes.
+
+Routes keep their full-resolution `points`; `simplify_levels` derives one
+reduced copy per tolerance in TOLERANCES (meters), stored in
+`routes.simplified` as {"<tolerance>": [points...]}. Clients pick a level
+explicitly (`tolerance`) or from the map zoom (`tolerance_for_zoom`).
+
+Coordinates are projected to meters with an equirectangular approximation
+around the route's mean latitude, which is accurate enough at city/day scale.
+"""
+import os
+import math
+
+# tolerances in meters, finest first; override with ETRAC_ROUTE_TOLERANCES=2,10,50
+TOLERANCES = tuple(float(t) for t in os.getenv('ETRAC_ROUTE_TOLERANCES', '2,10,50').split(',') if t.strip())
+
+EARTH_RADIUS_M = 6371008.8
+# ground resolution of a web-mercator tile pixel at the equator, zoom 0
+METERS_PER_PIXEL_Z0 = 156543.03392
+
+
+def level_key(tolerance):
+    """JSON key of a tolerance level: '10' for 10.0, '2.5' for 2.5."""
+    return ('%g' % float(tolerance))
+
+
+def project(points):
+    """Return [(x, y)] in meters for points with 'lat'/'lon' keys."""
+    if not points:
+        return []
+    lat0 = math.radians(sum(p['lat'] for p in points) / len(points))
+    kx = EARTH_RADIUS_M * math.cos(lat0) * math.pi / 180.0
+    ky = EARTH_RADIUS_M * math.pi / 180.0
+    return [(p['lon'] * kx, p['lat'] * ky) for p in points]
+
+
+def douglas_peucker(xy, tolerance):
+    """Indices of the points kept by Douglas-Peucker for `tolerance` (same unit as xy).
+
+    Iterative, so long routes do not hit the recursion limit; distances are
+    measured to the segment (not the infinite line), which keeps U-turns.
+    """
+    n = len(xy)
+    if n < 3:
+        return list(range(n))
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    tol2 = tolerance * tolerance
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        dx = xy[last][0] - ax
+        dy = xy[last][1] - ay
+        seg2 = dx * dx + dy * dy
+        max_d2 = -1.0
+        index = first
+        for i in range(first + 1, last):
+            px = xy[i][0] - ax
+            py = xy[i][1] - ay
+            if seg2:
+                t = (px * dx + py * dy) / seg2
+                if t < 0.0:
+                    t = 0.0
+                elif t > 1.0:
+                    t = 1.0
+                px -= t * dx
+                py -= t * dy
+            d2 = px * px + py * py
+            if d2 > max_d2:
+                max_d2 = d2
+                index = i
+        if max_d2 > tol2:
+            keep[index] = True
+            if index - first > 1:
+                stack.append((first, index))
+            if last - index > 1:
+                stack.append((index, last))
+    return [i for i in range(n) if keep[i]]
+
+
+def simplify(points, tolerance):
+    """Return the subset of `points` kept at `tolerance` meters."""
+    return [points[i] for i in douglas_peucker(project(points), tolerance)]
+
+
+def simplify_levels(points, tolerances=TOLERANCES):
+    """Return {level_key(tolerance): simplified points} for every tolerance."""
+    xy = project(points)
+    return {level_key(t): [points[i] for i in douglas_peucker(xy, t)] for t in tolerances}
+
+
+def tolerance_for_zoom(zoom, lat=0.0, pixels=1.0, tolerances=TOLERANCES):
+    """Coarsest stored tolerance that stays under `pixels` screen pixels at `zoom`.
+
+    Returns None when even the finest level would be visible (use full resolution).
+    """
+    meters = pixels * METERS_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / (2 ** float(zoom))
+    fitting = [t for t in tolerances if t <= meters]
+    return max(fitting) if fitting else None
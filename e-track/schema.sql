@@ -12,6 +12,9 @@ CREATE TABLE IF NOT EXISTS terminals (
     data JSONB
 );
 
+-- positions can be range-partitioned by month on data_transmissao (see
+-- partitions.py / ETRAC_POSITIONS_PARTITIONED); the statements below then
+-- apply to the partitioned parent and every partition inherits the indexes.
 CREATE TABLE IF NOT EXISTS positions (
     id BIGSERIAL PRIMARY KEY,
     placa TEXT REFERENCES terminals(placa) ON DELETE CASCADE,
@@ -31,8 +34,16 @@ CREATE TABLE IF NOT EXISTS positions (
     created_at TIMESTAMP DEFAULT now()
 );
 
-CREATE INDEX IF NOT EXISTS positions_placa_idx ON positions(placa);
-CREATE INDEX IF NOT EXISTS positions_data_transmissao_idx ON positions(data_transmissao);
+-- "positions of plate X between t1 and t2 ordered by time" (routes, /api/positions):
+-- the route columns are included so the day window is an index-only scan
+CREATE INDEX IF NOT EXISTS positions_placa_ts_idx ON positions(placa, data_transmissao)
+    INCLUDE (latitude, longitude, velocidade, logradouro);
+-- fleet-wide time windows: rows arrive roughly in data_transmissao order, so a
+-- BRIN index is a few pages instead of a btree the size of the table
+CREATE INDEX IF NOT EXISTS positions_data_transmissao_brin ON positions USING brin(data_transmissao) WITH (pages_per_range = 32);
+-- superseded by the two above (placa is the leading column of positions_placa_ts_idx)
+DROP INDEX IF EXISTS positions_placa_idx;
+DROP INDEX IF EXISTS positions_data_transmissao_idx;
 
 CREATE TABLE IF NOT EXISTS trips (
     id BIGSERIAL PRIMARY KEY,
@@ -71,3 +82,29 @@ CREATE TABLE IF NOT EXISTS routes (
 );
 
 CREATE UNIQUE INDEX IF NOT EXISTS routes_placa_date_idx ON routes(placa, rota_date);
+
+-- last positions.data_transmissao already included in routes.points; incremental
+-- refreshes append only newer positions (NULL = rebuild the route from scratch)
+ALTER TABLE routes ADD COLUMN IF NOT EXISTS watermark TIMESTAMP;
+
+-- Douglas-Peucker copies of points per tolerance in meters: {"2": [...], "10": [...], "50": [...]}
+ALTER TABLE routes ADD COLUMN IF NOT EXISTS simplified JSONB;
+
+-- per-route metrics computed from points by route_metrics (NULL until computed)
+ALTER TABLE routes ADD COLUMN IF NOT EXISTS distance_km DOUBLE PRECISION;
+ALTER TABLE routes ADD COLUMN IF NOT EXISTS moving_seconds INTEGER;
+ALTER TABLE routes ADD COLUMN IF NOT EXISTS idle_seconds INTEGER;
+ALTER TABLE routes ADD COLUMN IF NOT EXISTS max_speed DOUBLE PRECISION;
+ALTER TABLE routes ADD COLUMN IF NOT EXISTS avg_speed DOUBLE PRECISION;
+ALTER TABLE routes ADD COLUMN IF NOT EXISTS stop_count INTEGER;
+
+-- raw payload retention (ETRAC_RAW_MODE, raw_store.py): in 'hashed' mode the
+-- non-normalized part of each API item is stored once per distinct content
+-- here and referenced from positions.raw_hash / trips.raw_hash
+CREATE TABLE IF NOT EXISTS raw_payloads (
+    hash TEXT PRIMARY KEY,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT now()
+);
+ALTER TABLE positions ADD COLUMN IF NOT EXISTS raw_hash TEXT;
+ALTER TABLE trips ADD COLUMN IF NOT EXISTS raw_hash TEXT;
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Process-level cache of table metadata (columns, types, primary key).
+
+`information_schema.columns` is a view over several catalogs with privilege
+checks, and the web UI used to query it on every request. `get` reads
+pg_catalog once per (schema, table) and keeps the result for
+ETRAC_TABLE_META_TTL seconds (default 300). `collector.ensure_tables` calls
+`invalidate` after applying the schema, so DDL run by this process is seen
+immediately; other processes pick it up at the next TTL expiry.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+
+TTL = float(os.getenv('ETRAC_TABLE_META_TTL', '300'))
+
+# columns: {name: type as format_type prints it}, in column order
+TableMeta = namedtuple('TableMeta', 'schema table columns primary_key loaded_at')
+
+COLUMNS_SQL = """SELECT a.attname, format_type(a.atttypid, a.atttypmod) FROM pg_attribute a
+   WHERE a.attrelid = %s AND a.attnum > 0 AND NOT a.attisdropped ORDER BY a.attnum"""
+PRIMARY_KEY_SQL = """SELECT a.attname FROM pg_index i
+    CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, n)
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+   WHERE i.indrelid = %s AND i.indisprimary ORDER BY k.n"""
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _load(conn, schema, table):
+    cur = conn.cursor()
+    cur.execute('SELECT to_regclass(%s)::oid', (f'{_quote(schema)}.{_quote(table)}',))
+    row = cur.fetchone()
+    oid = row[0] if row else None
+    if oid is None:
+        return None
+    cur.execute(COLUMNS_SQL, (oid,))
+    columns = {name: typ for name, typ in cur.fetchall()}
+    cur.execute(PRIMARY_KEY_SQL, (oid,))
+    primary_key = tuple(name for (name,) in cur.fetchall())
+    return TableMeta(schema, table, columns, primary_key, time.monotonic())
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def get(conn, schema, table, ttl=None):
+    """TableMeta of schema.table (None when it does not exist; misses are not cached)."""
+    ttl = TTL if ttl is None else ttl
+    key = (schema, table)
+    meta = _cache.get(key)
+    if meta is not None and time.monotonic() - meta.loaded_at < ttl:
+        return meta
+    meta = _load(conn, schema, table)
+    with _lock:
+        if meta is None:
+            _cache.pop(key, None)
+        else:
+            _cache[key] = meta
+    return meta
+
+
+def columns(conn, schema, table):
+    """{column: type} of schema.table ({} when it does not exist)."""
+    meta = get(conn, schema, table)
+    return meta.columns if meta else {}
+
+
+def invalidate(schema=None, table=None):
+    """Drop cached entries: all of them, one schema's, or one table's."""
+    with _lock:
+        for key in list(_cache):
+            if (schema is None or key[0] == schema) and (table is None or key[1] == table):
+                del _cache[key]
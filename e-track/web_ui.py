@@ -3,20 +3,27 @@
 
 Routes:
  - /        : links to resources
- - /db/<resource>?page=1&page_size=20 : paginated list
+ - /db/<resource>?page_size=20 : paginated list (Prev/Next use keyset tokens, ?exact=1 counts rows)
  - /db/<resource>/<id> : full JSON view
+ - /api/pool : connection pool utilization
 
 Run: set DB env vars (or use .env) and run `python web_ui.py` or `FLASK_APP=web_ui.py flask run`.
 """
-from flask import Flask, request, abort
+from flask import Flask, Response, g, request, abort
+import base64
+import heapq
 import os
 import json
+import math
+import threading
+import time
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 from psycopg2 import sql
 from html import escape
 from dotenv import load_dotenv
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import logging
 import os
 
@@ -32,6 +39,24 @@ here = os.path.dirname(__file__)
 repo_root = os.path.abspath(os.path.join(here, '..'))
 load_dotenv(os.path.join(repo_root, '.env'), override=False)
 
+# imported after .env is loaded: collector reads API credentials at import time
+try:
+    from . import collector
+    from .http_session import get_session
+    from .route_simplify import level_key, simplify, tolerance_for_zoom
+    from .route_codec import FORMATS as ROUTE_FORMATS, decode_points, encode_points
+    from .route_metrics import COLUMNS as ROUTE_METRICS
+    from .archive import iter_positions as iter_archived_positions, read_route as read_archived_route
+    from . import table_meta
+except Exception:
+    import collector
+    from http_session import get_session
+    from route_simplify import level_key, simplify, tolerance_for_zoom
+    from route_codec import FORMATS as ROUTE_FORMATS, decode_points, encode_points
+    from route_metrics import COLUMNS as ROUTE_METRICS
+    from archive import iter_positions as iter_archived_positions, read_route as read_archived_route
+    import table_meta
+
 API_RESOURCES = ['terminals', 'positions', 'trips', 'routes']
 
 PG_DSN = os.getenv('PG_DSN')
@@ -41,37 +66,131 @@ PG_DB = os.getenv('PGDATABASE')
 PG_USER = os.getenv('PGUSER')
 PG_PASSWORD = os.getenv('PGPASSWORD')
 ETRAC_SCHEMA = os.getenv('ETRAC_SCHEMA', 'e_track')
+# rows fetched per round-trip by the server-side cursor of streamed responses
+STREAM_CHUNK = int(os.getenv('ETRAC_STREAM_CHUNK', '2000'))
+
+# fields of /api/positions and their array names in layout=columnar
+POSITION_FIELDS = ('placa', 'data_transmissao', 'latitude', 'longitude', 'velocidade', 'ignicao', 'raw')
+COLUMNAR_KEYS = {'placa': 'placa', 'data_transmissao': 'ts', 'latitude': 'lat', 'longitude': 'lon',
+                 'velocidade': 'vel', 'ignicao': 'ign', 'raw': 'raw'}
+COLUMNAR_DEFAULT_FIELDS = ('data_transmissao', 'latitude', 'longitude', 'velocidade')
+POSITION_LAYOUTS = ('objects', 'columnar')
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+# connection pool of the web UI: up to POOL_MAX connections, POOL_MIN of them kept open
+# while idle; a request waits up to POOL_TIMEOUT seconds for a free one (then 503)
+POOL_MIN = int(os.getenv('ETRAC_WEB_POOL_MIN', '2'))
+POOL_MAX = int(os.getenv('ETRAC_WEB_POOL_MAX', '10'))
+POOL_TIMEOUT = float(os.getenv('ETRAC_WEB_POOL_TIMEOUT', '10'))
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_MAX)
+_pool_stats = {'checkouts': 0, 'timeouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
 
 
 app = Flask(__name__)
 
 
-def pg_connect():
-    logger.debug('Connecting to Postgres: host=%s port=%s dbname=%s user=%s', PG_HOST, PG_PORT, PG_DB, PG_USER)
+def pg_connect_kwargs():
+    """psycopg2.connect arguments; search_path is set at connection startup."""
+    options = f'-c search_path={ETRAC_SCHEMA},public'
+    if PG_DSN:
+        return {'dsn': PG_DSN, 'options': options}
+    missing = []
+    if not PG_DB:
+        missing.append('PGDATABASE')
+    if not PG_USER:
+        missing.append('PGUSER')
+    if not PG_PASSWORD:
+        missing.append('PGPASSWORD')
+    if missing:
+        logger.error('Missing Postgres configuration: %s', missing)
+        raise RuntimeError(f'Missing Postgres configuration: {missing}')
+    return {'host': PG_HOST, 'port': PG_PORT, 'dbname': PG_DB, 'user': PG_USER, 'password': PG_PASSWORD, 'options': options}
+
+
+def get_pool():
+    """Process-wide connection pool, created on first use (after a gunicorn fork)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                logger.debug('Creating Postgres pool: host=%s port=%s dbname=%s user=%s max=%d', PG_HOST, PG_PORT, PG_DB, PG_USER, POOL_MAX)
+                try:
+                    _pool = psycopg2.pool.ThreadedConnectionPool(POOL_MIN, POOL_MAX, **pg_connect_kwargs())
+                except Exception:
+                    logger.exception('Failed to connect to Postgres')
+                    raise
+                logger.info('Connected to Postgres %s:%s/%s (pool of up to %d connections)', PG_HOST, PG_PORT, PG_DB, POOL_MAX)
+    return _pool
+
+
+def checkout():
+    """Take a connection from the pool, waiting up to POOL_TIMEOUT seconds for a free one."""
+    pool = get_pool()
+    started = time.monotonic()
+    if not _pool_slots.acquire(timeout=POOL_TIMEOUT):
+        with _pool_lock:
+            _pool_stats['timeouts'] += 1
+        abort(503, description='database pool exhausted')
+    waited = time.monotonic() - started
     try:
-        if PG_DSN:
-            conn = psycopg2.connect(PG_DSN)
-        else:
-            missing = []
-            if not PG_DB:
-                missing.append('PGDATABASE')
-            if not PG_USER:
-                missing.append('PGUSER')
-            if not PG_PASSWORD:
-                missing.append('PGPASSWORD')
-            if missing:
-                logger.error('Missing Postgres configuration: %s', missing)
-                raise RuntimeError(f'Missing Postgres configuration: {missing}')
-            conn = psycopg2.connect(host=PG_HOST, port=PG_PORT, dbname=PG_DB, user=PG_USER, password=PG_PASSWORD)
-        # quick sanity check
-        cur = conn.cursor()
-        cur.execute('SELECT 1')
-        cur.close()
-        logger.info('Successfully connected to Postgres %s:%s/%s', PG_HOST, PG_PORT, PG_DB)
-        return conn
+        conn = pool.getconn()
+        if conn.closed:
+            # server restarted or the connection dropped while idle
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
     except Exception:
+        _pool_slots.release()
         logger.exception('Failed to connect to Postgres')
         raise
+    with _pool_lock:
+        _pool_stats['checkouts'] += 1
+        _pool_stats['wait_seconds'] += waited
+        _pool_stats['max_wait_seconds'] = max(_pool_stats['max_wait_seconds'], waited)
+    return conn
+
+
+def release(conn):
+    """Return a connection to the pool (the pool rolls back an open transaction,
+    broken connections are discarded)."""
+    try:
+        get_pool().putconn(conn, close=bool(conn.closed))
+    finally:
+        _pool_slots.release()
+
+
+def pg_connect():
+    """Pooled connection of the current request, returned by the app-context teardown."""
+    if 'db_conn' not in g:
+        g.db_conn = checkout()
+    return g.db_conn
+
+
+@app.teardown_appcontext
+def release_request_connection(exc):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        release(conn)
+
+
+def pool_stats():
+    """Pool size and utilization counters since start."""
+    with _pool_lock:
+        out = dict(_pool_stats)
+    pool = _pool
+    out.update({'min': POOL_MIN, 'max': POOL_MAX,
+                'in_use': len(pool._used) if pool else 0, 'idle': len(pool._pool) if pool else 0})
+    out['wait_seconds'] = round(out['wait_seconds'], 3)
+    out['max_wait_seconds'] = round(out['max_wait_seconds'], 3)
+    return out
+
+
+@app.route('/api/pool')
+def api_pool():
+    return pool_stats()
 
 
 def get_candidates(resource):
@@ -84,7 +203,7 @@ def get_candidates(resource):
         'terminals': ['placa', 'descricao', 'frota', 'equipamento_serial', 'data_gravacao', 'data_atualizacao'],
         'positions': ['data_transmissao', 'latitude', 'longitude', 'velocidade', 'ignicao', 'logradouro', 'equipamento_serial', 'created_at'],
         'trips': ['placa', 'cliente', 'data_inicio_conducao', 'data_fim_conducao', 'distancia_conducao', 'condutor_nome', 'created_at'],
-        'routes': ['placa', 'rota_date', 'point_count', 'start_ts', 'end_ts', 'created_at'],
+        'routes': ['placa', 'rota_date', 'point_count', 'distance_km', 'moving_seconds', 'stop_count', 'start_ts', 'end_ts', 'created_at'],
     }
     return mapping.get(resource, ['id'])
 
@@ -94,31 +213,124 @@ def index():
     return f"<h1>e-track Data Browser</h1><ul>" + "".join(f"<li><a href='/db/{r}'>{r}</a></li>" for r in API_RESOURCES) + "</ul>"
 
 
+# keyset order of /db/<resource>, newest first; the last column must be unique and NOT NULL.
+# positions is listed by id (insertion order): data_transmissao only has a BRIN index,
+# which cannot return rows in order
+LIST_ORDER = {
+    'terminals': ('placa',),
+    'positions': ('id',),
+    'trips': ('id',),
+    'routes': ('placa', 'rota_date'),
+}
+
+
+def encode_page_token(row, keys):
+    """Opaque token with the listing key of `row`."""
+    values = [v.isoformat() if isinstance(v, (datetime, date)) else v for v in (row.get(k) for k in keys)]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+# token values are bound against the key columns; these bounds keep a forged
+# token from turning into a Postgres error (500) instead of a 400
+_INT_BOUNDS = {'smallint': 2 ** 15, 'integer': 2 ** 31, 'bigint': 2 ** 63}
+
+
+def _token_value_ok(value, typ):
+    """Whether a decoded token value fits a column of type `typ` (as format_type prints it)."""
+    if isinstance(value, bool):
+        return False
+    if typ in _INT_BOUNDS:
+        return isinstance(value, int) and -_INT_BOUNDS[typ] <= value < _INT_BOUNDS[typ]
+    if typ.startswith(('timestamp', 'date')):
+        try:
+            datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return False
+        return True
+    if typ in ('double precision', 'real') or typ.startswith('numeric'):
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    return isinstance(value, str)
+
+
+def decode_page_token(token, keys, types):
+    """Key values of a token from encode_page_token, or None when it is not
+    valid: malformed, or a value of the wrong type for its column in `types`
+    ({column: type}). Only the last key is never NULL."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except Exception:
+        return None
+    if not isinstance(values, list) or len(values) != len(keys):
+        return None
+    for i, (k, v) in enumerate(zip(keys, values)):
+        if v is None and i < len(keys) - 1:
+            continue
+        if v is None or not _token_value_ok(v, types.get(k, 'text')):
+            return None
+    return values
+
+
+def keyset_clause(keys, values, forward):
+    """Condition for the rows after (`forward`) or before `values` in the
+    order `keys` DESC (NULLs of the first key come first, as in a backward
+    index scan). Timestamps travel as ISO strings and Postgres casts them."""
+    op = sql.SQL('<' if forward else '>')
+    idents = [sql.Identifier(k) for k in keys]
+    if len(keys) == 1:
+        return sql.SQL('{} {} %s').format(idents[0], op), list(values)
+    first, last = idents
+    value, key = values
+    if value is None:
+        if forward:
+            return sql.SQL('({} IS NOT NULL OR {} < %s)').format(first, last), [key]
+        return sql.SQL('({} IS NULL AND {} > %s)').format(first, last), [key]
+    if forward:
+        return sql.SQL('({}, {}) < (%s, %s)').format(first, last), [value, key]
+    return sql.SQL('(({}, {}) > (%s, %s) OR {} IS NULL)').format(first, last, first), [value, key]
+
+
+def estimate_rows(cur, table, exact=False):
+    """(rows, exact): planner estimate from pg_class.reltuples summed over the
+    partitions, or count(*) when `exact` or the table was never analyzed."""
+    if not exact:
+        # leaf partitions of a partitioned table, or the plain table itself
+        cur.execute("""SELECT sum(greatest(c.reltuples, 0))::bigint AS n, bool_or(c.reltuples < 0) AS unknown
+                         FROM pg_class c
+                        WHERE c.oid IN (SELECT relid FROM pg_partition_tree(to_regclass(%(t)s)) WHERE isleaf)
+                           OR (c.oid = to_regclass(%(t)s) AND c.relkind = 'r')""", {'t': table.as_string(cur)})
+        row = cur.fetchone()
+        if row and row['n'] is not None and not row['unknown']:
+            return row['n'], False
+    cur.execute(sql.SQL('SELECT COUNT(*) AS cnt FROM {}').format(table))
+    return cur.fetchone()['cnt'], True
+
+
 @app.route('/db/<resource>')
 def list_resource(resource):
+    """Paginated list with keyset pagination: ?after=<token> / ?before=<token> from
+    the Next/Prev links, ?page_size=20, ?exact=1 for an exact total (estimated otherwise)."""
     if resource not in API_RESOURCES:
         abort(404)
-    try:
-        page = max(1, int(request.args.get('page', '1')))
-    except ValueError:
-        page = 1
     try:
         page_size = min(200, max(1, int(request.args.get('page_size', '20'))))
     except ValueError:
         page_size = 20
-    offset = (page - 1) * page_size
-
+    exact = request.args.get('exact') == '1'
     conn = pg_connect()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
+    # columns and primary key come from the process-level cache (see table_meta)
+    meta = table_meta.get(conn, ETRAC_SCHEMA, resource)
+    db_cols = meta.columns if meta else {}
+    keys = LIST_ORDER.get(resource) or (meta.primary_key if meta and meta.primary_key else ('id',))
+    token = request.args.get('after') or request.args.get('before')
+    forward = not request.args.get('before')
+    values = decode_page_token(token, keys, db_cols) if token else None
+    if token and values is None:
+        return {'error': 'invalid page token'}, 400
+
     candidates = get_candidates(resource)
     cols = []
-    # check which columns exist in the table
-    try:
-        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s", (ETRAC_SCHEMA, resource))
-        db_cols = {r['column_name'] for r in cur.fetchall()}
-    except Exception:
-        db_cols = set()
 
     for c in candidates:
         if c in db_cols:
@@ -127,22 +339,33 @@ def list_resource(resource):
     # always include raw JSON if exists
     if 'raw' in db_cols:
         cols.append('raw')
-    # assemble select
-    select_cols = ', '.join(cols) if cols else '*'
+    # assemble select; the listing key is needed for the page tokens, the detail key for the links
+    link_key = detail_key(meta) if meta else 'id'
+    extra = [k for k in dict.fromkeys(keys + (link_key,)) if k not in cols]
+    select_cols = [sql.Identifier(c) for c in cols + extra]
     # use schema-qualified table name
     table_ident = sql.Identifier(ETRAC_SCHEMA, resource)
-    # execute safe query
-    q = sql.SQL("SELECT {fields} FROM {table} ORDER BY {order} DESC LIMIT %s OFFSET %s").format(
-        fields=sql.SQL(select_cols), table=table_ident, order=sql.Identifier(cols[0] if cols else 'id')
+    direction = sql.SQL('DESC' if forward else 'ASC')
+    where, params = keyset_clause(keys, values, forward) if values else (sql.SQL('TRUE'), [])
+    # execute safe query; one extra row tells whether there is a further page
+    q = sql.SQL("SELECT {fields} FROM {table} WHERE {where} ORDER BY {order} LIMIT %s").format(
+        fields=sql.SQL(', ').join(select_cols), table=table_ident, where=where,
+        order=sql.SQL(', ').join(sql.SQL('{} {}').format(sql.Identifier(k), direction) for k in keys)
     )
-    cur.execute(q, (page_size, offset))
+    cur.execute(q, params + [page_size + 1])
     rows = cur.fetchall()
-    cur.execute(sql.SQL("SELECT COUNT(*) as cnt FROM {table}").format(table=table_ident))
-    total = cur.fetchone()['cnt']
-    conn.close()
-
-    prev_link = f"/db/{resource}?page={page-1}&page_size={page_size}" if page > 1 else ''
-    next_link = f"/db/{resource}?page={page+1}&page_size={page_size}" if offset + page_size < total else ''
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not forward:
+        rows.reverse()
+    total, total_exact = estimate_rows(cur, table_ident, exact)
+
+    base_link = f"/db/{resource}?page_size={page_size}" + ('&exact=1' if exact else '')
+    has_prev = (more if not forward else bool(values)) and rows
+    has_next = (more if forward else True) and rows
+    prev_link = f"{base_link}&before={encode_page_token(rows[0], keys)}" if has_prev else ''
+    next_link = f"{base_link}&after={encode_page_token(rows[-1], keys)}" if has_next else ''
+    total_html = f"{total}" if total_exact else f"~{total} (<a href='/db/{resource}?page_size={page_size}&exact=1'>exact</a>)"
 
     # helper to convert row values (datetimes) into JSON-serializable equivalents
     def row_to_jsonable(row):
@@ -156,7 +379,7 @@ def list_resource(resource):
 
     rows_html = []
     for r in rows:
-        rid = escape(str(r.get('id') or r.get('placa') or ''))
+        rid = escape(str(r.get(link_key) or ''))
         try:
             preview = escape(json.dumps(row_to_jsonable(r), ensure_ascii=False))[:300]
         except Exception:
@@ -187,13 +410,13 @@ def list_resource(resource):
     html = f"""
     <html>
       <head>
-        <title>{resource} — page {page}</title>
+        <title>{resource}</title>
         <style>table{{width:100%;border-collapse:collapse}}td,th{{border:1px solid #ddd;padding:8px;vertical-align:top}}</style>
       </head>
       <body>
-        <h2>{resource} (total: {total})</h2>
-        <p>Page {page} — Page size {page_size}</p>
-        <p>{f'<a href="{prev_link}">Prev</a>' if prev_link else ''} {f'<a href="{next_link}">Next</a>' if next_link else ''}</p>
+        <h2>{resource} (total: {total_html})</h2>
+        <p>Page size {page_size} — ordered by {', '.join(keys)} (descending)</p>
+        <p><a href="/db/{resource}?page_size={page_size}">First</a> {f'<a href="{prev_link}">Prev</a>' if prev_link else ''} {f'<a href="{next_link}">Next</a>' if next_link else ''}</p>
         <table>
           <thead>
             <tr>
@@ -212,20 +435,31 @@ def list_resource(resource):
     return html
 
 
+def detail_key(meta):
+    """Column the detail page looks rows up by: the primary key (partitioned
+    positions has none: id is indexed), else id, else placa."""
+    if len(meta.primary_key) == 1:
+        return meta.primary_key[0]
+    return 'id' if 'id' in meta.columns else 'placa'
+
+
 @app.route('/db/<resource>/<row_id>')
 def show_resource(resource, row_id):
     if resource not in API_RESOURCES:
         abort(404)
     conn = pg_connect()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s", (ETRAC_SCHEMA, resource))
-    db_cols = {r['column_name'] for r in cur.fetchall()}
+    meta = table_meta.get(conn, ETRAC_SCHEMA, resource)
+    if not meta:
+        abort(404)
+    key = detail_key(meta)
+    if meta.columns.get(key) in ('bigint', 'integer', 'smallint') and not row_id.isdigit():
+        abort(404)
 
     # select all columns for this row
     table_ident = sql.Identifier(ETRAC_SCHEMA, resource)
-    cur.execute(sql.SQL("SELECT * FROM {table} WHERE (id::text = %s OR placa = %s) LIMIT 1").format(table=table_ident), (row_id, row_id))
+    cur.execute(sql.SQL("SELECT * FROM {table} WHERE {key} = %s LIMIT 1").format(table=table_ident, key=sql.Identifier(key)), (row_id,))
     row = cur.fetchone()
-    conn.close()
     if not row:
         abort(404)
     # convert datetimes for JSON pretty output
@@ -264,6 +498,11 @@ def api_positions_plate(plate):
             - date=DD/MM/YYYY  -> full day
             - start=YYYY-mm-ddTHH:MM:SS or DD/MM/YYYY HH:MM:SS
             - end=... (same formats)
+            - stream=1 (or Accept: application/x-ndjson) -> one JSON object per line, read
+              through a server-side cursor in ETRAC_STREAM_CHUNK rows (flat memory for any range)
+            - fields=data_transmissao,latitude,... -> only these fields (and columns read); default all
+            - layout=columnar -> parallel arrays ts[] (epoch seconds), lat[], lon[], vel[], ... instead
+              of one object per position; default fields data_transmissao,latitude,longitude,velocidade
         """
         date = request.args.get('date')
         start = request.args.get('start')
@@ -293,8 +532,20 @@ def api_positions_plate(plate):
                 start_dt = parse_dt(start) if start else None
                 end_dt = parse_dt(end) if end else None
 
-        conn = pg_connect()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        stream = request.args.get('stream') == '1' or \
+                request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+        layout = request.args.get('layout') or 'objects'
+        if layout not in POSITION_LAYOUTS:
+                return {'error': f'layout must be one of {", ".join(POSITION_LAYOUTS)}'}, 400
+        if layout == 'columnar' and stream:
+                return {'error': 'layout=columnar cannot be streamed'}, 400
+        if request.args.get('fields'):
+                fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+                unknown = [f for f in fields if f not in POSITION_FIELDS]
+                if unknown or not fields:
+                        return {'error': f'fields must be among {", ".join(POSITION_FIELDS)}'}, 400
+        else:
+                fields = list(COLUMNAR_DEFAULT_FIELDS if layout == 'columnar' else POSITION_FIELDS)
         table_ident = sql.Identifier(ETRAC_SCHEMA, 'positions')
         params = [plate]
         where = sql.SQL('placa = %s')
@@ -308,34 +559,108 @@ def api_positions_plate(plate):
                 where = sql.SQL('placa = %s AND data_transmissao <= %s')
                 params = [plate, end_dt]
 
-        q = sql.SQL('SELECT placa, data_transmissao, latitude, longitude, velocidade, ignicao, raw FROM {table} WHERE {where} ORDER BY data_transmissao ASC').format(
-                table=table_ident, where=where
+        # only the requested columns are read (without raw, the covering index serves the query);
+        # the time and coordinates are always needed to merge archived positions
+        columns = [sql.Identifier(c) for c in dict.fromkeys(fields + ['data_transmissao', 'latitude', 'longitude']) if c != 'raw']
+        join = sql.SQL('')
+        if 'raw' in fields:
+                # raw kept in 'hashed' mode lives in raw_payloads (see raw_store.py)
+                columns.append(sql.SQL('coalesce(p.raw, rp.payload) AS raw'))
+                join = sql.SQL('LEFT JOIN {} rp ON rp.hash = p.raw_hash').format(sql.Identifier(ETRAC_SCHEMA, 'raw_payloads'))
+        q = sql.SQL('SELECT {columns} FROM {table} p {join} WHERE {where} ORDER BY data_transmissao ASC').format(
+                columns=sql.SQL(', ').join(columns), table=table_ident, join=join, where=where
         )
-        cur.execute(q, tuple(params))
-        rows = cur.fetchall()
-        conn.close()
-        # convert datetimes to isoformat
-        out = []
-        for r in rows:
-                out.append({
-                        'placa': r.get('placa'),
-                        'data_transmissao': r.get('data_transmissao').isoformat() if r.get('data_transmissao') else None,
-                        'latitude': r.get('latitude'),
-                        'longitude': r.get('longitude'),
-                        'velocidade': r.get('velocidade'),
-                        'ignicao': r.get('ignicao'),
-                        'raw': r.get('raw')
-                })
-        return {'positions': out}
+        # closed months moved out of Postgres by archive.py are served from their files
+        archived = iter_archived_positions(plate, start_dt, end_dt)
+        if not stream:
+                cur = pg_connect().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                cur.execute(q, tuple(params))
+                rows = cur.fetchall()
+                if layout == 'columnar':
+                        return positions_columnar(merge_positions(rows, archived), fields)
+                return {'positions': [position_json(r, fields) for r in merge_positions(rows, archived)]}
+
+        # the body is produced after the request context is gone: the connection
+        # is checked out for the response and returned when the server closes it
+        conn = checkout()
+        try:
+                # named cursor: the rows stay on the server and arrive STREAM_CHUNK at a time
+                cur = conn.cursor(name='positions_stream', cursor_factory=psycopg2.extras.RealDictCursor)
+                cur.itersize = STREAM_CHUNK
+                cur.execute(q, tuple(params))
+        except Exception:
+                release(conn)
+                raise
+
+        def generate():
+                for r in merge_positions(cur, archived):
+                        yield json.dumps(position_json(r, fields), default=str) + '\n'
+        response = Response(generate(), mimetype='application/x-ndjson')
+        response.call_on_close(lambda: release(conn))
+        return response
+
+
+def merge_positions(rows, archived):
+    """Merge positions from Postgres with archived ones, both ordered by
+    data_transmissao (NULLs last), dropping archived rows still in Postgres."""
+    def parsed(it):
+        for a in it:
+            a['data_transmissao'] = datetime.fromisoformat(a['data_transmissao']) if a.get('data_transmissao') else None
+            yield a
+    seen, seen_ts = set(), None
+    for r in heapq.merge(rows, parsed(archived), key=lambda r: r.get('data_transmissao') or datetime.max):
+        ts = r.get('data_transmissao')
+        if ts is not None:
+            if ts != seen_ts:
+                seen, seen_ts = set(), ts
+            key = (r.get('latitude'), r.get('longitude'))
+            if key in seen:
+                continue
+            seen.add(key)
+        yield r
+
+
+def position_json(r, fields=POSITION_FIELDS):
+    out = {f: r.get(f) for f in fields}
+    if out.get('data_transmissao'):
+        out['data_transmissao'] = out['data_transmissao'].isoformat()
+    return out
+
+
+def positions_columnar(rows, fields):
+    """Parallel arrays per field (see COLUMNAR_KEYS): timestamps as epoch
+    seconds, coordinates rounded to 6 decimals like route_codec."""
+    rows = list(rows)
+    out = {'layout': 'columnar', 'n': len(rows)}
+    for f in fields:
+        values = [r.get(f) for r in rows]
+        if f == 'data_transmissao':
+            values = [None if v is None else (v - _EPOCH) // _SECOND for v in values]
+        elif f in ('latitude', 'longitude'):
+            values = [None if v is None else round(v, 6) for v in values]
+        out[COLUMNAR_KEYS[f]] = values
+    return out
 
 
 @app.route('/api/routes/<plate>')
 def api_routes_plate(plate):
     """Return stored routes for a plate. Query params:
         - date=DD/MM/YYYY or YYYY-mm-dd -> return single route points
+        - tolerance=<meters> or zoom=<map zoom>[&lat=<map latitude>] -> simplified route (default: full resolution)
+        - format=points|columnar|polyline -> encoding of the returned route (see route_codec; default points)
+          the single-route response also carries `metrics` (distance, moving/idle time, stops; see route_metrics)
         - no date -> return available rota_date list for plate
     """
     date = request.args.get('date')
+    try:
+        tolerance = float(request.args['tolerance']) if request.args.get('tolerance') else None
+        zoom = float(request.args['zoom']) if request.args.get('zoom') else None
+        lat = float(request.args.get('lat') or -23.55)
+    except ValueError:
+        return {'error': 'tolerance, zoom and lat must be numbers'}, 400
+    fmt = request.args.get('format') or 'points'
+    if fmt not in ROUTE_FORMATS:
+        return {'error': f'format must be one of {", ".join(ROUTE_FORMATS)}'}, 400
     # parse simple date formats
     def parse_date_str(s):
         if not s:
@@ -356,44 +681,61 @@ def api_routes_plate(plate):
     if date:
         d = parse_date_str(date)
         if not d:
-            conn.close()
             return {'error': 'invalid date format, use DD/MM/YYYY or YYYY-mm-dd'}, 400
-        cur.execute(sql.SQL('SELECT points, point_count, start_ts, end_ts FROM {table} WHERE placa = %s AND rota_date = %s LIMIT 1').format(table=table_ident), (plate, d))
+        if tolerance is None and zoom is not None:
+            tolerance = tolerance_for_zoom(zoom, lat=lat)
+        level = level_key(tolerance) if tolerance is not None else None
+        # with a level, the full points are only read when that level was not stored
+        route_query = sql.SQL('SELECT simplified -> %(level)s AS simplified, '
+                              'CASE WHEN %(level)s IS NULL OR simplified -> %(level)s IS NULL THEN points END AS points, '
+                              'point_count, start_ts, end_ts, {metrics} FROM {table} WHERE placa = %(plate)s AND rota_date = %(day)s LIMIT 1').format(
+                                  table=table_ident, metrics=sql.SQL(', ').join(map(sql.Identifier, ROUTE_METRICS)))
+        route_params = {'level': level, 'plate': plate, 'day': d}
+        cur.execute(route_query, route_params)
         row = cur.fetchone()
+        archived = None if row else read_archived_route(plate, d)
+        if archived:
+            # route of a month moved to files by archive.py: same shape as route_query
+            row = {k: archived.get(k) for k in ('point_count', *ROUTE_METRICS)}
+            row['simplified'] = (archived.get('simplified') or {}).get(level) if level else None
+            row['points'] = archived.get('points')
+            for k in ('start_ts', 'end_ts'):
+                row[k] = datetime.fromisoformat(archived[k]) if archived.get(k) else None
         # if route missing or sparse, attempt to refresh by calling collector (fetch history + compute route)
         MIN_POINTS = 3
-        if (not row) or (row.get('point_count') is None) or (row.get('point_count') < MIN_POINTS):
-            # try to run collector to fetch history and recompute route for this plate/date
+        if not archived and ((not row) or (row.get('point_count') is None) or (row.get('point_count') < MIN_POINTS)):
+            # fetch history and recompute the route in-process, reusing the shared HTTP session
             try:
-                # detect python executable in repo venv (WSL/linux style), fallback to system python
-                python_exe = os.path.join(repo_root, '.venv', 'bin', 'python')
-                if not os.path.exists(python_exe):
-                    python_exe = os.path.join(repo_root, '.venv', 'Scripts', 'python.exe')
-                if not os.path.exists(python_exe):
-                    python_exe = os.environ.get('PYTHON_EXECUTABLE') or 'python3'
-
                 date_str = d.strftime('%d/%m/%Y')
-                fetch_cmd = [python_exe, os.path.join(repo_root, 'e-track', 'collector.py'), '--fetch-history', plate, '--date', date_str]
-                compute_cmd = [python_exe, os.path.join(repo_root, 'e-track', 'collector.py'), '--compute-route-plate', plate, '--compute-route-date', date_str]
                 logger.info('Attempting on-demand refresh for route %s %s', plate, date_str)
-                # run fetch history then compute route (blocking calls)
-                subprocess.run(fetch_cmd, cwd=repo_root, timeout=120)
-                subprocess.run(compute_cmd, cwd=repo_root, timeout=120)
+                # collector SQL uses unqualified table names: pooled connections start with search_path set
+                session = get_session()
+                try:
+                    collector.fetch_terminal_history(session, conn, plate, data=date_str)
+                except Exception:
+                    logger.warning('History fetch failed for %s %s; computing from stored positions', plate, date_str)
+                # history was just fetched above: don't let the route builder fetch it again
+                collector.build_and_store_route_for_date(conn, plate, d, session=None)
                 # re-query the route
-                cur.execute(sql.SQL('SELECT points, point_count, start_ts, end_ts FROM {table} WHERE placa = %s AND rota_date = %s LIMIT 1').format(table=table_ident), (plate, d))
+                cur.execute(route_query, route_params)
                 row = cur.fetchone()
             except Exception:
                 logger.exception('On-demand route refresh failed for %s %s', plate, d)
 
-        conn.close()
         if not row:
             return {'route': None}
-        return {'route': row.get('points'), 'point_count': row.get('point_count'), 'start_ts': row.get('start_ts').isoformat() if row.get('start_ts') else None, 'end_ts': row.get('end_ts').isoformat() if row.get('end_ts') else None}
+        points = row.get('simplified')
+        if points is None:
+            points = row.get('points')
+            if level is not None and points:
+                # route stored before simplification existed: reduce it on the fly
+                points = simplify(decode_points(points), tolerance)
+        return {'route': encode_points(points, fmt), 'format': fmt, 'point_count': row.get('point_count'), 'tolerance': tolerance, 'start_ts': row.get('start_ts').isoformat() if row.get('start_ts') else None, 'end_ts': row.get('end_ts').isoformat() if row.get('end_ts') else None,
+                'metrics': {k: row.get(k) for k in ROUTE_METRICS}}
     # list available rota_dates for plate
-    cur.execute(sql.SQL('SELECT rota_date, point_count, created_at FROM {table} WHERE placa = %s ORDER BY rota_date DESC LIMIT 100').format(table=table_ident), (plate,))
+    cur.execute(sql.SQL('SELECT rota_date, point_count, distance_km, stop_count, created_at FROM {table} WHERE placa = %s ORDER BY rota_date DESC LIMIT 100').format(table=table_ident), (plate,))
     rows = cur.fetchall()
-    conn.close()
-    out = [{'rota_date': r.get('rota_date').isoformat() if r.get('rota_date') else None, 'point_count': r.get('point_count'), 'created_at': r.get('created_at').isoformat() if r.get('created_at') else None} for r in rows]
+    out = [{'rota_date': r.get('rota_date').isoformat() if r.get('rota_date') else None, 'point_count': r.get('point_count'), 'distance_km': r.get('distance_km'), 'stop_count': r.get('stop_count'), 'created_at': r.get('created_at').isoformat() if r.get('created_at') else None} for r in rows]
     return {'routes': out}
 
 
@@ -428,9 +770,12 @@ def map_view():
                 if (!plate) {
                     alert('Informe ?plate=PLACA&date=DD/MM/YYYY');
                 } else {
-                    const url = '/api/positions/' + encodeURIComponent(plate) + '?date=' + encodeURIComponent(date);
+                    const url = '/api/positions/' + encodeURIComponent(plate) + '?date=' + encodeURIComponent(date) + '&layout=columnar';
                     fetch(url).then(r=>r.json()).then(j=>{
-                        const pts = j.positions.filter(p=>p.latitude && p.longitude).map(p=>[parseFloat(p.latitude), parseFloat(p.longitude)]);
+                        const positions = j.ts.map((ts, i)=>({
+                            data_transmissao: ts === null ? null : new Date(ts * 1000).toISOString().slice(0, 19),
+                            latitude: j.lat[i], longitude: j.lon[i], velocidade: j.vel[i]}));
+                        const pts = positions.filter(p=>p.latitude && p.longitude).map(p=>[parseFloat(p.latitude), parseFloat(p.longitude)]);
                         if (pts.length===0) { alert('Nenhuma posição encontrada para a placa/data'); return; }
                         const poly = L.polyline(pts, {color:'blue'}).addTo(map);
                         map.fitBounds(poly.getBounds());
@@ -438,7 +783,7 @@ def map_view():
                         L.circleMarker(pts[0], {color:'green'}).addTo(map).bindPopup('Start');
                         L.circleMarker(pts[pts.length-1], {color:'red'}).addTo(map).bindPopup('End');
                         // add popup on each point with time/speed
-                        j.positions.forEach(p=>{
+                        positions.forEach(p=>{
                             if (p.latitude && p.longitude) {
                                 const m = L.circleMarker([parseFloat(p.latitude), parseFloat(p.longitude)], {radius:4}).addTo(map);
                                 m.bindPopup(p.data_transmissao + '<br>vel: ' + p.velocidade);
@@ -488,32 +833,43 @@ def map_route_view():
                 if (!plate || !date) {
                     alert('Informe ?plate=PLACA&date=DD/MM/YYYY');
                 } else {
-                    const url = '/api/routes/' + encodeURIComponent(plate) + '?date=' + encodeURIComponent(date);
-                    fetch(url).then(r=>r.json()).then(j=>{
+                    // the API returns the route simplified for the current zoom; reload when it changes
+                    const layer = L.layerGroup().addTo(map);
+                    let fitted = false;
+                    const load = () => {
+                        const c = map.getCenter();
+                        const url = '/api/routes/' + encodeURIComponent(plate) + '?date=' + encodeURIComponent(date)
+                            + '&zoom=' + map.getZoom() + '&lat=' + c.lat.toFixed(4);
+                        return fetch(url).then(r=>r.json()).then(j=>{
                         const route = j.route;
                         if (!route || route.length===0) { alert('Nenhuma rota encontrada para a placa/data'); return; }
                         const pts = route.filter(p=>p.lat && p.lon).map(p=>[parseFloat(p.lat), parseFloat(p.lon)]);
                         if (pts.length===0) { alert('Nenhuma posição válida na rota'); return; }
-                        const poly = L.polyline(pts, {color:'red'}).addTo(map);
-                        map.fitBounds(poly.getBounds());
+                        layer.clearLayers();
+                        const poly = L.polyline(pts, {color:'red'}).addTo(layer);
+                        // fitting changes the zoom, which reloads the route at the matching detail
+                        if (!fitted) { fitted = true; map.fitBounds(poly.getBounds()); }
                         // start and end markers with popups including timestamp, speed and address when available
                         const first = route.find(p=>p.lat && p.lon);
                         const last = [...route].reverse().find(p=>p.lat && p.lon);
                         if (first) {
-                            L.circleMarker([parseFloat(first.lat), parseFloat(first.lon)], {color:'green'}).addTo(map).bindPopup('Start: ' + first.ts + (first.vel? '<br>vel: '+first.vel:'' ) + (first.addr? '<br>'+first.addr:''));
+                            L.circleMarker([parseFloat(first.lat), parseFloat(first.lon)], {color:'green'}).addTo(layer).bindPopup('Start: ' + first.ts + (first.vel? '<br>vel: '+first.vel:'' ) + (first.addr? '<br>'+first.addr:''));
                         }
                         if (last) {
-                            L.circleMarker([parseFloat(last.lat), parseFloat(last.lon)], {color:'red'}).addTo(map).bindPopup('End: ' + last.ts + (last.vel? '<br>vel: '+last.vel:'' ) + (last.addr? '<br>'+last.addr:''));
+                            L.circleMarker([parseFloat(last.lat), parseFloat(last.lon)], {color:'red'}).addTo(layer).bindPopup('End: ' + last.ts + (last.vel? '<br>vel: '+last.vel:'' ) + (last.addr? '<br>'+last.addr:''));
                         }
-                        // markers for each point with popup (addr + ts + vel)
+                        // markers for each returned point with popup (addr + ts + vel)
                         route.forEach(p=>{
                             if (p.lat && p.lon) {
-                                const m = L.circleMarker([parseFloat(p.lat), parseFloat(p.lon)], {radius:4}).addTo(map);
+                                const m = L.circleMarker([parseFloat(p.lat), parseFloat(p.lon)], {radius:4}).addTo(layer);
                                 const popup = (p.ts || '') + (p.vel !== undefined && p.vel !== null ? '<br>vel: '+p.vel : '') + (p.addr? '<br>'+p.addr : '');
                                 m.bindPopup(popup);
                             }
                         });
-                    }).catch(err=>{ alert('Erro carregando rota: '+err); });
+                        });
+                    };
+                    map.on('zoomend', ()=>load().catch(err=>{ alert('Erro carregando rota: '+err); }));
+                    load().catch(err=>{ alert('Erro carregando rota: '+err); });
                 }
                 </script>
             </body>
@@ -13,6 +13,7 @@ repo_root = os.path.abspath(os.path.join(here, '..'))
 sys.path.insert(0, here)  # ensure we can import collector when run as `python e-track/...`
 
 import collector
+from http_session import get_session
 
 
 def main():
@@ -26,7 +27,7 @@ def main():
         return
     out = sys.argv[2]
 
-    session = collector.requests.Session()
+    session = get_session()
     plates = collector.get_all_plates(session)
     if not plates:
         print('No plates discovered')